@@ -0,0 +1,41 @@
+"""Seconds per call of the array helpers, pure Python on lists against NumPy
+on ndarrays"""
+import timeit
+
+import futile.array
+from futile.array import count_by, filter_by, partition, take_indices, unique
+
+
+def main(size=10 ** 6):
+    np = futile.array.np
+    if np is None:
+        print("NumPy is not installed")
+        return
+    ints = np.random.randint(0, size // 10, size)
+    bools = ints % 2 == 0
+    indices = np.random.randint(-size, size * 2, size)
+    # lists are never handed to NumPy, they time the pure-Python path
+    inputs = dict(python=(ints.tolist(), bools.tolist(), indices.tolist()))
+    inputs["numpy"] = (ints, bools, indices)
+    cases = [
+        ("unique", lambda ints, bools, indices: list(unique(ints))),
+        ("count_by", lambda ints, bools, indices: count_by(ints)),
+        ("partition", lambda ints, bools, indices: partition(ints)),
+        ("filter_by", lambda ints, bools, indices: list(filter_by(ints, bools))),
+        (
+            "take_indices",
+            lambda ints, bools, indices: list(take_indices(ints, indices)),
+        ),
+    ]
+    print("%d ints, seconds per call" % size)
+    print("%-14s %8s %8s" % ("", "python", "numpy"))
+    for name, case in cases:
+        python, accelerated = (
+            min(timeit.repeat(lambda: case(*inputs[path]), number=1, repeat=3))
+            for path in ("python", "numpy")
+        )
+        print("%-14s %8.3f %8.3f" % (name, python, accelerated))
+
+
+if __name__ == "__main__":
+    main()
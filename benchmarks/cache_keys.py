@@ -0,0 +1,36 @@
+"""Nanoseconds per cache hit of lru_cache, building and hashing keys is most
+of their cost"""
+import timeit
+
+from futile.cache import lru_cache
+
+
+@lru_cache(100)
+def func(a, b=1, *, c=None):
+    pass
+
+
+@lru_cache(100)
+def pair(a, b):
+    pass
+
+
+@lru_cache(100)
+def single(a):
+    pass
+
+
+def main(n=1000000):
+    cases = [
+        ("func(1, b=2, c=3)", lambda: func(1, b=2, c=3)),
+        ("pair(1, 2)", lambda: pair(1, 2)),
+        ("single(1)", lambda: single(1)),
+    ]
+    for name, case in cases:
+        case()
+        seconds = min(timeit.repeat(case, number=n, repeat=5))
+        print("%-20s %6.0f ns/call" % (name, seconds / n * 1e9))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Points per second from emit_counter to the emitter process of metrics,
+one dict per put against blocks packed by _PointBuffer"""
+import multiprocessing as mp
+import time
+
+from futile.metrics import MetricsEmitter, _PointBuffer
+from futile.queues import queue_mget
+
+
+def _drain_points(q, n, done):
+    received = 0
+    while received < n:
+        q.get()
+        received += 1
+    done.set()
+
+
+def _drain_blocks(q, n, done):
+    emitter = MetricsEmitter(None, "benchmark")
+    getters = dict(counter=emitter.get_counter_point)
+    received = 0
+    while received < n:
+        blocks = [q.get()]
+        blocks.extend(queue_mget(q, 63, return_when="any", timeout=0))
+        for block in blocks:
+            for kind, args, kwargs in block:
+                getters[kind](*args, **kwargs)
+            received += len(block)
+    done.set()
+
+
+def main(n=200000):
+    emitter = MetricsEmitter(None, "benchmark")
+    tags = {"code": 200}
+
+    def put_points(q):
+        for _ in range(n):
+            q.put(emitter.get_counter_point("requests", 1, tags=tags))
+
+    def put_blocks(q):
+        buffer = _PointBuffer(q)
+        for _ in range(n):
+            buffer.add("counter", ("requests", 1), {"tags": tags})
+        buffer.flush()
+
+    cases = [
+        ("one dict per put", put_points, _drain_points),
+        ("packed blocks", put_blocks, _drain_blocks),
+    ]
+    for name, produce, drain in cases:
+        q = mp.Queue()
+        done = mp.Event()
+        consumer = mp.Process(target=drain, args=(q, n, done))
+        consumer.start()
+        start = time.perf_counter()
+        produce(q)
+        produced = time.perf_counter() - start
+        done.wait()
+        elapsed = time.perf_counter() - start
+        consumer.join()
+        print(
+            "%-18s produce %9.0f points/s, end to end %9.0f points/s"
+            % (name, n / produced, n / elapsed)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -5,7 +5,9 @@
 __all__ = [
     "identity",
     "chunked",
+    "chunked_file",
     "chunked_qs",
+    "keyset_chunked_qs",
     "compact",
     "compact_dict",
     "fill",
@@ -29,20 +31,81 @@ __all__ = [
     "take_indices",
     "safe_zip",
     "filter_by",
+    "parallel_map",
+    "parallel_imap_unordered",
+    "parallel_reduce",
+    "ParallelMapError",
+    "windowed",
+    "tumbling_window",
+    "sliding_window",
+    "CountAggregator",
+    "SumAggregator",
+    "ApproxDistinctAggregator",
+    "TopKAggregator",
 ]
 
+import array as pyarray
 import collections
+import concurrent.futures
 import itertools
 import functools
+import heapq
+import math
+import mmap
+import os
+import pickle
+import queue
+import tempfile
+import threading
 from datetime import timedelta
 from typing import Iterable
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# converting a shorter list to an ndarray costs more than it saves
+_NUMPY_MIN_SIZE = 1024
+
 
 def identity(obj):
     return obj
 
 
-def chunked(chunk_size, iterable, len_func=len):
+def _numeric_array(sequence):
+    """
+    Return sequence as a 1-d numeric ndarray if NumPy can handle it without
+    changing any value, None otherwise.
+
+    ndarrays are used as they are, long array.arrays without a copy. Lists are
+    not converted, checking and converting them costs about as much as the
+    pure-Python loops.
+    """
+    if np is None:
+        return None
+    if isinstance(sequence, np.ndarray):
+        if sequence.ndim == 1 and sequence.dtype.kind in "biuf":
+            return sequence
+        return None
+    if isinstance(sequence, pyarray.array) and len(sequence) >= _NUMPY_MIN_SIZE:
+        return np.asarray(sequence) if sequence.typecode != "u" else None
+    return None
+
+
+def _has_nan(arr):
+    # nan != nan, a set keeps every nan while np.unique merges them
+    return arr.dtype.kind == "f" and bool(np.isnan(arr).any())
+
+
+def _to_list(values, source):
+    """Elements of values as iterating source would give them"""
+    if isinstance(source, np.ndarray):
+        return list(values)
+    return values.tolist()
+
+
+def chunked(chunk_size, iterable, len_func=len, zero_copy=False):
     """
     数组切片，每个切片的大小是 chunk_size
 
@@ -56,7 +119,26 @@ def chunked(chunk_size, iterable, len_func=len):
     [[0, 1], [2, 3], [4]]
     >>> list(chunked(2, (i for i in range(4))))
     [[0, 1], [2, 3]]
+
+    ndarrays are sliced into views, the chunks are not copies.
+
+    With zero_copy, objects supporting the buffer protocol, e.g. bytes,
+    bytearray or array.array, are sliced into memoryviews instead of copies.
+    chunk_size counts items, or bytes for multi-dimensional buffers.
+
+    >>> [bytes(c) for c in chunked(2, b'abcde', zero_copy=True)]
+    [b'ab', b'cd', b'e']
     """
+    if zero_copy:
+        try:
+            view = memoryview(iterable)
+        except TypeError:
+            pass
+        else:
+            if view.ndim != 1:
+                view = view.cast("B")
+            yield from _chunked_view(chunk_size, view)
+            return
     if hasattr(iterable, "__getitem__"):
         for i in range(0, len_func(iterable), chunk_size):
             yield iterable[i : i + chunk_size]
@@ -74,11 +156,137 @@ def chunked(chunk_size, iterable, len_func=len):
             yield chunk  # yield the last uncomplete chunk
 
 
+def _chunked_view(chunk_size, view):
+    for i in range(0, len(view), chunk_size):
+        yield view[i : i + chunk_size]
+
+
+def chunked_file(chunk_size, file):
+    """
+    Split a file into memoryviews of chunk_size bytes, backed by a read-only mmap
+
+    Pages are read by the kernel when a chunk is used, and can be dropped once
+    it is not, so memory usage does not grow with the size of the file. file is
+    a path or a file object opened in binary mode.
+    """
+    if isinstance(file, (str, bytes, os.PathLike)):
+        with open(file, "rb") as f:
+            yield from chunked_file(chunk_size, f)
+        return
+    if os.fstat(file.fileno()).st_size == 0:
+        # an empty file can not be mapped
+        return
+    mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        yield from _chunked_view(chunk_size, memoryview(mapped))
+    finally:
+        try:
+            mapped.close()
+        except BufferError:
+            # chunks are still referenced, the mmap is closed once they are not
+            pass
+
+
 def chunked_qs(chunk_size, query_set):
     """
     Django QuerySet 切片
+
+    Every chunk is an OFFSET query, prefer keyset_chunked_qs on large tables.
+    """
+    return chunked(chunk_size, query_set, lambda qs: qs.count())
+
+
+def keyset_chunked_qs(chunk_size, query_set, *, key="pk", prefetch=False):
+    """
+    Django QuerySet 切片, by key ranges instead of offsets
+
+    Chunks are fetched ordered by key with `WHERE key > <last key>` and a
+    LIMIT, like sql.MysqlDatabase.iter_select, so every chunk costs the same
+    on a large table, while OFFSET queries get slower the further they go.
+    key must be unique, elements are model instances, or values() dicts
+    including key.
+
+    With prefetch, the next chunk is fetched in a thread, with its own
+    database connection, while the current one is being processed.
     """
-    return chunked(query_set, chunk_size, lambda qs: qs.count())
+    if key == "pk":
+        # values() dicts hold the primary key by its column attribute name
+        attname = query_set.model._meta.pk.attname
+    else:
+        attname = key
+
+    def last_key(row):
+        if isinstance(row, dict):
+            return row[attname] if attname in row else row[key]
+        return getattr(row, key)
+
+    def chunks():
+        qs = query_set.order_by(key)
+        last = None
+        while True:
+            page = qs if last is None else qs.filter(**{key + "__gt": last})
+            chunk = list(page[:chunk_size])
+            if not chunk:
+                return
+            yield chunk
+            if len(chunk) < chunk_size:
+                return
+            last = last_key(chunk[-1])
+
+    if prefetch:
+        return _prefetched(chunks(), _close_db_connections)
+    return chunks()
+
+
+def _close_db_connections():
+    try:
+        from django.conf import settings
+        from django.db import connections
+    except ImportError:
+        return
+
+    if not settings.configured:
+        return
+    # only closes the connections of the calling thread
+    connections.close_all()
+
+
+def _prefetched(iterator, on_exit=None):
+    """Yield the elements of iterator, reading the next one ahead in a thread"""
+    results = queue.Queue(maxsize=1)
+    stopped = threading.Event()
+    done = object()
+
+    def produce():
+        try:
+            for element in iterator:
+                results.put((element, None))
+                if stopped.is_set():
+                    return
+            results.put((done, None))
+        except Exception as e:
+            results.put((done, e))
+        finally:
+            if on_exit is not None:
+                on_exit()
+
+    thread = threading.Thread(target=produce, name="prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            element, error = results.get()
+            if error is not None:
+                raise error
+            if element is done:
+                return
+            yield element
+    finally:
+        stopped.set()
+        # unblock the producer if it is waiting on a full queue
+        try:
+            results.get_nowait()
+        except queue.Empty:
+            pass
 
 
 def merge_dict(obj1: dict, obj2: dict) -> dict:
@@ -247,20 +455,134 @@ def take(iterable, n):
             return
 
 
-def unique(iterable, key=lambda x: x):
+def unique(
+    iterable,
+    key=identity,
+    *,
+    max_keys=None,
+    approximate=False,
+    capacity=None,
+    error_rate=0.001,
+    tmpdir=None,
+):
     """
     >>> list(unique([1, 2, 3, 1, 2, 3]))
     [1, 2, 3]
     >>> list(unique([1, 2, 3]))
     [1, 2, 3]
+
+    Numeric ndarrays and long array.arrays are deduplicated by NumPy when it is
+    installed and key is the default one.
+
+    Three modes, for inputs whose keys do not fit in memory:
+
+    - default : all keys are kept in a set
+
+    - max_keys : at most max_keys keys are kept in memory, the others are
+      spilled to sorted runs in temporary files (in tmpdir) and merged once the
+      input is consumed. Elements come in input order until max_keys is
+      reached, then the remaining unique ones come in key order at the end.
+      Keys must be orderable, keys and elements picklable.
+
+    - approximate : keys are kept in a Bloom filter sized for capacity keys,
+      which may wrongly take up to error_rate of the unique elements for
+      duplicates, and skip them. Duplicates are never yielded.
+
+    >>> list(unique([3, 1, 3, 2, 1, 4], max_keys=2))
+    [3, 1, 2, 4]
     """
+    if approximate:
+        if capacity is None:
+            raise ValueError("approximate mode needs the capacity")
+        yield from _unique_approximate(iterable, key, capacity, error_rate)
+        return
+    if max_keys is not None:
+        if max_keys < 1:
+            raise ValueError("max_keys must be >0")
+        yield from _unique_external(iterable, key, max_keys, tmpdir)
+        return
+    if key is identity and hasattr(iterable, "__len__"):
+        arr = _numeric_array(iterable)
+        if arr is not None and not _has_nan(arr):
+            _, first = np.unique(arr, return_index=True)
+            yield from _to_list(arr[np.sort(first)], iterable)
+            return
     seen = set()
     for element in iterable:
-        if key(element) not in seen:
-            seen.add(key(element))
+        computed = key(element)
+        if computed not in seen:
+            seen.add(computed)
+            yield element
+
+
+def _unique_approximate(iterable, key, capacity, error_rate):
+    from .bloomfilter import BloomFilter
+
+    seen = BloomFilter(capacity, error_rate)
+    for element in iterable:
+        if not seen.add(key(element)):
             yield element
 
 
+def _spill(records, tmpdir):
+    """Write records sorted to a temporary file, return it"""
+    run = tempfile.TemporaryFile(dir=tmpdir)
+    pickler = pickle.Pickler(run, pickle.HIGHEST_PROTOCOL)
+    for record in sorted(records):
+        pickler.dump(record)
+    run.seek(0)
+    return run
+
+
+def _read_run(run):
+    unpickler = pickle.Unpickler(run)
+    while True:
+        try:
+            yield unpickler.load()
+        except EOFError:
+            return
+
+
+def _unique_external(iterable, key, max_keys, tmpdir):
+    seen = set()
+    it = enumerate(iterable)
+    # while the keys fit in memory, elements are yielded right away
+    for position, element in it:
+        computed = key(element)
+        if computed not in seen:
+            seen.add(computed)
+            yield element
+            if len(seen) >= max_keys:
+                break
+    else:
+        return
+    # records are (key, position, element), a position of -1 marks the keys
+    # which were already yielded
+    runs = [_spill(((k, -1, None) for k in seen), tmpdir)]
+    del seen
+    try:
+        buffer = {}
+        for position, element in it:
+            computed = key(element)
+            if computed not in buffer:
+                buffer[computed] = (computed, position, element)
+                if len(buffer) >= max_keys:
+                    runs.append(_spill(buffer.values(), tmpdir))
+                    buffer = {}
+        if buffer:
+            runs.append(_spill(buffer.values(), tmpdir))
+            buffer = None
+        merged = heapq.merge(*[_read_run(run) for run in runs])
+        for _, records in itertools.groupby(merged, key=lambda record: record[0]):
+            # the first occurrence of a key sorts first
+            _, position, element = next(records)
+            if position != -1:
+                yield element
+    finally:
+        for run in runs:
+            run.close()
+
+
 def without(iterable, values, key=lambda x: x):
     """
     >>> list(without([1, 2, 3], 2))
@@ -273,12 +595,30 @@ def without(iterable, values, key=lambda x: x):
             yield element
 
 
-def count_by(iterable, key=lambda x: x):
+def count_by(iterable, key=identity, vectorized=False):
     """
     count the iterable by given key function
     >>> count_by([0, 1, 2, 3, 4, 5], key=lambda x : x % 2 == 0)
     defaultdict(<class 'int'>, {True: 3, False: 3})
+
+    Numeric ndarrays and long array.arrays are counted by NumPy when it is
+    installed and key is the default one, or vectorized is set: key is then
+    called once with the whole array, and returns the array of keys.
     """
+    if (key is identity or vectorized) and hasattr(iterable, "__len__"):
+        arr = _numeric_array(iterable)
+        if arr is not None:
+            keys = arr if key is identity else np.asarray(key(arr))
+            if keys.shape == arr.shape and not _has_nan(keys):
+                values, first, counts = np.unique(
+                    keys, return_index=True, return_counts=True
+                )
+                # keys in the order they are first seen, as a dict would have
+                order = np.argsort(first, kind="stable")
+                source = iterable if key is identity else keys
+                return collections.defaultdict(
+                    int, zip(_to_list(values[order], source), counts[order].tolist())
+                )
     result = collections.defaultdict(int)
     for element in iterable:
         computed = key(element)
@@ -311,12 +651,23 @@ def any(iterable, pred=bool):
     return False
 
 
-def partition(iterable, pred=lambda x: x):
+def partition(iterable, pred=identity, vectorized=False):
     """
     split values into truthy and false values by `pred`
     >>> partition([-2, -1, 0, 1, 2], pred=lambda x: x < 0)
     ([-2, -1], [0, 1, 2])
+
+    Numeric ndarrays and long array.arrays are split by NumPy when it is
+    installed and pred is the default one, or vectorized is set: pred is then
+    called once with the whole array, and returns an array of booleans, e.g.
+    `lambda x: x < 0` works both ways.
     """
+    if (pred is identity or vectorized) and hasattr(iterable, "__len__"):
+        arr = _numeric_array(iterable)
+        if arr is not None:
+            mask = arr != 0 if pred is identity else np.asarray(pred(arr), dtype=bool)
+            if mask.shape == arr.shape:
+                return _to_list(arr[mask], iterable), _to_list(arr[~mask], iterable)
     truthy = []
     falsy = []
     for element in iterable:
@@ -373,6 +724,224 @@ def split_ranges(start, stop, count=None, step=None):
     return [(start + i * step, start + (i + 1) * step) for i in range(int(count))]
 
 
+class CountAggregator:
+    """Number of values in a window"""
+
+    def __init__(self):
+        self.count = 0
+
+    def add(self, value):
+        self.count += 1
+
+    def merge(self, other):
+        self.count += other.count
+
+    def result(self):
+        return self.count
+
+
+class SumAggregator:
+    """Sum of the values in a window"""
+
+    def __init__(self):
+        self.total = 0
+
+    def add(self, value):
+        self.total += value
+
+    def merge(self, other):
+        self.total += other.total
+
+    def result(self):
+        return self.total
+
+
+def _mix64(x):
+    # splitmix64 finalizer, hash() of small ints is the int itself
+    x &= 0xFFFFFFFFFFFFFFFF
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+    return x ^ (x >> 31)
+
+
+class ApproxDistinctAggregator:
+    """
+    Approximate number of distinct values in a window (HyperLogLog)
+
+    Uses 2**precision bytes whatever the number of values, the standard error
+    is about 1.04 / sqrt(2**precision), 1.6% by default. Values are hashed
+    with hash(), so estimates are only comparable within a process.
+    """
+
+    def __init__(self, precision=12):
+        if not 4 <= precision <= 16:
+            raise ValueError("precision must be in [4, 16]")
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value):
+        x = _mix64(hash(value))
+        index = x >> (64 - self.precision)
+        rest = x & ((1 << (64 - self.precision)) - 1)
+        rank = 64 - self.precision - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("can not merge different precisions")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def result(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # linear counting is more accurate for small cardinalities
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+
+class TopKAggregator:
+    """
+    Approximate k most frequent values in a window (Space-Saving)
+
+    At most capacity values are counted, 10 * k by default, the least frequent
+    one is replaced when a new value comes, so counts may be overestimated by
+    up to the smallest count. result() is a list of (value, count), most
+    frequent first.
+    """
+
+    def __init__(self, k, capacity=None):
+        self.k = k
+        self.capacity = capacity if capacity is not None else 10 * k
+        self.counts = {}
+
+    def add(self, value):
+        counts = self.counts
+        if value in counts:
+            counts[value] += 1
+        elif len(counts) < self.capacity:
+            counts[value] = 1
+        else:
+            smallest = min(counts, key=counts.__getitem__)
+            counts[value] = counts.pop(smallest) + 1
+
+    def merge(self, other):
+        counts = self.counts
+        for value, count in other.counts.items():
+            counts[value] = counts.get(value, 0) + count
+        if len(counts) > self.capacity:
+            self.counts = dict(
+                heapq.nlargest(self.capacity, counts.items(), key=lambda kv: kv[1])
+            )
+
+    def result(self):
+        return heapq.nlargest(self.k, self.counts.items(), key=lambda kv: kv[1])
+
+
+def windowed(
+    iterable, aggregator, size, step=None, *, key=None, value=identity, start=None
+):
+    """
+    Aggregate a stream over windows of size, starting every step, lazily
+
+    Windows are [start + i * step, start + i * step + size) like the ranges of
+    split_ranges, of timestamps given by key(element), or of element positions
+    if key is None. step defaults to size, i.e. tumbling windows, size must be
+    a multiple of step. Timestamps may be numbers, or datetimes with timedelta
+    size and step. start defaults to the first timestamp.
+
+    aggregator is called to create an aggregator, e.g. SumAggregator or
+    functools.partial(TopKAggregator, 10), which gets value(element) for every
+    element. ((window start, window stop), result) is yielded for every window
+    as soon as the stream is past it, windows without any element are skipped.
+
+    Elements are kept in per-step aggregators (panes) only until their last
+    window is yielded, so memory is bounded by size / step aggregators.
+    Elements should come in timestamp order, those older than the oldest
+    pending window are dropped.
+
+    >>> list(windowed([1, 2, 3, 4, 5], SumAggregator, 2))
+    [((0, 2), 3), ((2, 4), 7), ((4, 6), 5)]
+    >>> list(windowed([1, 2, 3, 4], SumAggregator, 2, 1))
+    [((0, 2), 3), ((1, 3), 5), ((2, 4), 7), ((3, 5), 4)]
+    """
+    if step is None:
+        step = size
+    panes_per_window = size / step
+    if panes_per_window < 1 or panes_per_window != int(panes_per_window):
+        raise ValueError("size must be a multiple of step")
+    panes_per_window = int(panes_per_window)
+    # pane index -> aggregator of the elements in [start + i * step, + step)
+    panes = {}
+    # first window not yielded yet
+    next_window = 0
+
+    def flush(until):
+        # yield the windows ending at or before pane index until
+        nonlocal next_window
+        while next_window + panes_per_window <= until:
+            if not panes:
+                next_window = until - panes_per_window + 1
+                return
+            first_pane = min(panes)
+            if first_pane >= next_window + panes_per_window:
+                # skip the windows without any element
+                next_window = first_pane - panes_per_window + 1
+                continue
+            merged = aggregator()
+            for index in range(next_window, next_window + panes_per_window):
+                pane = panes.get(index)
+                if pane is not None:
+                    merged.merge(pane)
+            window_start = start + next_window * step
+            yield (window_start, window_start + size), merged.result()
+            panes.pop(next_window, None)
+            next_window += 1
+
+    if key is None:
+        start = 0
+    for position, element in enumerate(iterable):
+        timestamp = position if key is None else key(element)
+        if start is None:
+            start = timestamp
+        index = int((timestamp - start) // step)
+        if index < next_window:
+            continue
+        yield from flush(index)
+        pane = panes.get(index)
+        if pane is None:
+            pane = panes[index] = aggregator()
+        pane.add(value(element))
+    if panes:
+        yield from flush(max(panes) + panes_per_window)
+
+
+def tumbling_window(iterable, aggregator, size, **kwargs):
+    """
+    Aggregate a stream over consecutive windows of size, see windowed
+
+    >>> from datetime import datetime, timedelta
+    >>> events = [datetime(2020, 1, 1, 0, m) for m in (0, 1, 7, 31)]
+    >>> [(w[0].minute, n) for w, n in tumbling_window(
+    ...     events, CountAggregator, timedelta(minutes=10), key=identity)]
+    [(0, 3), (30, 1)]
+    """
+    return windowed(iterable, aggregator, size, size, **kwargs)
+
+
+def sliding_window(iterable, aggregator, size, step, **kwargs):
+    """
+    Aggregate a stream over windows of size, starting every step, see windowed
+
+    >>> list(sliding_window("abcab", CountAggregator, 4, 2))
+    [((0, 4), 4), ((2, 6), 3), ((4, 8), 1)]
+    """
+    return windowed(iterable, aggregator, size, step, **kwargs)
+
+
 def take_indices(l, indices=None, default=None):
     """
     >>> list(take_indices([1, 2, 3], [0, 2, 5]))
@@ -380,6 +949,10 @@ def take_indices(l, indices=None, default=None):
     """
     if indices is None:
         return
+    taken = _take_indices_numpy(l, indices, default)
+    if taken is not None:
+        yield from taken
+        return
     for idx in indices:
         try:
             yield l[idx]
@@ -387,6 +960,23 @@ def take_indices(l, indices=None, default=None):
             yield default
 
 
+def _take_indices_numpy(l, indices, default):
+    arr = _numeric_array(l)
+    if arr is None:
+        return None
+    idx = _numeric_array(indices)
+    if idx is None or idx.dtype.kind not in "iu":
+        return None
+    n = len(arr)
+    valid = (idx >= -n) & (idx < n)
+    if valid.all():
+        return _to_list(arr[idx], l)
+    taken = _to_list(arr[np.where(valid, idx, 0)], l) if n else [default] * len(idx)
+    for position in np.flatnonzero(~valid).tolist():
+        taken[position] = default
+    return taken
+
+
 def group_by_attr(l, attr):
     ret = collections.defaultdict(list)
     for el in l:
@@ -410,12 +1000,202 @@ def filter_by(l, bools, falsy=False):
     [1, 3]
     >>> list(filter_by([1,2,3], [True, False, True], falsy=True))
     [2]
+
+    Numeric ndarrays and long array.arrays are filtered by NumPy when it is
+    installed and bools is an ndarray of booleans.
     """
+    arr = _numeric_array(l)
+    mask = _numeric_array(bools) if arr is not None else None
+    if mask is not None and mask.dtype == bool:
+        if len(arr) != len(mask):
+            raise ValueError(
+                "zip list lengths are not equal %s" % [len(l), len(bools)]
+            )
+        yield from _to_list(arr[~mask if falsy else mask], l)
+        return
     for a, b in safe_zip(l, bools):
         if not falsy and b or falsy and not b:
             yield a
 
 
+class ParallelMapError(Exception):
+    """fn raised error for item, in one of the parallel_* helpers"""
+
+    def __init__(self, item, error):
+        # both in args, so that it pickles back from a worker process
+        super().__init__(item, error)
+        self.item = item
+        self.error = error
+
+    def __str__(self):
+        return "%r failed: %r" % (self.item, self.error)
+
+
+_MISSING = object()
+
+
+def _map_chunk(fn, chunk):
+    results = []
+    for item in chunk:
+        try:
+            results.append(fn(item))
+        except Exception as e:
+            raise ParallelMapError(item, e) from e
+    return results
+
+
+def _reduce_chunk(fn, chunk):
+    it = iter(chunk)
+    result = next(it)
+    for item in it:
+        try:
+            result = fn(result, item)
+        except Exception as e:
+            raise ParallelMapError(item, e) from e
+    return result
+
+
+def _make_executor(executor, max_workers):
+    """Return (executor, owned), owned executors are shut down by the caller"""
+    if executor == "thread":
+        return concurrent.futures.ThreadPoolExecutor(max_workers), True
+    if executor == "process":
+        return concurrent.futures.ProcessPoolExecutor(max_workers), True
+    if isinstance(executor, concurrent.futures.Executor):
+        return executor, False
+    raise ValueError("executor must be 'thread', 'process' or an Executor")
+
+
+def _run_chunks(
+    chunk_fn, fn, iterable, executor, max_workers, chunk_size, max_inflight, ordered
+):
+    """Yield chunk_fn(fn, chunk) for every chunk of iterable
+
+    At most max_inflight chunks are submitted at once, the next one is only
+    taken from iterable when a result was consumed.
+    """
+    executor, owned = _make_executor(executor, max_workers)
+    if max_inflight is None:
+        max_inflight = 2 * (max_workers or os.cpu_count() or 1)
+    chunks = chunked(chunk_size, iter(iterable))
+    pending = collections.deque()
+    try:
+        for chunk in itertools.islice(chunks, max_inflight):
+            pending.append(executor.submit(chunk_fn, fn, chunk))
+        while pending:
+            if ordered:
+                future = pending.popleft()
+            else:
+                done, _ = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                future = done.pop()
+                pending.remove(future)
+            result = future.result()
+            for chunk in itertools.islice(chunks, 1):
+                pending.append(executor.submit(chunk_fn, fn, chunk))
+            yield result
+    finally:
+        # on errors, or when the caller stopped iterating
+        for future in pending:
+            future.cancel()
+        if owned:
+            executor.shutdown(wait=True)
+
+
+def parallel_map(
+    fn,
+    iterable,
+    *,
+    executor="thread",
+    max_workers=None,
+    chunk_size=64,
+    max_inflight=None,
+):
+    """
+    Lazily yield fn(item) for every item of iterable, in order
+
+    Items are sent to the workers in chunks of chunk_size, and at most
+    max_inflight chunks (twice the workers by default) are queued or running
+    at once, so a large generator is never fully read in memory.
+
+    - executor : "thread", "process", or a concurrent.futures.Executor which
+      is left running
+
+    When fn raises, ParallelMapError is raised with the failing item and the
+    original exception.
+
+    >>> list(parallel_map(abs, range(-3, 3), chunk_size=2))
+    [3, 2, 1, 0, 1, 2]
+    """
+    for results in _run_chunks(
+        _map_chunk, fn, iterable, executor, max_workers, chunk_size, max_inflight, True
+    ):
+        yield from results
+
+
+def parallel_imap_unordered(
+    fn,
+    iterable,
+    *,
+    executor="thread",
+    max_workers=None,
+    chunk_size=64,
+    max_inflight=None,
+):
+    """
+    Like parallel_map, but yield results as soon as their chunk is done
+
+    >>> sorted(parallel_imap_unordered(abs, range(-3, 3), chunk_size=2))
+    [0, 1, 1, 2, 2, 3]
+    """
+    for results in _run_chunks(
+        _map_chunk, fn, iterable, executor, max_workers, chunk_size, max_inflight, False
+    ):
+        yield from results
+
+
+def parallel_reduce(
+    fn,
+    iterable,
+    initial=_MISSING,
+    *,
+    executor="thread",
+    max_workers=None,
+    chunk_size=64,
+    max_inflight=None,
+):
+    """
+    Reduce every chunk of iterable with fn in the workers, then reduce the results
+    of the chunks, in order
+
+    fn must be associative, e.g. operator.add or max. Other parameters are as
+    in parallel_map.
+
+    >>> import operator
+    >>> parallel_reduce(operator.add, range(10), chunk_size=3)
+    45
+    >>> parallel_reduce(operator.add, [], 0)
+    0
+    """
+    result = initial
+    chunk_results = _run_chunks(
+        _reduce_chunk,
+        fn,
+        iterable,
+        executor,
+        max_workers,
+        chunk_size,
+        max_inflight,
+        ordered=True,
+    )
+    for chunk_result in chunk_results:
+        result = chunk_result if result is _MISSING else fn(result, chunk_result)
+    if result is _MISSING:
+        raise TypeError("parallel_reduce() of empty iterable with no initial value")
+    return result
+
+
 if __name__ == "__main__":
     import doctest
 
@@ -1,50 +1,124 @@
+"""Bloom filter, a set that may give false positives but uses a few bits per key"""
+
+import hashlib
+import math
+import struct
+
+__all__ = ["BloomFilter"]
+
+
+def _encode(key):
+    """Bytes of key, tagged by type, equal for keys equal in a set"""
+    if isinstance(key, bytes):
+        return b"b" + key
+    if isinstance(key, str):
+        return b"s" + key.encode("utf-8", "surrogatepass")
+    if isinstance(key, (int, float)):
+        # 1 == 1.0 == True
+        if isinstance(key, bool) or isinstance(key, float) and key.is_integer():
+            key = int(key)
+        return b"n" + repr(key).encode("ascii")
+    return b"h" + struct.pack("<q", hash(key))
+
+
 class BloomFilter:
+    """
+    >>> bf = BloomFilter(capacity=1000, error_rate=0.01)
+    >>> bf.add("hello")
+    False
+    >>> bf.add("hello")
+    True
+    >>> "hello" in bf, "world" in bf
+    (True, False)
+    >>> len(bf)
+    1
 
-    def put(self, )
+    Size it with capacity, the number of keys it will hold, and error_rate, the
+    false positive rate once it holds them, or directly with bit_num and
+    hash_num. bits restores the content saved from bits().
 
-class BloomFilter2(object):
-    def __init__(self, bit_num=None, hash_num=None, item_num=None, bits=None):
+    Keys are told apart like in a set: 1, 1.0 and True are one key, 1 and "1"
+    or "a" and b"a" are two. str, bytes, int and float keys are hashed by
+    value, other keys by hash(), their bits are only valid in the process
+    which set them, e.g. hash() of str varies between processes.
+    """
+
+    def __init__(
+        self,
+        capacity=None,
+        error_rate=0.01,
+        *,
+        bit_num=None,
+        hash_num=None,
+        item_num=0,
+        bits=None,
+    ):
+        if bit_num is None:
+            if capacity is None:
+                raise ValueError("either capacity or bit_num must be given")
+            if not 0 < error_rate < 1:
+                raise ValueError("error_rate must be in (0, 1)")
+            # optimal sizes for capacity keys, see wikipedia
+            bit_num = -capacity * math.log(error_rate) / math.log(2) ** 2
+            bit_num = max(int(math.ceil(bit_num)), 8)
+        if hash_num is None:
+            if capacity is None:
+                raise ValueError("hash_num must be given with bit_num")
+            hash_num = max(1, int(round(bit_num / capacity * math.log(2))))
         self.bit_num = bit_num
         self.hash_num = hash_num
-        self.item_num = item_num if item_num else 0
-        self._bits = BitVector(size=bit_num, bits=bits)
-
-    def gen_offsets(self, key: Union[str, bytes]):
-        key = ensure_bytes(key)
-        h = md5.new()
-        if isinstance(key, unicode):
-            key = key.encode('utf-8')
+        self.item_num = item_num
+        size = (bit_num + 7) // 8
+        if bits is not None:
+            if len(bits) != size:
+                raise ValueError("bits must be %d bytes" % size)
+            self._bits = bytearray(bits)
         else:
-            key = str(key)
-        h.update(key)
-        a, b = struct.unpack('QQ', h.digest())
+            self._bits = bytearray(size)
+
+    def gen_offsets(self, key):
+        """Yield the bit offsets of key"""
+        digest = hashlib.blake2b(_encode(key), digest_size=16).digest()
+        a, b = struct.unpack("<QQ", digest)
+        # double hashing, b must not be 0
+        b |= 1
         for i in range(self.hash_num):
             yield (a + i * b) % self.bit_num
 
     def add(self, key):
-        ''' Adds a key to this bloom filter. If the key already exists in this
-            filter it will return True. Otherwise False. '''
+        """ Adds a key to this bloom filter. If the key already exists in this
+            filter it will return True. Otherwise False. """
+        bits = self._bits
         dup = True
-        for i in self.gen_offsets(key): 
-            if dup and not self._bits.has_bit(i):
+        for i in self.gen_offsets(key):
+            byte, mask = i >> 3, 1 << (i & 7)
+            if not bits[byte] & mask:
                 dup = False
-            self._bits.set_bit(i)
+                bits[byte] |= mask
         if not dup:
             self.item_num += 1
         return dup
 
     def might_contain(self, key):
+        bits = self._bits
         for i in self.gen_offsets(key):
-            if not self._bits.has_bit(i):
+            if not bits[i >> 3] & (1 << (i & 7)):
                 return False
         return True
 
+    __contains__ = might_contain
+
     def __len__(self):
         return self.item_num
 
     def bits(self):
-        return self._bits.to_binary()
+        return bytes(self._bits)
 
     def bits_size(self):
-        return len(self._bits.to_binary())
+        return len(self._bits)
+
+
+if __name__ == "__main__":
+    import doctest
 
+    doctest.testmod()
@@ -6,9 +6,15 @@ from: https://github.com/repoze/repoze.lru/
 from abc import abstractmethod
 from abc import ABC
 
+import functools
 import threading
 import time
 import uuid
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from futile.cache.keys import make_key_builder
+from futile.log import get_logger
 
 
 _MARKER = object()
@@ -34,6 +40,86 @@ class Cache(ABC):
     def invalidate(self, key):
         """Remove key from the cache"""
 
+    def get_many(self, keys):
+        """Return a dict of the values of keys found in the cache"""
+        result = {}
+        for key in keys:
+            val = self.get(key, _MARKER)
+            if val is not _MARKER:
+                result[key] = val
+        return result
+
+    def put_many(self, mapping):
+        """Add all the key, value pairs of mapping to the cache"""
+        for key, val in mapping.items():
+            self.put(key, val)
+
+    def invalidate_many(self, keys):
+        """Remove keys from the cache"""
+        for key in keys:
+            self.invalidate(key)
+
+    def victim(self, key):
+        """Return the key that put(key, ...) would evict now
+
+        Returns _MARKER when nothing would be evicted, i.e. key is already
+        cached or there is room left, or when the cache cannot tell.
+        """
+        return _MARKER
+
+
+class _TimedLock(object):
+    """threading.Lock that adds up how long callers waited to acquire it
+
+    Only contended acquisitions are timed, an uncontended one costs a single
+    non-blocking acquire.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.wait = 0.0
+        self.contended = 0
+
+    def __enter__(self):
+        lock = self._lock
+        if not lock.acquire(False):
+            start = time.perf_counter()
+            lock.acquire()
+            self.wait += time.perf_counter() - start
+            self.contended += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self._lock.release()
+
+    def acquire(self, blocking=True, timeout=-1):
+        return self._lock.acquire(blocking, timeout)
+
+    def release(self):
+        self._lock.release()
+
+    def locked(self):
+        return self._lock.locked()
+
+
+def _find_clock_victim(data, clock_keys, clock_refs, hand, key):
+    # replays the CLOCK scan of put() without touching the reference bits
+    if key in data:
+        return _MARKER
+    size = len(clock_refs)
+    count = 0
+    while clock_refs[hand] is True:
+        hand += 1
+        if hand >= size:
+            hand = 0
+        count += 1
+        # put() clears the bits it passes, so it stops after a full round at
+        # the latest, or after 107 steps when it forces an eviction
+        if count >= size or count >= 107:
+            break
+    oldkey = clock_keys[hand]
+    return oldkey if oldkey in data else _MARKER
+
 
 class UnboundedCache(Cache):
     """
@@ -58,20 +144,42 @@ class UnboundedCache(Cache):
     def put(self, key, val):
         self._data[key] = val
 
+    def get_many(self, keys):
+        data = self._data
+        return {key: data[key] for key in keys if key in data}
+
+    def put_many(self, mapping):
+        self._data.update(mapping)
+
+    def invalidate_many(self, keys):
+        pop = self._data.pop
+        for key in keys:
+            pop(key, None)
+
 
 class LruCache(Cache):
     """ Implements a pseudo-LRU algorithm (CLOCK)
 
     The Clock algorithm is not kept strictly to improve performance, e.g. to
     allow get() and invalidate() to work without acquiring the lock.
+
+    If weigher is given, weigher(key, val) is the estimated weight of an entry,
+    e.g. its size in bytes, and entries are also evicted to keep the total
+    weight under max_weight. size still bounds the number of entries.
     """
 
-    def __init__(self, size, delete_callback=None):
+    def __init__(self, size, delete_callback=None, weigher=None, max_weight=None):
         size = int(size)
         if size < 1:
             raise ValueError("size must be >0")
+        if (weigher is None) != (max_weight is None):
+            raise ValueError("weigher and max_weight must be given together")
         self.size = size
-        self.lock = threading.Lock()
+        self.weigher = weigher
+        self.max_weight = max_weight
+        self.weights = None
+        self.weight = 0
+        self.lock = _TimedLock()
         self.hand = 0
         self.maxpos = size - 1
         self.clock_keys = None
@@ -94,6 +202,8 @@ class LruCache(Cache):
             # With self.data already clear, that peak should not exceed what
             # we normally use.
             self.data = {}
+            self.weights = {}
+            self.weight = 0
             size = self.size
             self.clock_keys = [_MARKER] * size
             self.clock_refs = [False] * size
@@ -115,61 +225,149 @@ class LruCache(Cache):
         self.clock_refs[pos] = True
         return val
 
+    def get_many(self, keys):
+        """Return a dict of the values of keys found in the cache"""
+        # any iterable, counted below
+        keys = list(keys)
+        data = self.data
+        clock_refs = self.clock_refs
+        result = {}
+        for key in keys:
+            entry = data.get(key)
+            if entry is not None:
+                clock_refs[entry[0]] = True
+                result[key] = entry[1]
+        hits = len(result)
+        self.lookups += len(keys)
+        self.hits += hits
+        self.misses += len(keys) - hits
+        return result
+
     def put(self, key, val):
         """Add key to the cache with value val"""
-        # These do not change or they are just references, no need for locking.
+        weight = None
+        if self.weigher is not None:
+            weight = self.weigher(key, val)
+            if weight > self.max_weight:
+                # it would push out everything else, and still not fit
+                self.invalidate(key)
+                return
+        with self.lock:
+            self._put(key, val, weight)
+
+    def put_many(self, mapping):
+        """Add all the key, value pairs of mapping to the cache"""
+        items = list(mapping.items())
+        weights = [None] * len(items)
+        if self.weigher is not None:
+            weights = [self.weigher(key, val) for key, val in items]
+            too_heavy = [
+                key for (key, _), weight in zip(items, weights)
+                if weight > self.max_weight
+            ]
+            self.invalidate_many(too_heavy)
+        with self.lock:
+            for (key, val), weight in zip(items, weights):
+                if weight is None or weight <= self.max_weight:
+                    self._put(key, val, weight)
+
+    def _put(self, key, val, weight):
+        # caller must hold the lock
+        weigher = self.weigher
         maxpos = self.maxpos
         clock_refs = self.clock_refs
         clock_keys = self.clock_keys
         data = self.data
 
-        with self.lock:
-            entry = data.get(key)
-            if entry is not None:
-                # We already have key. Only make sure data is up to date and
-                # to remember that it was used.
-                pos, old_val = entry
-                if old_val is not val:
-                    data[key] = (pos, val)
-                self.clock_refs[pos] = True
-                return
-            # else: key is not yet in cache. Search place to insert it.
-
-            hand = self.hand
-            count = 0
-            max_count = 107
-            while 1:
-                ref = clock_refs[hand]
-                if ref is True:
+        entry = data.get(key)
+        if entry is not None:
+            # We already have key. Only make sure data is up to date and
+            # to remember that it was used.
+            pos, old_val = entry
+            if old_val is not val:
+                data[key] = (pos, val)
+            self.clock_refs[pos] = True
+            if weigher is not None:
+                self._reweigh(key, weight)
+            return
+        # else: key is not yet in cache. Search place to insert it.
+
+        hand = self.hand
+        count = 0
+        max_count = 107
+        while 1:
+            ref = clock_refs[hand]
+            if ref is True:
+                clock_refs[hand] = False
+                hand += 1
+                if hand > maxpos:
+                    hand = 0
+
+                count += 1
+                if count >= max_count:
+                    # We have been searching long enough. Force eviction of
+                    # next entry, no matter what its status is.
                     clock_refs[hand] = False
-                    hand += 1
-                    if hand > maxpos:
-                        hand = 0
-
-                    count += 1
-                    if count >= max_count:
-                        # We have been searching long enough. Force eviction of
-                        # next entry, no matter what its status is.
-                        clock_refs[hand] = False
-                else:
-                    oldkey = clock_keys[hand]
-                    # Maybe oldkey was not in self.data to begin with. If it
-                    # was, self.invalidate() in another thread might have
-                    # already removed it. del() would raise KeyError, so pop().
-                    oldentry = data.pop(oldkey, _MARKER)
-                    if oldentry is not _MARKER:
-                        self.evictions += 1
-                    clock_keys[hand] = key
-                    clock_refs[hand] = True
-                    data[key] = (hand, val)
-                    hand += 1
-                    if hand > maxpos:
-                        hand = 0
-                    self.hand = hand
-                    break
+            else:
+                oldkey = clock_keys[hand]
+                # Maybe oldkey was not in self.data to begin with. If it
+                # was, self.invalidate() in another thread might have
+                # already removed it. del() would raise KeyError, so pop().
+                oldentry = data.pop(oldkey, _MARKER)
+                if oldentry is not _MARKER:
+                    self.evictions += 1
+                    if weigher is not None:
+                        self.weight -= self.weights.pop(oldkey, 0)
+                clock_keys[hand] = key
+                clock_refs[hand] = True
+                data[key] = (hand, val)
+                hand += 1
+                if hand > maxpos:
+                    hand = 0
+                self.hand = hand
+                break
+        if weigher is not None:
+            self._reweigh(key, weight)
+
+    def _reweigh(self, key, weight):
+        # caller must hold the lock
+        weights = self.weights
+        self.weight += weight - weights.get(key, 0)
+        weights[key] = weight
+        if self.weight <= self.max_weight:
+            return
+        # run the clock hand until enough weight is evicted, sparing the slot of
+        # key, which may hold an equal but distinct key object
+        data = self.data
+        spared = data[key][0]
+        clock_refs = self.clock_refs
+        clock_keys = self.clock_keys
+        maxpos = self.maxpos
+        hand = self.hand
+        while self.weight > self.max_weight and len(data) > 1:
+            if clock_refs[hand] is True:
+                clock_refs[hand] = False
+            elif hand != spared:
+                oldkey = clock_keys[hand]
+                if data.pop(oldkey, _MARKER) is not _MARKER:
+                    self.evictions += 1
+                    self.weight -= weights.pop(oldkey, 0)
+                    clock_keys[hand] = _MARKER
+            hand += 1
+            if hand > maxpos:
+                hand = 0
+        self.hand = hand
 
     def invalidate(self, key):
         """Remove key from the cache"""
+        if self.weigher is not None:
+            # weights have to be kept in sync, no lock-free shortcut here
+            with self.lock:
+                entry = self.data.pop(key, _MARKER)
+                if entry is not _MARKER:
+                    self.clock_refs[entry[0]] = False
+                    self.weight -= self.weights.pop(key, 0)
+            return
         # pop with default arg will not raise KeyError
         entry = self.data.pop(key, _MARKER)
         if entry is not _MARKER:
@@ -178,6 +376,183 @@ class LruCache(Cache):
             self.clock_refs[entry[0]] = False
         # else: key was not in cache. Nothing to do.
 
+    def invalidate_many(self, keys):
+        """Remove keys from the cache"""
+        data = self.data
+        clock_refs = self.clock_refs
+        if self.weigher is None:
+            for key in keys:
+                entry = data.pop(key, _MARKER)
+                if entry is not _MARKER:
+                    clock_refs[entry[0]] = False
+            return
+        with self.lock:
+            for key in keys:
+                entry = data.pop(key, _MARKER)
+                if entry is not _MARKER:
+                    clock_refs[entry[0]] = False
+                    self.weight -= self.weights.pop(key, 0)
+
+    def victim(self, key):
+        """Return the key that put(key, ...) would evict now"""
+        return _find_clock_victim(
+            self.data, self.clock_keys, self.clock_refs, self.hand, key
+        )
+
+    def stats(self):
+        return dict(
+            size=self.size,
+            length=len(self.data),
+            weight=self.weight,
+            max_weight=self.max_weight,
+            hits=self.hits,
+            misses=self.misses,
+            lookups=self.lookups,
+            evictions=self.evictions,
+            lock_wait=self.lock.wait,
+        )
+
+
+class ShardedLruCache(Cache):
+    """ Spreads keys over several independent CLOCK rings (LruCache)
+
+    Every shard has its own lock and counters, so put()s landing on different
+    shards never contend with each other. Keys are assigned by hash(key).
+    """
+
+    def __init__(
+        self, size, shards=16, delete_callback=None, weigher=None, max_weight=None
+    ):
+        size = int(size)
+        if size < 1:
+            raise ValueError("size must be >0")
+        shards = int(shards)
+        if shards < 1:
+            raise ValueError("shards must be >0")
+        # never create more shards than slots, every shard holds at least 1 key
+        shards = min(shards, size)
+        # the first size % shards shards hold one more key, size in total
+        shard_size, extra = divmod(size, shards)
+        # every shard gets an equal part of the weight budget
+        shard_max_weight = None if max_weight is None else max_weight / shards
+        self.size = size
+        self.max_weight = max_weight
+        self.shards = [
+            LruCache(
+                shard_size + (i < extra), delete_callback, weigher, shard_max_weight
+            )
+            for i in range(shards)
+        ]
+        self._nshards = shards
+
+    def _shard(self, key):
+        return self.shards[hash(key) % self._nshards]
+
+    @property
+    def evictions(self):
+        return sum(shard.evictions for shard in self.shards)
+
+    @property
+    def hits(self):
+        return sum(shard.hits for shard in self.shards)
+
+    @property
+    def misses(self):
+        return sum(shard.misses for shard in self.shards)
+
+    @property
+    def lookups(self):
+        return sum(shard.lookups for shard in self.shards)
+
+    @property
+    def weight(self):
+        return sum(shard.weight for shard in self.shards)
+
+    def clear(self):
+        """Remove all entries from the cache"""
+        for shard in self.shards:
+            shard.clear()
+
+    def get(self, key, default=None):
+        """Return value for key. If not in cache, return default"""
+        return self._shard(key).get(key, default)
+
+    def put(self, key, val):
+        """Add key to the cache with value val"""
+        self._shard(key).put(key, val)
+
+    def invalidate(self, key):
+        """Remove key from the cache"""
+        self._shard(key).invalidate(key)
+
+    def _group(self, keys):
+        groups = {}
+        for key in keys:
+            groups.setdefault(hash(key) % self._nshards, []).append(key)
+        return groups
+
+    def get_many(self, keys):
+        """Return a dict of the values of keys found in the cache"""
+        result = {}
+        for index, shard_keys in self._group(keys).items():
+            result.update(self.shards[index].get_many(shard_keys))
+        return result
+
+    def put_many(self, mapping):
+        """Add all the key, value pairs of mapping to the cache"""
+        for index, shard_keys in self._group(mapping).items():
+            self.shards[index].put_many({key: mapping[key] for key in shard_keys})
+
+    def invalidate_many(self, keys):
+        """Remove keys from the cache"""
+        for index, shard_keys in self._group(keys).items():
+            self.shards[index].invalidate_many(shard_keys)
+
+    def victim(self, key):
+        """Return the key that put(key, ...) would evict now"""
+        return self._shard(key).victim(key)
+
+    def stats(self):
+        shard_stats = [shard.stats() for shard in self.shards]
+        stats = dict(size=self.size, max_weight=self.max_weight)
+        fields = (
+            "length",
+            "weight",
+            "hits",
+            "misses",
+            "lookups",
+            "evictions",
+            "lock_wait",
+        )
+        for field in fields:
+            stats[field] = sum(shard[field] for shard in shard_stats)
+        return stats
+
+
+class _Reaper(threading.Thread):
+    """Daemon thread calling cache.purge_expired() every interval seconds
+
+    Only a weak reference to the cache is kept, the thread exits once the cache
+    is garbage collected.
+    """
+
+    def __init__(self, cache, interval):
+        super().__init__(name="cache-reaper", daemon=True)
+        self._cache = weakref.ref(cache)
+        self._interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self._interval):
+            cache = self._cache()
+            if cache is None:
+                return
+            cache.purge_expired()
+            del cache
+
+    def stop(self):
+        self._stopped.set()
+
 
 class ExpiringLruCache(Cache):
     """ Implements a pseudo-LRU algorithm (CLOCK) with expiration times
@@ -186,13 +561,33 @@ class ExpiringLruCache(Cache):
     allow get() and invalidate() to work without acquiring the lock.
     """
 
-    def __init__(self, size, default_timeout=_DEFAULT_TIMEOUT):
+    def __init__(
+        self,
+        size,
+        default_timeout=_DEFAULT_TIMEOUT,
+        sweep_on_access=True,
+        reaper_interval=None,
+        stale_ttl=0,
+    ):
+        """
+        - sweep_on_access : drop an expired entry as soon as get() finds it,
+          instead of waiting for the CLOCK hand to recycle its slot.
+
+        - reaper_interval : if set, purge expired entries every that many
+          seconds in a background thread, see start_reaper.
+
+        - stale_ttl : keep expired entries that many more seconds, so that
+          get_entry() can still serve them while they are being refreshed.
+        """
         self.default_timeout = default_timeout
+        self.sweep_on_access = sweep_on_access
+        self.stale_ttl = stale_ttl
+        self._reaper = None
         size = int(size)
         if size < 1:
             raise ValueError("size must be >0")
         self.size = size
-        self.lock = threading.Lock()
+        self.lock = _TimedLock()
         self.hand = 0
         self.maxpos = size - 1
         self.clock_keys = None
@@ -202,7 +597,11 @@ class ExpiringLruCache(Cache):
         self.hits = 0
         self.misses = 0
         self.lookups = 0
+        self.expirations = 0
+        self.stale_hits = 0
         self.clear()
+        if reaper_interval is not None:
+            self.start_reaper(reaper_interval)
 
     def clear(self):
         """Remove all entries from the cache"""
@@ -223,6 +622,8 @@ class ExpiringLruCache(Cache):
             self.hits = 0
             self.misses = 0
             self.lookups = 0
+            self.expirations = 0
+            self.stale_hits = 0
 
     def get(self, key, default=None):
         """Return value for key. If not in cache or expired, return default"""
@@ -242,65 +643,184 @@ class ExpiringLruCache(Cache):
             # be recycled soon.
             self.misses += 1
             self.clock_refs[pos] = False
+            if self.sweep_on_access:
+                self._remove_expired(key)
             return default
 
+    def get_many(self, keys):
+        """Return a dict of the values of keys found in the cache and not
+        expired
+        """
+        # any iterable, counted below
+        keys = list(keys)
+        data = self.data
+        clock_refs = self.clock_refs
+        now = time.time()
+        result = {}
+        expired = []
+        for key in keys:
+            entry = data.get(key)
+            if entry is None:
+                continue
+            pos, val, expires = entry
+            if expires > now:
+                clock_refs[pos] = True
+                result[key] = val
+            else:
+                clock_refs[pos] = False
+                expired.append(key)
+        hits = len(result)
+        self.lookups += len(keys)
+        self.hits += hits
+        self.misses += len(keys) - hits
+        if expired and self.sweep_on_access:
+            for key in expired:
+                self._remove_expired(key)
+        return result
+
+    def get_entry(self, key, default=None):
+        """Return (val, expires) for key, also if it expired less than
+        stale_ttl seconds ago. If not in cache or expired, return default
+        """
+        self.lookups += 1
+        try:
+            pos, val, expires = self.data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        now = time.time()
+        if expires + self.stale_ttl > now:
+            self.hits += 1
+            if expires <= now:
+                self.stale_hits += 1
+            self.clock_refs[pos] = True
+            return val, expires
+        else:
+            self.misses += 1
+            self.clock_refs[pos] = False
+            if self.sweep_on_access:
+                self._remove_expired(key)
+            return default
+
+    def _remove_expired(self, key):
+        with self.lock:
+            entry = self.data.get(key)
+            # another thread may have refreshed the key in the meantime, and
+            # stale entries are kept until their grace period ends
+            if entry is None or entry[2] + self.stale_ttl > time.time():
+                return
+            del self.data[key]
+            self.clock_keys[entry[0]] = _MARKER
+            self.clock_refs[entry[0]] = False
+            self.expirations += 1
+
+    def invalidate_many(self, keys):
+        """Remove keys from the cache"""
+        data = self.data
+        clock_refs = self.clock_refs
+        for key in keys:
+            entry = data.pop(key, _MARKER)
+            if entry is not _MARKER:
+                clock_refs[entry[0]] = False
+
+    def purge_expired(self):
+        """Remove all expired entries, return how many were removed"""
+        now = time.time() - self.stale_ttl
+        with self.lock:
+            data = self.data
+            clock_keys = self.clock_keys
+            clock_refs = self.clock_refs
+            expired = [key for key, entry in data.items() if entry[2] <= now]
+            for key in expired:
+                pos = data.pop(key)[0]
+                clock_keys[pos] = _MARKER
+                clock_refs[pos] = False
+            self.expirations += len(expired)
+        return len(expired)
+
+    def start_reaper(self, interval):
+        """Purge expired entries every interval seconds in a daemon thread"""
+        self.stop_reaper()
+        self._reaper = _Reaper(self, interval)
+        self._reaper.start()
+
+    def stop_reaper(self):
+        if self._reaper is not None:
+            self._reaper.stop()
+            self._reaper = None
+
     def put(self, key, val, timeout=None):
         """Add key to the cache with value val
 
         key will expire in $timeout seconds. If key is already in cache, val
         and timeout will be updated.
         """
-        # These do not change or they are just references, no need for locking.
+        if timeout is None:
+            timeout = self.default_timeout
+        with self.lock:
+            self._put(key, val, time.time() + timeout)
+
+    def put_many(self, mapping, timeout=None):
+        """Add all the key, value pairs of mapping to the cache
+
+        They will expire in $timeout seconds.
+        """
+        if timeout is None:
+            timeout = self.default_timeout
+        expires = time.time() + timeout
+        with self.lock:
+            for key, val in mapping.items():
+                self._put(key, val, expires)
+
+    def _put(self, key, val, expires):
+        # caller must hold the lock
         maxpos = self.maxpos
         clock_refs = self.clock_refs
         clock_keys = self.clock_keys
         data = self.data
-        if timeout is None:
-            timeout = self.default_timeout
 
-        with self.lock:
-            entry = data.get(key)
-            if entry is not None:
-                # We already have key. Only make sure data is up to date and
-                # to remember that it was used.
-                pos = entry[0]
-                data[key] = (pos, val, time.time() + timeout)
-                clock_refs[pos] = True
-                return
-            # else: key is not yet in cache. Search place to insert it.
-
-            hand = self.hand
-            count = 0
-            max_count = 107
-            while 1:
-                ref = clock_refs[hand]
-                if ref is True:
+        entry = data.get(key)
+        if entry is not None:
+            # We already have key. Only make sure data is up to date and
+            # to remember that it was used.
+            pos = entry[0]
+            data[key] = (pos, val, expires)
+            clock_refs[pos] = True
+            return
+        # else: key is not yet in cache. Search place to insert it.
+
+        hand = self.hand
+        count = 0
+        max_count = 107
+        while 1:
+            ref = clock_refs[hand]
+            if ref is True:
+                clock_refs[hand] = False
+                hand += 1
+                if hand > maxpos:
+                    hand = 0
+
+                count += 1
+                if count >= max_count:
+                    # We have been searching long enough. Force eviction of
+                    # next entry, no matter what its status is.
                     clock_refs[hand] = False
-                    hand += 1
-                    if hand > maxpos:
-                        hand = 0
-
-                    count += 1
-                    if count >= max_count:
-                        # We have been searching long enough. Force eviction of
-                        # next entry, no matter what its status is.
-                        clock_refs[hand] = False
-                else:
-                    oldkey = clock_keys[hand]
-                    # Maybe oldkey was not in self.data to begin with. If it
-                    # was, self.invalidate() in another thread might have
-                    # already removed it. del() would raise KeyError, so pop().
-                    oldentry = data.pop(oldkey, _MARKER)
-                    if oldentry is not _MARKER:
-                        self.evictions += 1
-                    clock_keys[hand] = key
-                    clock_refs[hand] = True
-                    data[key] = (hand, val, time.time() + timeout)
-                    hand += 1
-                    if hand > maxpos:
-                        hand = 0
-                    self.hand = hand
-                    break
+            else:
+                oldkey = clock_keys[hand]
+                # Maybe oldkey was not in self.data to begin with. If it
+                # was, self.invalidate() in another thread might have
+                # already removed it. del() would raise KeyError, so pop().
+                oldentry = data.pop(oldkey, _MARKER)
+                if oldentry is not _MARKER:
+                    self.evictions += 1
+                clock_keys[hand] = key
+                clock_refs[hand] = True
+                data[key] = (hand, val, expires)
+                hand += 1
+                if hand > maxpos:
+                    hand = 0
+                self.hand = hand
+                break
 
     def invalidate(self, key):
         """Remove key from the cache"""
@@ -312,12 +832,206 @@ class ExpiringLruCache(Cache):
             self.clock_refs[entry[0]] = False
         # else: key was not in cache. Nothing to do.
 
+    def victim(self, key):
+        """Return the key that put(key, ...) would evict now"""
+        return _find_clock_victim(
+            self.data, self.clock_keys, self.clock_refs, self.hand, key
+        )
+
+    def stats(self):
+        return dict(
+            size=self.size,
+            length=len(self.data),
+            hits=self.hits,
+            misses=self.misses,
+            lookups=self.lookups,
+            evictions=self.evictions,
+            expirations=self.expirations,
+            stale_hits=self.stale_hits,
+            lock_wait=self.lock.wait,
+        )
+
+
+def make_cache(maxsize, policy="clock"):
+    """Create a cache holding at most maxsize entries, evicted by `policy`
+
+    - clock : pseudo-LRU CLOCK, see LruCache
+
+    - lru : exact LRU, see policies.OrderedLruCache
+
+    - slru : segmented LRU, see policies.SegmentedLruCache
+
+    - clock-pro : CLOCK-Pro, see policies.ClockProCache
+    """
+    from futile.cache.policies import POLICIES
+
+    try:
+        cache_class = POLICIES[policy]
+    except KeyError:
+        raise ValueError("unknown cache policy %s" % policy)
+    return cache_class(maxsize)
+
+
+def _make_decorator_cache(
+    maxsize,
+    timeout=None,
+    shards=None,
+    policy="clock",
+    stale_ttl=None,
+    weigher=None,
+    max_weight=None,
+):
+    if maxsize is None:
+        return UnboundedCache()
+    if timeout is not None:
+        if policy != "clock" or weigher is not None:
+            raise ValueError("timeout is only supported by the unweighted clock policy")
+        if shards is not None:
+            raise ValueError("timeout is not supported with shards")
+        return ExpiringLruCache(
+            maxsize, default_timeout=timeout, stale_ttl=stale_ttl or 0
+        )
+    if shards is not None:
+        if policy != "clock":
+            raise ValueError("shards are only supported by the clock policy")
+        return ShardedLruCache(
+            maxsize, shards, weigher=weigher, max_weight=max_weight
+        )
+    if weigher is not None:
+        if policy != "clock":
+            raise ValueError("weigher is only supported by the clock policy")
+        return LruCache(maxsize, weigher=weigher, max_weight=max_weight)
+    return make_cache(maxsize, policy)
+
+
+class _Call(object):
+    __slots__ = ("event", "val", "exc")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.val = None
+        self.exc = None
+
+
+class _SingleFlight(object):
+    """Collapses concurrent calls with the same key into one
+
+    The first caller of a key runs the function, callers arriving while it is
+    running wait for it and get its result, or its exception.
+
+    With a cache, the first caller looks the key up again before running the
+    function, a caller that missed the cache right before the previous call
+    finished gets the value it stored.
+    """
+
+    def __init__(self, cache=None):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._cache = cache
+
+    def do(self, key, func, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.event.wait()
+            if call.exc is not None:
+                raise call.exc
+            return call.val
+        try:
+            val = _MARKER
+            if self._cache is not None:
+                val = self._cache.get(key, _MARKER)
+            if val is _MARKER:
+                val = func(*args, **kwargs)
+            call.val = val
+        except BaseException as e:
+            call.exc = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.val
+
+
+class _Refresher(object):
+    """Reloads cache entries in a thread pool, at most once at a time per key"""
+
+    def __init__(self, max_workers):
+        self._max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = set()
+
+    def submit(self, key, load, *args):
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self._max_workers, thread_name_prefix="cache-refresh"
+                )
+        self._executor.submit(self._refresh, key, load, *args)
+
+    def _refresh(self, key, load, *args):
+        try:
+            load(*args)
+        except Exception as e:
+            # keep serving the stale value, the next call will try again
+            get_logger("cache").exception("refreshing %r failed: %s", key, e)
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+
+class _LoadStats(object):
+    """How many times a decorated function was called on a miss, and how long
+    those calls took in total"""
+
+    def __init__(self):
+        self.loads = 0
+        self.load_time = 0.0
+
+    def record(self, elapsed):
+        self.loads += 1
+        self.load_time += elapsed
+
 
 class lru_cache(object):
     """ Decorator for LRU-cached function
 
     timeout parameter specifies after how many seconds a cached entry should
     be considered invalid.
+
+    shards parameter splits the LRU cache into that many lock-striped shards
+    (see ShardedLruCache), useful when the function is called from many threads.
+    Only with the clock policy and without timeout.
+
+    policy parameter selects the eviction policy by name, see make_cache.
+
+    single_flight parameter makes concurrent calls missing the same key wait
+    for one call of the function, instead of all calling it at once. If that
+    call raises, the exception is raised to all of them.
+
+    stale_ttl parameter serves entries that expired less than that many
+    seconds ago right away, and reloads them in a background thread pool of
+    refresh_workers threads.
+
+    refresh_ahead parameter, a fraction of timeout, reloads entries in the
+    background once they are older than that, e.g. 0.8 reloads an entry of a
+    cache with a 60s timeout when it is hit after 48s, before it even expires.
+
+    weigher and max_weight parameters bound the total weight of the cached
+    values, see LruCache.
+
+    Calls are cached by the arguments they give, keyword arguments bound to
+    the signature of the function, so f(1, 2) and f(1, b=2) share one entry,
+    see keys.make_key_builder. key parameter is a function computing the cache
+    key from the arguments instead.
     """
 
     def __init__(
@@ -326,34 +1040,124 @@ class lru_cache(object):
         cache=None,  # cache is an arg to serve tests
         timeout=None,
         ignore_unhashable_args=False,
+        shards=None,
+        policy="clock",
+        single_flight=False,
+        stale_ttl=None,
+        refresh_ahead=None,
+        refresh_workers=4,
+        weigher=None,
+        max_weight=None,
+        key=None,
     ):
         if cache is None:
-            if maxsize is None:
-                cache = UnboundedCache()
-            elif timeout is None:
-                cache = LruCache(maxsize)
-            else:
-                cache = ExpiringLruCache(maxsize, default_timeout=timeout)
+            cache = _make_decorator_cache(
+                maxsize, timeout, shards, policy, stale_ttl, weigher, max_weight
+            )
         self.cache = cache
         self._ignore_unhashable_args = ignore_unhashable_args
+        self._key = key
+        self.load_stats = _LoadStats()
+        self._single_flight = _SingleFlight(cache) if single_flight else None
+        self._refresher = None
+        self._refresh_window = None
+        if stale_ttl is not None or refresh_ahead is not None:
+            if not hasattr(cache, "get_entry"):
+                raise ValueError("stale_ttl and refresh_ahead need an expiring cache")
+            if stale_ttl is not None:
+                # a cache given by the caller keeps expired entries as well
+                cache.stale_ttl = stale_ttl
+            if refresh_ahead is not None:
+                if not 0 < refresh_ahead < 1:
+                    raise ValueError("refresh_ahead must be in (0, 1)")
+                self._refresh_window = cache.default_timeout * (1 - refresh_ahead)
+            self._refresher = _Refresher(refresh_workers)
 
     def __call__(self, func):
         cache = self.cache
         marker = _MARKER
+        single_flight = self._single_flight
+        load_stats = self.load_stats
+
+        def load(key, args, kwargs):
+            start = time.perf_counter()
+            val = func(*args, **kwargs)
+            load_stats.record(time.perf_counter() - start)
+            cache.put(key, val)
+            return val
+
+        refresher = self._refresher
+        refresh_window = self._refresh_window
+
+        build_key = make_key_builder(func, self._key)
+        single = getattr(build_key, "single", False)
+        # without kwargs the key is args, unless computed by a key function
+        keyed_by_args = self._key is None and not single
+        ignore_unhashable_args = self._ignore_unhashable_args
+
+        plans = getattr(build_key, "plans", None)
 
         def cached_wrapper(*args, **kwargs):
+            if not kwargs and keyed_by_args:
+                key = args
+            elif kwargs and plans is not None:
+                # build_key inlined for the call shapes it has seen
+                try:
+                    shape, getter = plans[tuple(kwargs)][len(args)]
+                except (KeyError, TypeError):
+                    key = build_key(args, kwargs)
+                else:
+                    key = args + getter(kwargs)
+                    if shape is not None:
+                        key = (shape, key)
+            else:
+                key = build_key(args, kwargs)
+            # keys are only hashed by the cache
             try:
-                key = (args, frozenset(kwargs.items())) if kwargs else args
-            except TypeError as e:
-                if self._ignore_unhashable_args:
+                if refresher is None:
+                    val = cache.get(key, marker)
+                else:
+                    entry = cache.get_entry(key, marker)
+            except TypeError:
+                if ignore_unhashable_args:
                     return func(*args, **kwargs)
+                raise
+            if refresher is not None:
+                if entry is marker:
+                    val = marker
                 else:
-                    raise e
-            else:
-                val = cache.get(key, marker)
+                    val, expires = entry
+                    ttl = expires - time.time()
+                    if ttl <= 0 or (
+                        refresh_window is not None and ttl < refresh_window
+                    ):
+                        refresher.submit(key, load, key, args, kwargs)
+            if val is marker:
+                if single_flight is None:
+                    val = load(key, args, kwargs)
+                else:
+                    val = single_flight.do(key, load, key, args, kwargs)
+            return val
+
+        if single and refresher is None:
+            # f(x) called as f(x), skips packing and hashing a tuple of args
+            keyed_wrapper = cached_wrapper
+
+            def cached_wrapper(*args, **kwargs):
+                if kwargs or len(args) != 1:
+                    return keyed_wrapper(*args, **kwargs)
+                arg = args[0]
+                try:
+                    val = cache.get(arg, marker)
+                except TypeError:
+                    if ignore_unhashable_args:
+                        return func(arg)
+                    raise
                 if val is marker:
-                    val = func(*args, **kwargs)
-                    cache.put(key, val)
+                    if single_flight is None:
+                        val = load(arg, args, {})
+                    else:
+                        val = single_flight.do(arg, load, arg, args, {})
                 return val
 
         def _maybe_copy(source, target, attr):
@@ -364,6 +1168,69 @@ class lru_cache(object):
         _maybe_copy(func, cached_wrapper, "__module__")
         _maybe_copy(func, cached_wrapper, "__name__")
         _maybe_copy(func, cached_wrapper, "__doc__")
+        cached_wrapper._cache = cache
+        cached_wrapper._load_stats = load_stats
+        return cached_wrapper
+
+
+class batch_lru_cache(object):
+    """ Decorator for LRU-cached functions loading many keys at once
+
+    The decorated function takes a list of keys, e.g. ids to fetch from a
+    database, and returns a dict of the values it found. Every value is cached
+    under its own key, so only keys missing from the cache are passed to the
+    function, and a call for [1, 2] warms the cache for a later call for [2, 3].
+
+    Extra positional or keyword arguments are passed through, and are part of
+    the cache keys. Keys missing from the returned dict are not cached.
+
+    timeout, shards and policy parameters work as in lru_cache.
+    """
+
+    def __init__(
+        self,
+        maxsize,
+        cache=None,  # cache is an arg to serve tests
+        timeout=None,
+        shards=None,
+        policy="clock",
+    ):
+        if cache is None:
+            cache = _make_decorator_cache(maxsize, timeout, shards, policy)
+        self.cache = cache
+
+    def __call__(self, func):
+        cache = self.cache
+
+        @functools.wraps(func)
+        def cached_wrapper(keys, *args, **kwargs):
+            keys = list(keys)
+            if args or kwargs:
+                extra = (args, frozenset(kwargs.items()))
+                cache_keys = {key: (key, extra) for key in keys}
+            else:
+                cache_keys = {key: key for key in keys}
+            found = cache.get_many(list(cache_keys.values()))
+            result = {}
+            missing = []
+            for key in keys:
+                cache_key = cache_keys[key]
+                if cache_key in found:
+                    result[key] = found[cache_key]
+                else:
+                    missing.append(key)
+            if missing:
+                loaded = func(missing, *args, **kwargs)
+                cache.put_many(
+                    {
+                        cache_keys[key]: val
+                        for key, val in loaded.items()
+                        if key in cache_keys
+                    }
+                )
+                result.update(loaded)
+            return result
+
         cached_wrapper._cache = cache
         return cached_wrapper
 
@@ -372,16 +1239,27 @@ class CacheMaker(object):
     """Generates decorators that can be cleared later
     """
 
-    def __init__(self, maxsize=None, timeout=_DEFAULT_TIMEOUT):
+    def __init__(
+        self, maxsize=None, timeout=_DEFAULT_TIMEOUT, policy="clock", registry=None
+    ):
         """Create cache decorator factory.
 
         - maxsize : the default size for created caches.
 
         - timeout : the defaut expiraiton time for created caches.
+
+        - policy : the default eviction policy for created LRU caches, see
+          make_cache.
+
+        - registry : a futile.cache.registry.CacheRegistry to register the
+          created caches in, under their names.
         """
         self._maxsize = maxsize
         self._timeout = timeout
+        self._policy = policy
+        self._registry = registry
         self._cache = {}
+        self._load_stats = {}
 
     def _resolve_setting(self, name=None, maxsize=None, timeout=None):
         if name is None:
@@ -407,20 +1285,32 @@ class CacheMaker(object):
 
     def memoized(self, name=None):
         name, maxsize, _ = self._resolve_setting(name, 0)
-        cache = self._cache[name] = UnboundedCache()
-        return lru_cache(None, cache)
+        cache = UnboundedCache()
+        return self._add(name, cache, lru_cache(None, cache))
+
+    def _add(self, name, cache, decorator):
+        self._cache[name] = cache
+        self._load_stats[name] = decorator.load_stats
+        if self._registry is not None:
+            self._registry.register(name, cache, decorator.load_stats)
+        return decorator
 
-    def lrucache(self, name=None, maxsize=None):
+    def lrucache(self, name=None, maxsize=None, policy=None):
         """Named arguments:
 
         - name (optional) is a string, and should be unique amongst all caches
 
         - maxsize (optional) is an int, overriding any default value set by
           the constructor
+
+        - policy (optional) is an eviction policy name, overriding any default
+          value set by the constructor
         """
         name, maxsize, _ = self._resolve_setting(name, maxsize)
-        cache = self._cache[name] = LRUCache(maxsize)
-        return lru_cache(maxsize, cache)
+        if policy is None:
+            policy = self._policy
+        cache = make_cache(maxsize, policy)
+        return self._add(name, cache, lru_cache(maxsize, cache))
 
     def expiring_lrucache(self, name=None, maxsize=None, timeout=None):
         """Named arguments:
@@ -434,8 +1324,8 @@ class CacheMaker(object):
           the constructor or the default value (%d seconds)
         """ % _DEFAULT_TIMEOUT
         name, maxsize, timeout = self._resolve_setting(name, maxsize, timeout)
-        cache = self._cache[name] = ExpiringLRUCache(maxsize, timeout)
-        return lru_cache(maxsize, cache, timeout)
+        cache = ExpiringLruCache(maxsize, timeout)
+        return self._add(name, cache, lru_cache(maxsize, cache, timeout))
 
     def clear(self, *names):
         """Clear the given cache(s).
@@ -447,3 +1337,48 @@ class CacheMaker(object):
 
         for name in names:
             self._cache[name].clear()
+
+    def names(self):
+        """Return the names of all caches created by this factory"""
+        return list(self._cache)
+
+    def stats(self, *names):
+        """Return the stats of the given cache(s) by name, see cache_stats
+
+        If no 'names' are passed, return the stats of all caches.
+        """
+        if len(names) == 0:
+            names = self._cache.keys()
+
+        return {
+            name: cache_stats(self._cache[name], self._load_stats.get(name))
+            for name in names
+        }
+
+
+def cache_stats(cache, load_stats=None):
+    """Return a dict of the counters of any cache
+
+    Counters a cache does not keep are reported as 0. load_stats are the
+    _load_stats of a function decorated by lru_cache.
+    """
+    if hasattr(cache, "stats"):
+        stats = dict(cache.stats())
+    else:
+        stats = {}
+    for field in ("hits", "misses", "lookups", "evictions", "lock_wait"):
+        if field not in stats:
+            stats[field] = getattr(cache, field, 0)
+    if "length" not in stats:
+        data = getattr(cache, "data", None)
+        if data is None:
+            data = getattr(cache, "_data", None)
+        if data is not None:
+            stats["length"] = len(data)
+        elif hasattr(cache, "__len__"):
+            stats["length"] = len(cache)
+        else:
+            stats["length"] = 0
+    stats["loads"] = load_stats.loads if load_stats is not None else 0
+    stats["load_time"] = load_stats.load_time if load_stats is not None else 0.0
+    return stats
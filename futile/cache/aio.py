@@ -0,0 +1,81 @@
+"""
+LRU caching decorator for coroutine functions
+"""
+import asyncio
+from functools import wraps
+
+from futile.cache import _MARKER, _make_decorator_cache
+from futile.cache.keys import make_key_builder
+
+
+class alru_cache(object):
+    """ Decorator for LRU-cached coroutine functions
+
+    Unlike lru_cache, this caches the awaited result, not the coroutine object.
+    Concurrent awaits missing the same key share one future, so the function
+    runs once for all of them. A caller being cancelled does not cancel the
+    shared call for the others. Exceptions are not cached.
+
+    timeout, shards, policy and key parameters work as in lru_cache.
+    """
+
+    def __init__(
+        self,
+        maxsize,
+        cache=None,  # cache is an arg to serve tests
+        timeout=None,
+        ignore_unhashable_args=False,
+        shards=None,
+        policy="clock",
+        key=None,
+    ):
+        if cache is None:
+            cache = _make_decorator_cache(maxsize, timeout, shards, policy)
+        self.cache = cache
+        self._ignore_unhashable_args = ignore_unhashable_args
+        self._key = key
+
+    def __call__(self, func):
+        cache = self.cache
+        marker = _MARKER
+        # key -> future of the call in flight
+        inflight = {}
+
+        async def load(key, args, kwargs):
+            val = await func(*args, **kwargs)
+            cache.put(key, val)
+            return val
+
+        def done(key, future):
+            inflight.pop(key, None)
+            # mark the exception as retrieved, all waiters may be cancelled
+            if not future.cancelled():
+                future.exception()
+
+        build_key = make_key_builder(func, self._key)
+        # without kwargs the key is args, unless computed by a key function
+        keyed_by_args = self._key is None and not getattr(build_key, "single", False)
+
+        @wraps(func)
+        async def cached_wrapper(*args, **kwargs):
+            if kwargs or not keyed_by_args:
+                key = build_key(args, kwargs)
+            else:
+                key = args
+            try:
+                val = cache.get(key, marker)
+            except TypeError:
+                if self._ignore_unhashable_args:
+                    return await func(*args, **kwargs)
+                raise
+            if val is not marker:
+                return val
+            future = inflight.get(key)
+            if future is None:
+                future = asyncio.ensure_future(load(key, args, kwargs))
+                inflight[key] = future
+                future.add_done_callback(lambda f: done(key, f))
+            return await asyncio.shield(future)
+
+        cached_wrapper._cache = cache
+        return cached_wrapper
@@ -0,0 +1,171 @@
+"""
+Persistent cache backed by SQLite, and snapshots of in-memory caches
+
+Snapshot an in-memory cache when the service exits, and load it back when it
+starts, so that it does not start cold after every restart:
+
+    >>> disk = DiskCache("/data/service-cache.db")
+    >>> load_cache(cache, disk)
+    >>> with handle_exit(functools.partial(dump_cache, cache, disk)):
+    ...     server.wait_for_termination()
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from futile.cache import (
+    Cache,
+    ExpiringLruCache,
+    LruCache,
+    ShardedLruCache,
+    UnboundedCache,
+    _DEFAULT_TIMEOUT,
+)
+
+_PICKLE_PROTOCOL = 4
+
+
+class DiskCache(Cache):
+    """ Unbounded cache with expiration times in an SQLite database
+
+    The database is in WAL mode, so readers in other processes do not block
+    writers. Keys and values are pickled, and expiration times are absolute,
+    so they survive restarts.
+    """
+
+    _sql_create = (
+        "CREATE TABLE IF NOT EXISTS cache "
+        "(key BLOB PRIMARY KEY, value BLOB, expires REAL)"
+    )
+    _sql_get = "SELECT value, expires FROM cache WHERE key = ?"
+    _sql_put = "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)"
+    _sql_del = "DELETE FROM cache WHERE key = ?"
+    _sql_clear = "DELETE FROM cache"
+    _sql_purge = "DELETE FROM cache WHERE expires <= ?"
+    _sql_entries = "SELECT key, value, expires FROM cache WHERE expires > ?"
+    _sql_size = "SELECT COUNT(*) FROM cache"
+
+    def __init__(self, path, default_timeout=_DEFAULT_TIMEOUT):
+        self._path = os.path.abspath(path)
+        self._default_timeout = default_timeout
+        self._lock = threading.Lock()
+        self._db = sqlite3.Connection(self._path, timeout=60, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        with self._db as conn:
+            conn.execute(self._sql_create)
+
+    def clear(self):
+        with self._lock, self._db as conn:
+            conn.execute(self._sql_clear)
+
+    def get(self, key, default=None):
+        key = pickle.dumps(key, _PICKLE_PROTOCOL)
+        with self._lock:
+            row = self._db.execute(self._sql_get, (key,)).fetchone()
+        if row is None:
+            return default
+        value, expires = row
+        if expires <= time.time():
+            return default
+        return pickle.loads(value)
+
+    def put(self, key, val, timeout=None):
+        if timeout is None:
+            timeout = self._default_timeout
+        row = (
+            pickle.dumps(key, _PICKLE_PROTOCOL),
+            pickle.dumps(val, _PICKLE_PROTOCOL),
+            time.time() + timeout,
+        )
+        with self._lock, self._db as conn:
+            conn.execute(self._sql_put, row)
+
+    def invalidate(self, key):
+        key = pickle.dumps(key, _PICKLE_PROTOCOL)
+        with self._lock, self._db as conn:
+            conn.execute(self._sql_del, (key,))
+
+    def purge_expired(self):
+        """Remove all expired entries, return how many were removed"""
+        with self._lock, self._db as conn:
+            return conn.execute(self._sql_purge, (time.time(),)).rowcount
+
+    def entries(self):
+        """Return all live entries as (key, val, expires) triplets"""
+        with self._lock:
+            rows = self._db.execute(self._sql_entries, (time.time(),)).fetchall()
+        return [
+            (pickle.loads(key), pickle.loads(value), expires)
+            for key, value, expires in rows
+        ]
+
+    def replace(self, entries):
+        """Replace the whole content by (key, val, expires) triplets, atomically"""
+        rows = [
+            (
+                pickle.dumps(key, _PICKLE_PROTOCOL),
+                pickle.dumps(val, _PICKLE_PROTOCOL),
+                expires,
+            )
+            for key, val, expires in entries
+        ]
+        with self._lock, self._db as conn:
+            conn.execute(self._sql_clear)
+            conn.executemany(self._sql_put, rows)
+
+    def close(self):
+        self._db.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute(self._sql_size).fetchone()[0]
+
+
+def _iter_entries(cache):
+    """Yield the live entries of an in-memory cache as (key, val, expires)"""
+    if isinstance(cache, ShardedLruCache):
+        for shard in cache.shards:
+            yield from _iter_entries(shard)
+    elif isinstance(cache, ExpiringLruCache):
+        now = time.time()
+        for key, (_, val, expires) in list(cache.data.items()):
+            if expires > now:
+                yield key, val, expires
+    elif isinstance(cache, LruCache):
+        expires = time.time() + _DEFAULT_TIMEOUT
+        for key, (_, val) in list(cache.data.items()):
+            yield key, val, expires
+    elif isinstance(cache, UnboundedCache):
+        expires = time.time() + _DEFAULT_TIMEOUT
+        for key, val in list(cache._data.items()):
+            yield key, val, expires
+    else:
+        raise TypeError("can not snapshot %s" % type(cache).__name__)
+
+
+def dump_cache(cache, disk_cache):
+    """Replace the content of disk_cache by a snapshot of an in-memory cache
+
+    Expiration times of ExpiringLruCache entries are kept.
+    """
+    disk_cache.replace(_iter_entries(cache))
+
+
+def load_cache(cache, disk_cache):
+    """Put the live entries of disk_cache into an in-memory cache
+
+    Entries of an ExpiringLruCache expire when they would have without the
+    restart. Return how many entries were loaded.
+    """
+    now = time.time()
+    entries = disk_cache.entries()
+    expiring = isinstance(cache, ExpiringLruCache)
+    for key, val, expires in entries:
+        if expiring:
+            cache.put(key, val, expires - now)
+        else:
+            cache.put(key, val)
+    return len(entries)
@@ -1,19 +1,47 @@
-import sys
+import heapq
+import itertools
 import time
 import threading
 
-from futile.cache import Cache, _DEFAULT_TIMEOUT
+from futile.cache import Cache, _DEFAULT_TIMEOUT, _Reaper
+
+# how many expired entries a put() may remove, when sweeping on access
+_SWEEP_BATCH = 16
 
 
 class ExpiringCache(Cache):
-    def __init__(self, default_timeout=_DEFAULT_TIMEOUT):
+    """ Unbounded cache with expiration times
+
+    Expiration times are indexed by a heap, so expired entries can be removed
+    without scanning the whole cache, either a few at a time on every put()
+    (sweep_on_access), in a background thread (reaper_interval), or
+    explicitly by purge_expired().
+    """
+
+    def __init__(
+        self,
+        default_timeout=_DEFAULT_TIMEOUT,
+        sweep_on_access=True,
+        reaper_interval=None,
+    ):
         self._default_timeout = default_timeout
+        self._sweep_on_access = sweep_on_access
         self._cache = {}
+        # (expire_time, seq, key) triplets, seq keeps keys from being compared.
+        # Entries of updated or invalidated keys are left in place and skipped.
+        self._heap = []
+        self._seq = itertools.count()
         self._lock = threading.RLock()
+        self._reaper = None
+        self.expirations = 0
+        if reaper_interval is not None:
+            self.start_reaper(reaper_interval)
 
     def clear(self):
         with self._lock:
             self._cache = {}
+            self._heap = []
+            self.expirations = 0
 
     def get(self, key, default=None):
         item = self._cache.get(key)
@@ -21,6 +49,12 @@ class ExpiringCache(Cache):
             return default
         expire_time, value = item
         if expire_time < time.time():
+            if self._sweep_on_access:
+                with self._lock:
+                    # the key may have been refreshed in the meantime
+                    if self._cache.get(key) is item:
+                        del self._cache[key]
+                        self.expirations += 1
             return default
         return value
 
@@ -28,7 +62,49 @@ class ExpiringCache(Cache):
         with self._lock:
             if timeout is None:
                 timeout = self._default_timeout
-            self._cache[key] = (time.time() + timeout, val)
+            expire_time = time.time() + timeout
+            self._cache[key] = (expire_time, val)
+            heapq.heappush(self._heap, (expire_time, next(self._seq), key))
+            if self._sweep_on_access:
+                self._sweep(time.time(), _SWEEP_BATCH)
+            if len(self._heap) > 2 * len(self._cache) + 64:
+                self._rebuild_heap()
+
+    def get_many(self, keys):
+        """Return a dict of the values of keys found in the cache and not
+        expired
+        """
+        cache = self._cache
+        now = time.time()
+        result = {}
+        for key in keys:
+            item = cache.get(key)
+            if item and item[0] >= now:
+                result[key] = item[1]
+        return result
+
+    def put_many(self, mapping, timeout=None):
+        """Add all the key, value pairs of mapping, they expire together"""
+        if timeout is None:
+            timeout = self._default_timeout
+        with self._lock:
+            expire_time = time.time() + timeout
+            cache = self._cache
+            heap = self._heap
+            seq = self._seq
+            for key, val in mapping.items():
+                cache[key] = (expire_time, val)
+                heapq.heappush(heap, (expire_time, next(seq), key))
+            if self._sweep_on_access:
+                self._sweep(time.time(), _SWEEP_BATCH)
+            if len(self._heap) > 2 * len(self._cache) + 64:
+                self._rebuild_heap()
+
+    def invalidate_many(self, keys):
+        with self._lock:
+            pop = self._cache.pop
+            for key in keys:
+                pop(key, None)
 
     def invalidate(self, key):
         with self._lock:
@@ -36,3 +112,47 @@ class ExpiringCache(Cache):
                 del self._cache[key]
             except KeyError:
                 pass
+
+    def _sweep(self, now, limit=None):
+        # caller must hold the lock
+        heap = self._heap
+        cache = self._cache
+        removed = 0
+        while heap and heap[0][0] < now:
+            if limit is not None and removed >= limit:
+                break
+            expire_time, _, key = heapq.heappop(heap)
+            item = cache.get(key)
+            # skip heap entries left behind by updated or invalidated keys
+            if item is not None and item[0] == expire_time:
+                del cache[key]
+                removed += 1
+        self.expirations += removed
+        return removed
+
+    def _rebuild_heap(self):
+        seq = self._seq
+        self._heap = [
+            (expire_time, next(seq), key)
+            for key, (expire_time, _) in self._cache.items()
+        ]
+        heapq.heapify(self._heap)
+
+    def purge_expired(self):
+        """Remove all expired entries, return how many were removed"""
+        with self._lock:
+            return self._sweep(time.time())
+
+    def start_reaper(self, interval):
+        """Purge expired entries every interval seconds in a daemon thread"""
+        self.stop_reaper()
+        self._reaper = _Reaper(self, interval)
+        self._reaper.start()
+
+    def stop_reaper(self):
+        if self._reaper is not None:
+            self._reaper.stop()
+            self._reaper = None
+
+    def __len__(self):
+        return len(self._cache)
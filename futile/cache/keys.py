@@ -0,0 +1,174 @@
+"""
+Cache keys of function calls
+
+make_key_builder(func) inspects the signature of func once, and returns a
+function building the key of a call from its (args, kwargs), so that
+f(1, 2), f(1, b=2) and f(a=1, b=2) share one cache entry.
+
+Keys only hold the arguments given by the call, defaults are left out, so
+f(1) and f(1, 2) are two entries even if b defaults to 2.
+"""
+import inspect
+from operator import itemgetter
+
+_POSITIONAL = (
+    inspect.Parameter.POSITIONAL_ONLY,
+    inspect.Parameter.POSITIONAL_OR_KEYWORD,
+)
+
+# call shapes remembered per function, beyond that keys are built uncached,
+# for functions taking arbitrary **kwargs
+_MAX_SHAPES = 256
+
+
+def _generic_key(args, kwargs):
+    return (args, frozenset(kwargs.items())) if kwargs else args
+
+
+class _Shape(tuple):
+    """Marks keys of calls not given as a prefix of the positional parameters,
+    by the parameters they bind, so that keys pickle to the same bytes in
+    every process, see TieredCache, and never equal a tuple of arguments"""
+
+    __slots__ = ()
+    # hashed in C, only compared when not the same object
+    __hash__ = tuple.__hash__
+
+    def __eq__(self, other):
+        return type(other) is _Shape and tuple.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+
+def _make_single_key_builder(name):
+    def build_single_key(args, kwargs):
+        if not kwargs:
+            if len(args) == 1:
+                return args[0]
+        elif not args and len(kwargs) == 1 and name in kwargs:
+            return kwargs[name]
+        # func will raise TypeError, any key will do
+        return (args, frozenset(kwargs.items()))
+
+    build_single_key.single = True
+    return build_single_key
+
+
+def make_key_builder(func, key=None):
+    """Return a function building the cache key of func(*args, **kwargs)
+
+    The builder takes args and kwargs as two arguments, not unpacked.
+
+    - key : a user function called with the arguments of func, returning the
+      key, e.g. `key=lambda user, request: user.id` to ignore the request.
+
+    Keys are compared by value only, they are not hashed here.
+
+    Without kwargs the key is args itself, callers can inline that instead of
+    calling the builder, except for functions of a single parameter, keyed by
+    its value, whose builder has a true `single` attribute.
+
+    The parameters bound by a keyword call are worked out once per call shape,
+    that is the number of positional arguments and the keyword names. The
+    builder keeps them in its `plans` attribute, {names: {nargs: (shape,
+    getter)}}, for callers to inline the key of a known shape, see lru_cache.
+    """
+    if key is not None:
+        return lambda args, kwargs: key(*args, **kwargs)
+    try:
+        signature = inspect.signature(func)
+    except (TypeError, ValueError):
+        # some builtins have no signature
+        return _generic_key
+
+    npos = 0
+    var_positional = var_keyword = False
+    # name -> index among positional and keyword-only parameters
+    index_of = {}
+    index = 0
+    for param in signature.parameters.values():
+        if param.kind in _POSITIONAL or param.kind is param.KEYWORD_ONLY:
+            # positional-only parameters can not be given by keyword
+            if param.kind is not param.POSITIONAL_ONLY:
+                index_of[param.name] = index
+            if param.kind in _POSITIONAL:
+                npos += 1
+            index += 1
+        elif param.kind is param.VAR_POSITIONAL:
+            var_positional = True
+        else:
+            var_keyword = True
+
+    if npos == 1 and index == 1 and not (var_positional or var_keyword):
+        # the most common case, f(x), keyed by x itself
+        return _make_single_key_builder(next(iter(index_of), None))
+
+    # names -> nargs -> (_Shape or None, getter of the kwargs values), or None
+    # for the generic key
+    plans = {}
+    # bound parameters -> _Shape
+    shapes = {}
+
+    def plan(nargs, names):
+        """Return how to key calls of this shape, None for the generic key"""
+        if nargs > npos and not var_positional:
+            return None
+        bound = []
+        rest = []
+        for name in names:
+            index = index_of.get(name)
+            if index is None:
+                if not var_keyword:
+                    return None
+                rest.append(name)
+            elif index < nargs:
+                # given twice
+                return None
+            else:
+                bound.append((index, name))
+        bound.sort()
+        rest.sort()
+        ordered = [name for _, name in bound] + rest
+        getter = itemgetter(*ordered)
+        if len(ordered) == 1:
+            single = getter
+            getter = lambda kwargs: (single(kwargs),)
+        indexes = tuple(index for index, _ in bound)
+        if not rest and indexes == tuple(range(nargs, nargs + len(bound))) and (
+            nargs + len(bound) <= npos
+        ):
+            # same key as the positional call, f(1, b=2) is f(1, 2)
+            return None, getter
+        # f(1, c=3) and f(a=1, c=3) bind the same parameters
+        given = tuple(range(min(nargs, npos))) + indexes
+        bound_by = (given, max(nargs - npos, 0), tuple(rest))
+        shape = shapes.get(bound_by)
+        if shape is None:
+            shape = shapes[bound_by] = _Shape(bound_by)
+        return shape, getter
+
+    def build_key(args, kwargs):
+        if not kwargs:
+            return args
+        names = tuple(kwargs)
+        nargs = len(args)
+        try:
+            shape, getter = plans[names][nargs]
+        except KeyError:
+            found = plan(nargs, names)
+            if len(plans) < _MAX_SHAPES:
+                plans.setdefault(names, {})[nargs] = found
+            if found is None:
+                return _generic_key(args, kwargs)
+            shape, getter = found
+        except TypeError:
+            # func will raise TypeError, any key will do
+            return _generic_key(args, kwargs)
+        if shape is None:
+            return args + getter(kwargs)
+        return (shape, args + getter(kwargs))
+
+    build_key.plans = plans
+    return build_key
+
@@ -0,0 +1,391 @@
+"""
+Eviction policies other than the pseudo-LRU CLOCK implemented by LruCache
+
+All of them are bounded by entry count and implement the Cache interface, use
+futile.cache.make_cache to create one by policy name.
+"""
+import threading
+from collections import OrderedDict
+
+from futile.cache import Cache, LruCache, _MARKER
+
+
+class OrderedLruCache(Cache):
+    """ Implements an exact LRU algorithm on top of an OrderedDict
+
+    Every operation is O(1), but unlike LruCache get() has to take the lock,
+    since it reorders the dict.
+    """
+
+    def __init__(self, size):
+        size = int(size)
+        if size < 1:
+            raise ValueError("size must be >0")
+        self.size = size
+        self.lock = threading.Lock()
+        self.data = None
+        self.evictions = 0
+        self.hits = 0
+        self.misses = 0
+        self.lookups = 0
+        self.clear()
+
+    def clear(self):
+        """Remove all entries from the cache"""
+        with self.lock:
+            self.data = OrderedDict()
+            self.evictions = 0
+            self.hits = 0
+            self.misses = 0
+            self.lookups = 0
+
+    def get(self, key, default=None):
+        """Return value for key. If not in cache, return default"""
+        with self.lock:
+            self.lookups += 1
+            val = self.data.get(key, _MARKER)
+            if val is _MARKER:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self.data.move_to_end(key)
+            return val
+
+    def put(self, key, val):
+        """Add key to the cache with value val"""
+        with self.lock:
+            data = self.data
+            if key in data:
+                data.move_to_end(key)
+            elif len(data) >= self.size:
+                data.popitem(last=False)
+                self.evictions += 1
+            data[key] = val
+
+    def invalidate(self, key):
+        """Remove key from the cache"""
+        with self.lock:
+            self.data.pop(key, None)
+
+    def victim(self, key):
+        """Return the key that put(key, ...) would evict now"""
+        data = self.data
+        if key in data or len(data) < self.size:
+            return _MARKER
+        return next(iter(data), _MARKER)
+
+
+class SegmentedLruCache(Cache):
+    """ Implements the segmented LRU (SLRU) algorithm
+
+    New keys enter the probation segment, and are promoted to the protected
+    segment when they are hit again. Keys demoted from the protected segment go
+    back to the head of the probation segment, so a burst of one-hit keys only
+    ever evicts other probationary keys.
+    """
+
+    def __init__(self, size, protected_ratio=0.8):
+        size = int(size)
+        if size < 1:
+            raise ValueError("size must be >0")
+        if not 0 <= protected_ratio < 1:
+            raise ValueError("protected_ratio must be in [0, 1)")
+        self.size = size
+        self.protected_size = int(size * protected_ratio)
+        self.lock = threading.Lock()
+        self.probation = None
+        self.protected = None
+        self.evictions = 0
+        self.hits = 0
+        self.misses = 0
+        self.lookups = 0
+        self.clear()
+
+    def clear(self):
+        """Remove all entries from the cache"""
+        with self.lock:
+            self.probation = OrderedDict()
+            self.protected = OrderedDict()
+            self.evictions = 0
+            self.hits = 0
+            self.misses = 0
+            self.lookups = 0
+
+    def _promote(self, key, val):
+        # caller must hold the lock, and key must have left probation already
+        protected = self.protected
+        protected[key] = val
+        if len(protected) > self.protected_size:
+            demoted_key, demoted_val = protected.popitem(last=False)
+            self.probation[demoted_key] = demoted_val
+
+    def get(self, key, default=None):
+        """Return value for key. If not in cache, return default"""
+        with self.lock:
+            self.lookups += 1
+            val = self.protected.get(key, _MARKER)
+            if val is not _MARKER:
+                self.hits += 1
+                self.protected.move_to_end(key)
+                return val
+            val = self.probation.pop(key, _MARKER)
+            if val is _MARKER:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._promote(key, val)
+            return val
+
+    def put(self, key, val):
+        """Add key to the cache with value val"""
+        with self.lock:
+            if key in self.protected:
+                self.protected[key] = val
+                self.protected.move_to_end(key)
+                return
+            if self.probation.pop(key, _MARKER) is not _MARKER:
+                self._promote(key, val)
+                return
+            if len(self.probation) + len(self.protected) >= self.size:
+                if self.probation:
+                    self.probation.popitem(last=False)
+                else:
+                    self.protected.popitem(last=False)
+                self.evictions += 1
+            self.probation[key] = val
+
+    def invalidate(self, key):
+        """Remove key from the cache"""
+        with self.lock:
+            if self.probation.pop(key, _MARKER) is _MARKER:
+                self.protected.pop(key, None)
+
+    def victim(self, key):
+        """Return the key that put(key, ...) would evict now"""
+        probation, protected = self.probation, self.protected
+        if key in probation or key in protected:
+            return _MARKER
+        if len(probation) + len(protected) < self.size:
+            return _MARKER
+        return next(iter(probation or protected), _MARKER)
+
+
+_COLD = 0
+_HOT = 1
+_TEST = 2
+
+
+class _ClockProEntry:
+    __slots__ = ("key", "val", "ptype", "ref", "prev", "next")
+
+    def __init__(self, key, val, ptype):
+        self.key = key
+        self.val = val
+        self.ptype = ptype
+        self.ref = False
+        self.prev = self
+        self.next = self
+
+
+class ClockProCache(Cache):
+    """ Implements the CLOCK-Pro algorithm
+
+    Resident pages are either hot or cold, and evicted cold pages are kept on
+    the clock as non-resident test pages for a while. A cold page re-referenced
+    during its test period becomes hot, and the target size of the cold set
+    adapts to how often that happens. This keeps a scan of one-hit keys from
+    flushing the frequently used ones, which plain CLOCK cannot do.
+
+    see: Jiang, Chen and Zhang, "CLOCK-Pro: An Effective Improvement of the
+    CLOCK Replacement", USENIX 2005
+    """
+
+    def __init__(self, size):
+        size = int(size)
+        if size < 1:
+            raise ValueError("size must be >0")
+        self.size = size
+        self.lock = threading.Lock()
+        self.data = None
+        self.evictions = 0
+        self.hits = 0
+        self.misses = 0
+        self.lookups = 0
+        self.clear()
+
+    def clear(self):
+        """Remove all entries from the cache"""
+        with self.lock:
+            self.data = {}
+            self.hand_hot = None
+            self.hand_cold = None
+            self.hand_test = None
+            self.count_hot = 0
+            self.count_cold = 0
+            self.count_test = 0
+            self.cold_target = self.size
+            self.evictions = 0
+            self.hits = 0
+            self.misses = 0
+            self.lookups = 0
+
+    def get(self, key, default=None):
+        """Return value for key. If not in cache, return default"""
+        self.lookups += 1
+        entry = self.data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        # read val before ptype, the lock-free eviction sets them the other way
+        # round, so we never return the None of a fresh test page.
+        val = entry.val
+        if entry.ptype == _TEST:
+            self.misses += 1
+            return default
+        self.hits += 1
+        entry.ref = True
+        return val
+
+    def put(self, key, val):
+        """Add key to the cache with value val"""
+        with self.lock:
+            entry = self.data.get(key)
+            if entry is None:
+                self._meta_add(key, val, _COLD)
+                self.count_cold += 1
+                return
+            if entry.ptype != _TEST:
+                entry.val = val
+                entry.ref = True
+                return
+            # a test page is re-referenced, its reuse distance is small enough
+            # to make it hot, and we should have kept more cold pages.
+            if self.cold_target < self.size:
+                self.cold_target += 1
+            self.count_test -= 1
+            self._meta_del(entry)
+            self._meta_add(key, val, _HOT)
+            self.count_hot += 1
+
+    def invalidate(self, key):
+        """Remove key from the cache"""
+        with self.lock:
+            entry = self.data.get(key)
+            if entry is None:
+                return
+            if entry.ptype == _HOT:
+                self.count_hot -= 1
+            elif entry.ptype == _COLD:
+                self.count_cold -= 1
+            else:
+                self.count_test -= 1
+            self._meta_del(entry)
+
+    def victim(self, key):
+        """Return the key that put(key, ...) would evict now
+
+        This is only an estimate, the cold hand may promote or demote several
+        pages before it finally evicts one.
+        """
+        with self.lock:
+            entry = self.data.get(key)
+            if entry is not None and entry.ptype != _TEST:
+                return _MARKER
+            if self.count_hot + self.count_cold < self.size:
+                return _MARKER
+            entry = start = self.hand_cold
+            while True:
+                if entry.ptype == _COLD and not entry.ref:
+                    return entry.key
+                entry = entry.next
+                if entry is start:
+                    return _MARKER
+
+    def _meta_add(self, key, val, ptype):
+        self._evict()
+        entry = _ClockProEntry(key, val, ptype)
+        self.data[key] = entry
+        head = self.hand_hot
+        if head is None:
+            self.hand_hot = self.hand_cold = self.hand_test = entry
+            return
+        # insert right behind the hot hand, i.e. at the head of the clock
+        entry.prev = head.prev
+        entry.next = head
+        head.prev.next = entry
+        head.prev = entry
+        if self.hand_cold is self.hand_hot:
+            self.hand_cold = self.hand_cold.prev
+
+    def _meta_del(self, entry):
+        del self.data[entry.key]
+        if entry.next is entry:
+            self.hand_hot = self.hand_cold = self.hand_test = None
+            return
+        if entry is self.hand_hot:
+            self.hand_hot = entry.prev
+        if entry is self.hand_cold:
+            self.hand_cold = entry.prev
+        if entry is self.hand_test:
+            self.hand_test = entry.prev
+        entry.prev.next = entry.next
+        entry.next.prev = entry.prev
+        entry.prev = entry.next = entry
+
+    def _evict(self):
+        while self.count_hot + self.count_cold >= self.size:
+            self._run_hand_cold()
+
+    def _run_hand_cold(self):
+        entry = self.hand_cold
+        if entry.ptype == _COLD:
+            self.count_cold -= 1
+            if entry.ref:
+                entry.ptype = _HOT
+                entry.ref = False
+                self.count_hot += 1
+            else:
+                # evict the value, but remember the key as a test page
+                entry.ptype = _TEST
+                entry.val = None
+                self.count_test += 1
+                self.evictions += 1
+                while self.count_test > self.size:
+                    self._run_hand_test()
+        self.hand_cold = self.hand_cold.next
+        while self.count_hot > self.size - self.cold_target:
+            self._run_hand_hot()
+
+    def _run_hand_hot(self):
+        if self.hand_hot is self.hand_test:
+            self._run_hand_test()
+        entry = self.hand_hot
+        if entry.ptype == _HOT:
+            if entry.ref:
+                entry.ref = False
+            else:
+                entry.ptype = _COLD
+                self.count_hot -= 1
+                self.count_cold += 1
+        self.hand_hot = self.hand_hot.next
+
+    def _run_hand_test(self):
+        # NOTE the paper lets the test hand push the cold hand ahead here, but
+        # that recurses forever on tiny clocks, where all hands share a page.
+        entry = self.hand_test
+        if entry.ptype == _TEST:
+            # the test period is over without a re-reference, we should have
+            # kept fewer cold pages.
+            self.count_test -= 1
+            self._meta_del(entry)
+            if self.cold_target > 1:
+                self.cold_target -= 1
+        self.hand_test = self.hand_test.next
+
+
+POLICIES = {
+    "clock": LruCache,
+    "lru": OrderedLruCache,
+    "slru": SegmentedLruCache,
+    "clock-pro": ClockProCache,
+}
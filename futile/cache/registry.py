@@ -0,0 +1,161 @@
+"""
+Registry of named caches, reporting their stats periodically
+
+    >>> registry.register("user", get_user._cache, get_user._load_stats)
+    >>> registry.start_reporter(60)
+
+Every interval, the reporter emits one gauge per stat and cache through
+futile.metrics2, tagged with cache=<name>, e.g. `cache.hit_ratio,cache=user`.
+"""
+import threading
+import time
+
+from futile.cache import cache_stats
+from futile.log import get_logger
+
+# gauges emitted for every cache, see CacheRegistry.snapshot
+_GAUGES = (
+    "hit_ratio",
+    "eviction_rate",
+    "size",
+    "lock_wait",
+    "load_latency",
+)
+
+
+def _delta(current, previous):
+    # counters are reset by clear(), start over from 0 then
+    return current - previous if current >= previous else current
+
+
+class CacheRegistry(object):
+    """ Named caches, and their stats since the last snapshot
+
+    Rates and ratios are computed over the interval between two snapshot()
+    calls, so they reflect the recent behavior of a cache, not its whole life.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # name -> (cache, load_stats)
+        self._caches = {}
+        # name -> (time, stats) of the last snapshot
+        self._last = {}
+        self._reporter = None
+        self._should_stop = threading.Event()
+        self._logger = get_logger("cache_registry")
+
+    def register(self, name, cache, load_stats=None):
+        """Register cache under name
+
+        cache may also be a function decorated by lru_cache, its cache and
+        load stats are then registered.
+        """
+        if load_stats is None:
+            load_stats = getattr(cache, "_load_stats", None)
+        cache = getattr(cache, "_cache", cache)
+        with self._lock:
+            if name in self._caches:
+                raise KeyError("cache %s already registered" % name)
+            self._caches[name] = (cache, load_stats)
+
+    def unregister(self, name):
+        with self._lock:
+            self._caches.pop(name, None)
+            self._last.pop(name, None)
+
+    def names(self):
+        """Return the names of all registered caches"""
+        with self._lock:
+            return list(self._caches)
+
+    def get(self, name):
+        """Return the cache registered under name"""
+        with self._lock:
+            return self._caches[name][0]
+
+    def snapshot(self):
+        """Return a dict of stats per cache name, since the last snapshot
+
+        - hit_ratio : hits / lookups, None without lookups
+        - eviction_rate : evictions per second
+        - size : number of entries
+        - lock_wait : seconds spent waiting for the cache lock
+        - load_latency : mean seconds of the decorated function on a miss,
+          None without loads
+
+        The raw counters of cache_stats are included as well.
+        """
+        with self._lock:
+            caches = list(self._caches.items())
+        now = time.time()
+        snapshot = {}
+        for name, (cache, load_stats) in caches:
+            stats = cache_stats(cache, load_stats)
+            last_time, last = self._last.get(name, (None, None))
+            self._last[name] = (now, stats)
+            if last is None:
+                last = dict.fromkeys(stats, 0)
+            lookups = _delta(stats["lookups"], last["lookups"])
+            hits = _delta(stats["hits"], last["hits"])
+            loads = _delta(stats["loads"], last["loads"])
+            load_time = _delta(stats["load_time"], last["load_time"])
+            evictions = _delta(stats["evictions"], last["evictions"])
+            elapsed = now - last_time if last_time is not None else None
+            snapshot[name] = dict(
+                stats,
+                hit_ratio=hits / lookups if lookups else None,
+                eviction_rate=evictions / elapsed if elapsed else None,
+                size=stats["length"],
+                lock_wait=_delta(stats["lock_wait"], last["lock_wait"]),
+                load_latency=load_time / loads if loads else None,
+            )
+        return snapshot
+
+    def emit(self, emitter=None):
+        """Take a snapshot and emit its gauges
+
+        emitter is a futile.metrics2.MetricsEmitter, the one set up by
+        metrics2.init by default.
+        """
+        if emitter is None:
+            from futile import metrics2
+
+            emitter = metrics2
+        snapshot = self.snapshot()
+        for name, stats in snapshot.items():
+            tags = {"cache": name}
+            for gauge in _GAUGES:
+                value = stats[gauge]
+                if value is not None:
+                    emitter.emit_store("cache." + gauge, value, tags=tags)
+        return snapshot
+
+    def _report(self, interval, emitter):
+        while not self._should_stop.wait(interval):
+            try:
+                self.emit(emitter)
+            except Exception as e:
+                self._logger.exception("reporting cache stats failed: %s", e)
+
+    def start_reporter(self, interval, emitter=None):
+        """Emit the stats every interval seconds in a daemon thread"""
+        self.stop_reporter()
+        self._should_stop.clear()
+        self._reporter = threading.Thread(
+            target=self._report,
+            args=(interval, emitter),
+            name="cache-stats",
+            daemon=True,
+        )
+        self._reporter.start()
+
+    def stop_reporter(self):
+        if self._reporter is not None:
+            self._should_stop.set()
+            self._reporter.join()
+            self._reporter = None
+
+
+# the default registry
+registry = CacheRegistry()
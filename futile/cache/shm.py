@@ -0,0 +1,210 @@
+"""
+Cache shared by forked worker processes
+
+Entries live in fixed-size slots of a shared memory block, so a value loaded
+by one worker is a hit in all the others.
+"""
+import hashlib
+import mmap
+import multiprocessing as mp
+import pickle
+import random
+import struct
+import time
+from multiprocessing import shared_memory
+
+from futile.cache import Cache
+
+# seq, key hash, expires, key length, value length
+_HEADER = struct.Struct("<IQdII")
+_SEQ = struct.Struct("<I")
+# seq wraps around, keeping its parity
+_SEQ_MASK = 0xFFFFFFFF
+_PICKLE_PROTOCOL = 4
+_MAX_READ_RETRIES = 1000
+
+
+def _hash_key(key_bytes):
+    # hash() of str is randomized per interpreter, we need a stable one
+    return int.from_bytes(hashlib.blake2b(key_bytes, digest_size=8).digest(), "little")
+
+
+class SharedMemoryCache(Cache):
+    """ Set-associative cache in shared memory
+
+    Keys and values are pickled into slots of slot_size bytes, including a
+    small header, entries that do not fit are not cached. A key can only live in
+    one of the `ways` slots of its bucket, a random one of them is evicted
+    when the bucket is full.
+
+    Reads are lock-free: every slot has a sequence number which writers make
+    odd while they are writing, and readers retry when it changed under them.
+    Writers are serialized by a multiprocessing.Lock.
+
+    By default the memory is an anonymous mmap, so the cache has to be created
+    before forking the workers, e.g. before process.run_process. Give a `name`
+    to use a multiprocessing.shared_memory block instead, which unrelated
+    processes can attach to with create=False.
+
+    hits, misses and lookups are counted per process.
+    """
+
+    def __init__(
+        self,
+        size,
+        slot_size=1024,
+        ways=4,
+        default_timeout=None,
+        name=None,
+        create=True,
+        lock=None,
+    ):
+        size = int(size)
+        if size < 1:
+            raise ValueError("size must be >0")
+        if slot_size <= _HEADER.size:
+            raise ValueError("slot_size must be >%d" % _HEADER.size)
+        self.ways = ways
+        self.buckets = -(-size // ways)  # ceil division
+        self.size = self.buckets * ways
+        self.slot_size = slot_size
+        self.default_timeout = default_timeout
+        self.lock = lock if lock is not None else mp.Lock()
+        length = self.size * slot_size
+        if name is None:
+            self._shm = None
+            self._mmap = mmap.mmap(-1, length)
+            self._buf = memoryview(self._mmap)
+        else:
+            self._shm = shared_memory.SharedMemory(
+                name=name, create=create, size=length
+            )
+            self._mmap = None
+            self._buf = self._shm.buf
+        self.oversize = 0
+        self.hits = 0
+        self.misses = 0
+        self.lookups = 0
+
+    def _bucket(self, key_hash):
+        first = (key_hash % self.buckets) * self.ways
+        return range(first, first + self.ways)
+
+    def _read(self, slot, key_hash):
+        """Return (expires, payload, key_length) of slot if it holds key_hash"""
+        buf = self._buf
+        offset = slot * self.slot_size
+        for _ in range(_MAX_READ_RETRIES):
+            seq, slot_hash, expires, key_len, val_len = _HEADER.unpack_from(buf, offset)
+            if seq & 1:
+                # a writer is busy with this slot
+                continue
+            if slot_hash != key_hash or not key_len:
+                return None
+            start = offset + _HEADER.size
+            payload = bytes(buf[start : start + key_len + val_len])
+            if _SEQ.unpack_from(buf, offset)[0] == seq:
+                return expires, payload, key_len
+        # the writer probably died in the middle of writing, treat as a miss
+        return None
+
+    def _write(self, slot, key_hash, expires, key_bytes, val_bytes):
+        # caller must hold the lock
+        buf = self._buf
+        offset = slot * self.slot_size
+        seq = _SEQ.unpack_from(buf, offset)[0]
+        writing = (seq + 1) & _SEQ_MASK
+        _SEQ.pack_into(buf, offset, writing)
+        start = offset + _HEADER.size
+        payload = key_bytes + val_bytes
+        buf[start : start + len(payload)] = payload
+        _HEADER.pack_into(
+            buf, offset, writing, key_hash, expires, len(key_bytes), len(val_bytes)
+        )
+        _SEQ.pack_into(buf, offset, (seq + 2) & _SEQ_MASK)
+
+    def _find(self, key_bytes, key_hash):
+        """Return (slot, expires, value bytes) of key, or None"""
+        for slot in self._bucket(key_hash):
+            found = self._read(slot, key_hash)
+            if found is None:
+                continue
+            expires, payload, key_len = found
+            if payload[:key_len] == key_bytes:
+                return slot, expires, payload[key_len:]
+        return None
+
+    def clear(self):
+        """Remove all entries from the cache"""
+        with self.lock:
+            for slot in range(self.size):
+                self._write(slot, 0, 0, b"", b"")
+
+    def get(self, key, default=None):
+        """Return value for key. If not in cache or expired, return default"""
+        self.lookups += 1
+        key_bytes = pickle.dumps(key, _PICKLE_PROTOCOL)
+        found = self._find(key_bytes, _hash_key(key_bytes))
+        if found is None or (found[1] and found[1] <= time.time()):
+            self.misses += 1
+            return default
+        self.hits += 1
+        return pickle.loads(found[2])
+
+    def put(self, key, val, timeout=None):
+        """Add key to the cache with value val
+
+        key will expire in $timeout seconds, or never if no timeout is given
+        here or as default_timeout.
+        """
+        if timeout is None:
+            timeout = self.default_timeout
+        expires = time.time() + timeout if timeout is not None else 0
+        key_bytes = pickle.dumps(key, _PICKLE_PROTOCOL)
+        val_bytes = pickle.dumps(val, _PICKLE_PROTOCOL)
+        key_hash = _hash_key(key_bytes)
+        if _HEADER.size + len(key_bytes) + len(val_bytes) > self.slot_size:
+            self.oversize += 1
+            # do not keep serving an older value
+            self.invalidate(key)
+            return
+        with self.lock:
+            found = self._find(key_bytes, key_hash)
+            if found is not None:
+                slot = found[0]
+            else:
+                slot = self._free_slot(key_hash)
+            self._write(slot, key_hash, expires, key_bytes, val_bytes)
+
+    def _free_slot(self, key_hash):
+        # caller must hold the lock
+        buf = self._buf
+        now = time.time()
+        bucket = self._bucket(key_hash)
+        for slot in bucket:
+            _, _, expires, key_len, _ = _HEADER.unpack_from(buf, slot * self.slot_size)
+            if not key_len or (expires and expires <= now):
+                return slot
+        return random.choice(bucket)
+
+    def invalidate(self, key):
+        """Remove key from the cache"""
+        key_bytes = pickle.dumps(key, _PICKLE_PROTOCOL)
+        key_hash = _hash_key(key_bytes)
+        with self.lock:
+            found = self._find(key_bytes, key_hash)
+            if found is not None:
+                self._write(found[0], 0, 0, b"", b"")
+
+    def close(self):
+        """Detach from the shared memory"""
+        self._buf.release()
+        if self._mmap is not None:
+            self._mmap.close()
+        else:
+            self._shm.close()
+
+    def unlink(self):
+        """Destroy a named shared memory block"""
+        if self._shm is not None:
+            self._shm.unlink()
@@ -0,0 +1,289 @@
+"""
+Two-tier cache, an in-process cache in front of Redis
+"""
+import hashlib
+import pickle
+import threading
+import time
+import uuid
+
+from futile.cache import Cache, ExpiringLruCache, _MARKER
+from futile.log import get_logger
+
+_PICKLE_PROTOCOL = 4
+# cached in L1 for keys missing from Redis, never stored in Redis
+_NEGATIVE = object()
+# invalidation counters, keys share them by hash
+_GENERATION_SLOTS = 256
+
+
+class TieredCache(Cache):
+    """ Caches values in process (L1) and in Redis (L2)
+
+    Misses of L1 are looked up in Redis, and misses of both are remembered in L1
+    as well (negative caching), so that missing keys do not hit Redis on every
+    call. Values are pickled in Redis.
+
+    Every put() or invalidate() is published on a Redis channel, run
+    start_listener() so that the L1 caches of other processes and pods drop the
+    stale copies. Without it, L1 copies are only as fresh as l1_timeout.
+
+    - client : a redis.StrictRedis, from redis.make_redis_client by default
+
+    - l1 : the in-process cache, an ExpiringLruCache of l1_size entries
+      expiring after l1_timeout seconds by default. Keys of l1 are the Redis
+      keys, i.e. strings.
+
+    - timeout : expiration time of keys in Redis, never by default. An
+      expiring L1 keeps the values put() no longer than Redis does.
+
+    - negative_timeout : how long L1 remembers missing keys, needs an
+      expiring L1 cache. The default timeout of L1 if not set.
+
+    An invalidation may arrive while a value is being read from Redis, the
+    value read is then returned but not kept in L1, it may be the stale one.
+    """
+
+    def __init__(
+        self,
+        client=None,
+        l1=None,
+        *,
+        prefix="cache:",
+        timeout=None,
+        l1_size=1024,
+        l1_timeout=60,
+        negative_timeout=None,
+        channel=None,
+    ):
+        if client is None:
+            from futile.redis import make_redis_client
+
+            client = make_redis_client()
+        if l1 is None:
+            l1 = ExpiringLruCache(l1_size, default_timeout=l1_timeout)
+        self.client = client
+        self.l1 = l1
+        self.prefix = prefix
+        self.timeout = timeout
+        self.negative_timeout = negative_timeout
+        self.channel = channel if channel is not None else prefix + "invalidations"
+        # messages we published ourselves are skipped by the listener
+        self._origin = uuid.uuid4().hex
+        # bumped by every invalidation of the keys of a slot, and by clear
+        self._generations = [0] * _GENERATION_SLOTS
+        self._clears = 0
+        self._listener = None
+        self._should_stop = False
+        self._logger = get_logger("tiered_cache")
+        self.l1_hits = 0
+        self.l2_hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.lookups = 0
+
+    @property
+    def hits(self):
+        return self.l1_hits + self.l2_hits
+
+    def _redis_key(self, key):
+        if isinstance(key, str):
+            return self.prefix + key
+        digest = hashlib.sha1(pickle.dumps(key, _PICKLE_PROTOCOL)).hexdigest()
+        return self.prefix + digest
+
+    def _generation(self, rkey):
+        return self._clears, self._generations[hash(rkey) % _GENERATION_SLOTS]
+
+    def _bump(self, rkey):
+        self._generations[hash(rkey) % _GENERATION_SLOTS] += 1
+
+    def _l1_put(self, rkey, val, timeout=None):
+        if timeout is None:
+            self.l1.put(rkey, val)
+        else:
+            self.l1.put(rkey, val, timeout)
+
+    def _l1_timeout(self, timeout):
+        """Timeout of the L1 copy of a value expiring from Redis in timeout
+        seconds, None for the default of L1"""
+        default = getattr(self.l1, "default_timeout", None)
+        if timeout is None or default is None or default <= timeout:
+            return None
+        return timeout
+
+    def _l1_fill(self, rkey, val, generation, timeout=None):
+        """Keep val read from Redis in L1, unless rkey was invalidated since"""
+        if self._generation(rkey) == generation:
+            self._l1_put(rkey, val, timeout)
+
+    def get(self, key, default=None):
+        """Return value for key. If not in cache, return default"""
+        self.lookups += 1
+        rkey = self._redis_key(key)
+        val = self.l1.get(rkey, _MARKER)
+        if val is _NEGATIVE:
+            self.negative_hits += 1
+            self.misses += 1
+            return default
+        if val is not _MARKER:
+            self.l1_hits += 1
+            return val
+        generation = self._generation(rkey)
+        raw = self.client.get(rkey)
+        if raw is None:
+            self.misses += 1
+            self._l1_fill(rkey, _NEGATIVE, generation, self.negative_timeout)
+            return default
+        self.l2_hits += 1
+        val = pickle.loads(raw)
+        self._l1_fill(rkey, val, generation)
+        return val
+
+    def get_many(self, keys):
+        """Return a dict of the values of keys found in the cache
+
+        Keys missing from L1 are fetched from Redis in one MGET round trip.
+        """
+        result = {}
+        missing = []
+        for key in keys:
+            self.lookups += 1
+            rkey = self._redis_key(key)
+            val = self.l1.get(rkey, _MARKER)
+            if val is _NEGATIVE:
+                self.negative_hits += 1
+                self.misses += 1
+            elif val is not _MARKER:
+                self.l1_hits += 1
+                result[key] = val
+            else:
+                missing.append((key, rkey, self._generation(rkey)))
+        if not missing:
+            return result
+        raws = self.client.mget([rkey for _, rkey, _ in missing])
+        for (key, rkey, generation), raw in zip(missing, raws):
+            if raw is None:
+                self.misses += 1
+                self._l1_fill(rkey, _NEGATIVE, generation, self.negative_timeout)
+            else:
+                self.l2_hits += 1
+                val = result[key] = pickle.loads(raw)
+                self._l1_fill(rkey, val, generation)
+        return result
+
+    def put(self, key, val, timeout=None):
+        """Add key to the cache with value val, in both L1 and Redis
+
+        key will expire in Redis in $timeout seconds, or as set in the
+        constructor.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        rkey = self._redis_key(key)
+        pipe = self.client.pipeline()
+        pipe.set(rkey, pickle.dumps(val, _PICKLE_PROTOCOL), ex=timeout)
+        pipe.publish(self.channel, "%s %s" % (self._origin, rkey))
+        pipe.execute()
+        self._bump(rkey)
+        self._l1_put(rkey, val, self._l1_timeout(timeout))
+
+    def put_many(self, mapping, timeout=None):
+        """Add all the key, value pairs of mapping to the cache, in one Redis
+        round trip"""
+        if timeout is None:
+            timeout = self.timeout
+        items = [(self._redis_key(key), val) for key, val in mapping.items()]
+        pipe = self.client.pipeline()
+        for rkey, val in items:
+            pipe.set(rkey, pickle.dumps(val, _PICKLE_PROTOCOL), ex=timeout)
+            pipe.publish(self.channel, "%s %s" % (self._origin, rkey))
+        pipe.execute()
+        l1_timeout = self._l1_timeout(timeout)
+        for rkey, val in items:
+            self._bump(rkey)
+            self._l1_put(rkey, val, l1_timeout)
+
+    def invalidate(self, key):
+        """Remove key from the cache, in Redis and in all L1 caches"""
+        rkey = self._redis_key(key)
+        pipe = self.client.pipeline()
+        pipe.delete(rkey)
+        pipe.publish(self.channel, "%s %s" % (self._origin, rkey))
+        pipe.execute()
+        self._bump(rkey)
+        self.l1.invalidate(rkey)
+
+    def invalidate_many(self, keys):
+        """Remove keys from the cache, in one Redis round trip"""
+        rkeys = [self._redis_key(key) for key in keys]
+        pipe = self.client.pipeline()
+        for rkey in rkeys:
+            pipe.delete(rkey)
+            pipe.publish(self.channel, "%s %s" % (self._origin, rkey))
+        pipe.execute()
+        for rkey in rkeys:
+            self._bump(rkey)
+            self.l1.invalidate(rkey)
+
+    def clear(self):
+        """Remove all entries under prefix from Redis, and clear all L1 caches"""
+        pipe = self.client.pipeline()
+        for rkey in self.client.scan_iter(match=self.prefix + "*"):
+            pipe.delete(rkey)
+        pipe.publish(self.channel, "%s *" % self._origin)
+        pipe.execute()
+        self._clears += 1
+        self.l1.clear()
+
+    def _handle_message(self, data):
+        if isinstance(data, bytes):
+            data = data.decode("utf-8")
+        origin, _, rkey = data.partition(" ")
+        if origin == self._origin:
+            return
+        if rkey == "*":
+            self._clears += 1
+            self.l1.clear()
+        else:
+            self._bump(rkey)
+            self.l1.invalidate(rkey)
+
+    def _listen(self):
+        while not self._should_stop:
+            pubsub = None
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                # invalidations published while we were disconnected are lost
+                self._clears += 1
+                self.l1.clear()
+                while not self._should_stop:
+                    message = pubsub.get_message(timeout=1.0)
+                    if message is not None and message["type"] == "message":
+                        self._handle_message(message["data"])
+            except Exception as e:
+                self._logger.exception("invalidation listener error %s", e)
+                time.sleep(1)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+
+    def start_listener(self):
+        """Apply invalidations published by other processes in a daemon thread"""
+        if self._listener is not None:
+            return
+        self._should_stop = False
+        self._listener = threading.Thread(
+            target=self._listen, name="cache-invalidations", daemon=True
+        )
+        self._listener.start()
+
+    def stop_listener(self):
+        self._should_stop = True
+        if self._listener is not None:
+            self._listener.join()
+            self._listener = None
@@ -0,0 +1,185 @@
+"""
+W-TinyLFU admission policy
+
+see: Einziger, Friedman and Manes, "TinyLFU: A Highly Efficient Cache Admission
+Policy", ACM Transactions on Storage 2017
+"""
+import threading
+from collections import OrderedDict
+
+from futile.cache import Cache, _MARKER
+
+
+_MASK64 = (1 << 64) - 1
+# odd 64 bit constants for multiplicative hashing, one per sketch row
+_SEEDS = (
+    0x9E3779B97F4A7C15,
+    0xC2B2AE3D27D4EB4F,
+    0x165667B19E3779F9,
+    0xD6E8FEB86659FD93,
+)
+# lookup table to halve all the counters at once with bytes.translate
+_HALVE = bytes(i >> 1 for i in range(256))
+
+
+class CountMinSketch:
+    """ Approximate frequency counter with 4 bit saturating counters
+
+    After sample_size increments all the counters are halved, so the sketch
+    follows changes of the popularity of keys.
+    """
+
+    MAX_COUNT = 15
+
+    def __init__(self, width, sample_size=None, depth=4):
+        if depth < 1 or depth > len(_SEEDS):
+            raise ValueError("depth must be in [1, %d]" % len(_SEEDS))
+        # round width up to a power of 2, so that rows can be indexed by the
+        # high bits of the hash. Tiny sketches are all collisions, so we use
+        # at least 1024 counters per row.
+        bits = max(10, (int(width) - 1).bit_length())
+        self.width = 1 << bits
+        self.depth = depth
+        self.sample_size = sample_size or 10 * self.width
+        self._shift = 64 - bits
+        self._seeds = _SEEDS[:depth]
+        self.additions = 0
+        self.resets = 0
+        self.table = None
+        self.clear()
+
+    def clear(self):
+        self.table = bytearray(self.width * self.depth)
+        self.additions = 0
+
+    def _indexes(self, key):
+        h = hash(key) & _MASK64
+        # spread the bits first, hash() of ints is the int itself
+        h = ((h ^ (h >> 33)) * 0xFF51AFD7ED558CCD) & _MASK64
+        h ^= h >> 33
+        shift = self._shift
+        width = self.width
+        return [
+            row * width + (((h * seed) & _MASK64) >> shift)
+            for row, seed in enumerate(self._seeds)
+        ]
+
+    def increment(self, key):
+        table = self.table
+        for idx in self._indexes(key):
+            if table[idx] < self.MAX_COUNT:
+                table[idx] += 1
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            self.reset()
+
+    def estimate(self, key):
+        table = self.table
+        return min(table[idx] for idx in self._indexes(key))
+
+    def reset(self):
+        """Age the sketch by halving all the counters"""
+        self.table = bytearray(self.table.translate(_HALVE))
+        self.additions //= 2
+        self.resets += 1
+
+
+class TinyLfuCache(Cache):
+    """ Puts a W-TinyLFU admission filter in front of another cache
+
+    New keys first go to a small LRU window. When a key is pushed out of the
+    window, it only enters the main cache if the sketch says it has been used
+    more often than the key the main cache would evict for it, see
+    Cache.victim(). So one-hit keys never push hot keys out of the main cache.
+
+    Keys are only counted in get(), which is what the lru_cache decorator calls
+    on every invocation.
+    """
+
+    def __init__(self, cache, size=None, window_size=None, sample_size=None):
+        if size is None:
+            size = getattr(cache, "size", None)
+        if size is None:
+            raise ValueError("size must be given for caches without a size")
+        size = int(size)
+        if size < 1:
+            raise ValueError("size must be >0")
+        if window_size is None:
+            window_size = max(1, size // 100)
+        self.cache = cache
+        self.size = size
+        self.window_size = window_size
+        self.sketch = CountMinSketch(size, sample_size)
+        self.lock = threading.Lock()
+        self.window = None
+        self.admissions = 0
+        self.rejections = 0
+        self.hits = 0
+        self.misses = 0
+        self.lookups = 0
+        self.clear()
+
+    @property
+    def evictions(self):
+        return self.rejections + getattr(self.cache, "evictions", 0)
+
+    def clear(self):
+        """Remove all entries from the cache"""
+        with self.lock:
+            self.window = OrderedDict()
+            self.sketch.clear()
+            self.admissions = 0
+            self.rejections = 0
+            self.hits = 0
+            self.misses = 0
+            self.lookups = 0
+        self.cache.clear()
+
+    def get(self, key, default=None):
+        """Return value for key. If not in cache, return default"""
+        self.lookups += 1
+        self.sketch.increment(key)
+        with self.lock:
+            val = self.window.get(key, _MARKER)
+            if val is not _MARKER:
+                self.window.move_to_end(key)
+        if val is _MARKER:
+            val = self.cache.get(key, _MARKER)
+        if val is _MARKER:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return val
+
+    def put(self, key, val):
+        """Add key to the cache with value val"""
+        cache = self.cache
+        with self.lock:
+            window = self.window
+            if key in window:
+                window[key] = val
+                window.move_to_end(key)
+                return
+            if cache.victim(key) is _MARKER:
+                # key is in the main cache already, or there is room for it
+                cache.put(key, val)
+                return
+            window[key] = val
+            if len(window) <= self.window_size:
+                return
+            candidate, candidate_val = window.popitem(last=False)
+            victim = cache.victim(candidate)
+            sketch = self.sketch
+            if victim is _MARKER or sketch.estimate(candidate) > sketch.estimate(
+                victim
+            ):
+                self.admissions += 1
+                cache.put(candidate, candidate_val)
+            else:
+                self.rejections += 1
+
+    def invalidate(self, key):
+        """Remove key from the cache"""
+        with self.lock:
+            self.window.pop(key, None)
+        self.cache.invalidate(key)
@@ -21,6 +21,7 @@ import pickle
 from functools import wraps
 from multiprocessing.pool import Pool
 
+from .cache.keys import make_key_builder
 from .timeutil import parse_time_string
 
 
@@ -134,9 +135,15 @@ class memoized:
     def __init__(self, fn):
         self.fn = fn
         self.memo = {}
+        self._build_key = make_key_builder(fn)
 
     def __call__(self, *args, **kwargs):
-        key = pickle.dumps(args) + pickle.dumps(kwargs)
+        key = self._build_key(args, kwargs)
+        try:
+            hash(key)
+        except TypeError:
+            # unhashable args, e.g. lists, are still supported by value
+            key = pickle.dumps(args) + pickle.dumps(kwargs)
         if key not in self.memo:
             logging.debug("miss")
             self.memo[key] = self.fn(*args, **kwargs)
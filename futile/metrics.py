@@ -4,6 +4,8 @@ warnings.warn("Use StatsD instead", DeprecationWarning, stacklevel=2)
 
 import os
 import json
+import queue
+import random
 import sys
 import signal
 import time
@@ -12,6 +14,7 @@ import concurrent.futures
 import multiprocessing as mp
 import threading
 import socket
+import weakref
 from influxdb import InfluxDBClient
 from typing import Any
 
@@ -21,6 +24,7 @@ from futile.aio import aio_wrap
 from futile.log import get_logger
 from futile.queues import queue_mget
 from futile.process import run_process
+from futile.sketch import DDSketch
 
 _inited_pid = None
 _metrics_queue = mp.Queue()
@@ -31,12 +35,43 @@ _executor = concurrent.futures.ThreadPoolExecutor(
 )
 _directly = False
 _emitter = None
+_local = None
+_buffer = None
+_emit_thread = None
+_drain_timeout = 1
+
+
+def _sketch_fields(sketch):
+    return dict(
+        p50=sketch.quantile(0.5),
+        p90=sketch.quantile(0.9),
+        p99=sketch.quantile(0.99),
+        max=sketch.max,
+        count=sketch.count,
+        sum=sketch.sum,
+    )
 
 
 class MetricsEmitter:
     def __init__(
-        self, influxdb, prefix, *, batch_size=1024, max_timer_seq=128, emit_interval=60
+        self,
+        influxdb,
+        prefix,
+        *,
+        batch_size=1024,
+        max_timer_seq=128,
+        emit_interval=60,
+        timer_sketch=False,
+        timer_accuracy=0.01,
     ):
+        """
+        timer_sketch: summarize timers of every emit_interval into a sketch,
+            emitted as one point with p50, p90, p99, max, count and sum fields,
+            instead of emitting up to max_timer_seq raw points per millisecond.
+            The sketches are written by a flusher thread every emit_interval
+            seconds, and by close().
+        timer_accuracy: relative accuracy of the quantiles of timer_sketch
+        """
         self.pending_timestamp = 0
         self.pending_points = []
         self.batch = []
@@ -51,6 +86,12 @@ class MetricsEmitter:
         self.last_emit_ts = time.time()
         # 提交间隔
         self.emit_interval = emit_interval
+        self.timer_sketch = timer_sketch
+        self.timer_accuracy = timer_accuracy
+        # (measurement, sorted tags) -> DDSketch of the current interval
+        self.sketches = {}
+        self._flusher_pid = None
+        self._should_stop = threading.Event()
 
     def define_tagkv(self, tagk, tagvs):
         self.tagkv[tagk] = set(tagvs)
@@ -88,6 +129,55 @@ class MetricsEmitter:
         new_points.extend(counters.values())
         return new_points
 
+    def _start_flusher(self):
+        # once per process, the thread of the parent does not survive fork
+        self._flusher_pid = os.getpid()
+        self._should_stop = threading.Event()
+        thread = threading.Thread(
+            target=self._flush_loop, name="metrics-sketch", daemon=True
+        )
+        thread.start()
+
+    def _flush_loop(self):
+        while not self._should_stop.wait(self.emit_interval):
+            try:
+                self.flush_sketches()
+            except Exception as e:
+                get_logger("metrics").exception(e)
+
+    def flush_sketches(self):
+        """Write the points summarizing the timers since the last call"""
+        with self.lock:
+            points = self._sketch_points()
+            if points:
+                self.write_points(points)
+
+    def _record_timer(self, point):
+        if self._flusher_pid != os.getpid():
+            self._start_flusher()
+        key = (point["measurement"], tuple(sorted(point["tags"].items())))
+        sketch = self.sketches.get(key)
+        if sketch is None:
+            sketch = self.sketches[key] = DDSketch(self.timer_accuracy)
+        sketch.add(point["fields"]["_duration"])
+
+    def _sketch_points(self):
+        """Points summarizing the timers since the last call"""
+        sketches, self.sketches = self.sketches, {}
+        timestamp = int(time.time() * 1000)
+        points = []
+        for (measurement, tags), sketch in sketches.items():
+            fields = _sketch_fields(sketch)
+            points.append(
+                dict(
+                    measurement=measurement,
+                    tags=dict(tags),
+                    fields=fields,
+                    time=timestamp,
+                )
+            )
+        return points
+
     def _try_emit(self, point):
         """
         pending 表示当前时间戳内的点
@@ -95,7 +185,12 @@ class MetricsEmitter:
 
         如果新的点和当前时间戳不一样了,那就把当前时间戳的点累加后放到 batch
         如果batch 中有足够的点, 打点
+
+        timer_sketch 时, timer 的点只记入 sketch, 由 flush_sketches 定时提交
         """
+        if self.timer_sketch and point["tags"].get("_type") == "timer":
+            self._record_timer(point)
+            return []
         # 如果和当前 pending 时间一致, 继续累加
         if point["time"] == self.pending_timestamp:
             self.pending_points.append(point)
@@ -131,6 +226,7 @@ class MetricsEmitter:
         return to_send_points
 
     def close(self):
+        self._should_stop.set()
         if _debug:
             sys.stderr.write(
                 "start draining points %s\n" % json.dumps(self.pending_points, indent=4)
@@ -139,21 +235,15 @@ class MetricsEmitter:
         points = self._accumulate_points(self.pending_points)
         if self.batch:
             points.extend(self.batch)
+        if self.sketches:
+            points.extend(self._sketch_points())
         if _debug:
             sys.stderr.write(
                 "final points %s\n" % json.dumps(self.pending_points, indent=4)
             )
             sys.stderr.flush()
         if points:
-            for chunk in chunked(self.batch_size, points):
-                try:
-                    self.influxdb.write_points(chunk, time_precision="ms")
-                except Exception as e:
-                    import traceback
-
-                    ex = traceback.format_exc()
-                    sys.stderr.write("%s error writing points %s" % (time.time(), ex))
-                    sys.stderr.flush()
+            self.write_points(points)
         try:
             self.influxdb.close()
         except Exception:
@@ -261,12 +351,38 @@ class MetricsEmitter:
         with self.lock:
             points = self._try_emit(point)
             if points:
-                for chunk in chunked(self.batch_size, points):
-                    try:
-                        self.influxdb.write_points(chunk, time_precision="ms")
-                    except Exception as e:
-                        sys.stderr.write("%s error writing points\n" % time.time())
-                        sys.stderr.flush()
+                self.write_points(points)
+
+    def write_points(self, points):
+        """Write already aggregated points, in batches"""
+        for chunk in chunked(self.batch_size, points):
+            try:
+                self.influxdb.write_points(chunk, time_precision="ms")
+            except Exception as e:
+                import traceback
+
+                ex = traceback.format_exc()
+                sys.stderr.write("%s error writing points %s" % (time.time(), ex))
+                sys.stderr.flush()
+
+    def emit_packed(self, block):
+        """Emit a block of points packed by _PointBuffer"""
+        getters = dict(
+            any=self.get_point,
+            counter=self.get_counter_point,
+            timer=self.get_timer_point,
+            store=self.get_store_point,
+        )
+        with self.lock:
+            for kind, args, kwargs in block:
+                try:
+                    point = getters[kind](*args, **kwargs)
+                except Exception as e:
+                    get_logger("metrics emitter").exception(e)
+                    continue
+                points = self._try_emit(point)
+                if points:
+                    self.write_points(points)
 
     def emit_any(self, *args, **kwargs):
         point = self.get_point(*args, **kwargs)
@@ -285,11 +401,379 @@ class MetricsEmitter:
         self.emit(point)
 
 
+class _ThreadBuffer:
+    """Metrics of one thread, only ever written by that thread"""
+
+    def __init__(self):
+        self.thread = threading.current_thread()
+        self.counters = {}
+        self.timers = {}
+        self.stores = {}
+
+    def swap(self):
+        counters, self.counters = self.counters, {}
+        timers, self.timers = self.timers, {}
+        stores, self.stores = self.stores, {}
+        return counters, timers, stores
+
+
+class ThreadLocalMetrics:
+    """
+    Buffers metrics per thread, merged and written by one flusher thread
+
+    Emitting a counter is a dict increment in a buffer of the calling thread,
+    without any lock or pickling. Timers go into a DDSketch per key, and are
+    written like MetricsEmitter(timer_sketch=True) writes them.
+
+    Points are timestamped by the flusher, the timestamp argument of the emit
+    methods is ignored.
+
+    Every interval seconds the flusher swaps the buffers of all threads for
+    empty ones. A thread may still be finishing a write into the buffer it had
+    when it was swapped, so the swapped buffers are only merged and written
+    one interval later, with the time of the swap. close() writes everything
+    right away.
+
+    A forked process starts its own flusher on its first metric, the metrics
+    buffered by the parent are left for the parent to write.
+    """
+
+    def __init__(self, emitter, interval=10):
+        self.emitter = emitter
+        self.interval = interval
+        self._start_lock = threading.Lock()
+        self._pid = None
+        self._start()
+
+    def _start(self):
+        # once per process, the flusher of the parent does not survive fork
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._buffers = []
+            self._buffers_lock = threading.Lock()
+            self._local = threading.local()
+            # (swap time, swapped buffers) waiting for the next flush
+            self._retired = None
+            self._should_stop = threading.Event()
+            self._flusher = threading.Thread(
+                target=self._flush_loop, name="metrics-flush", daemon=True
+            )
+            self._flusher.start()
+            self._pid = os.getpid()
+
+    def _buffer(self):
+        if self._pid != os.getpid():
+            self._start()
+        try:
+            return self._local.buffer
+        except AttributeError:
+            buffer = self._local.buffer = _ThreadBuffer()
+            with self._buffers_lock:
+                self._buffers.append(buffer)
+            return buffer
+
+    @staticmethod
+    def _key(key, tags, measurement):
+        return (measurement, key, tuple(tags.items()) if tags else ())
+
+    def emit_counter(
+        self, key=None, count=1, tags=None, measurement=None, timestamp=None
+    ):
+        counters = self._buffer().counters
+        k = self._key(key, tags, measurement)
+        counters[k] = counters.get(k, 0) + count
+
+    def emit_timer(
+        self, key=None, duration=0, tags=None, measurement=None, timestamp=None
+    ):
+        timers = self._buffer().timers
+        k = self._key(key, tags, measurement)
+        sketch = timers.get(k)
+        if sketch is None:
+            sketch = timers[k] = DDSketch(self.emitter.timer_accuracy)
+        # float fields, like get_timer_point, influxdb fixes the type of fields
+        sketch.add(ensure_float(duration))
+
+    def emit_store(
+        self, key=None, value=0, tags=None, measurement=None, timestamp=None
+    ):
+        self._buffer().stores[self._key(key, tags, measurement)] = value
+
+    def _swap(self):
+        with self._buffers_lock:
+            buffers = list(self._buffers)
+            # buffers of finished threads are swapped one last time
+            self._buffers = [b for b in buffers if b.thread.is_alive()]
+        return time.time(), [buffer.swap() for buffer in buffers]
+
+    def _points(self, timestamp, swapped):
+        counters = {}
+        timers = {}
+        stores = {}
+        for buffer_counters, buffer_timers, buffer_stores in swapped:
+            for (measurement, key, tags), count in buffer_counters.items():
+                k = (measurement, key, tuple(sorted(tags)))
+                counters[k] = counters.get(k, 0) + count
+            for (measurement, key, tags), sketch in buffer_timers.items():
+                k = (measurement, key, tuple(sorted(tags)))
+                if k in timers:
+                    timers[k].merge(sketch)
+                else:
+                    timers[k] = sketch
+            for (measurement, key, tags), value in buffer_stores.items():
+                stores[(measurement, key, tuple(sorted(tags)))] = value
+        emitter = self.emitter
+        timestamp = int(timestamp * 1000)
+        points = []
+        for (measurement, key, tags), count in counters.items():
+            points.append(
+                emitter.get_counter_point(
+                    key, count, dict(tags), measurement, timestamp=timestamp
+                )
+            )
+        for (measurement, key, tags), value in stores.items():
+            points.append(
+                emitter.get_store_point(
+                    key, value, dict(tags), measurement, timestamp=timestamp
+                )
+            )
+        for (measurement, key, tags), sketch in timers.items():
+            point = emitter.get_timer_point(
+                key, 0, dict(tags), measurement, timestamp=timestamp
+            )
+            point["fields"] = _sketch_fields(sketch)
+            points.append(point)
+        return points
+
+    def flush(self):
+        retired, self._retired = self._retired, self._swap()
+        if retired is not None:
+            points = self._points(*retired)
+            if points:
+                self.emitter.write_points(points)
+
+    def _flush_loop(self):
+        while not self._should_stop.wait(self.interval):
+            try:
+                self.flush()
+            except Exception as e:
+                get_logger("metrics").exception(e)
+
+    def close(self):
+        """Stop the flusher, and write all the buffered metrics"""
+        self._should_stop.set()
+        self._flusher.join()
+        self.flush()
+        retired, self._retired = self._retired, None
+        points = self._points(*retired)
+        if points:
+            self.emitter.write_points(points)
+
+
+# index of the timestamp argument of get_point and get_*_point
+_TIMESTAMP_INDEX = dict(any=3, counter=4, timer=4, store=4)
+# indexes of their tags and fields arguments
+_DICT_INDEXES = dict(any=(1, 2), counter=(2,), timer=(2,), store=(2,))
+
+
+def _copy_dicts(kind, args, kwargs):
+    """Return args with copies of the tags and fields dicts, which the caller
+    may change before the point is built"""
+    if any(index < len(args) and args[index] for index in _DICT_INDEXES[kind]):
+        args = list(args)
+        for index in _DICT_INDEXES[kind]:
+            if index < len(args) and args[index]:
+                args[index] = dict(args[index])
+        args = tuple(args)
+    for name in ("tags", "fields"):
+        if kwargs.get(name):
+            kwargs[name] = dict(kwargs[name])
+    return args
+
+
+_QUEUE_FULL_POLICIES = ("block", "drop", "sample")
+
+
+class _PointBuffer:
+    """
+    Points of this process waiting to be put on the queue of the emitter
+
+    A point is packed as the (kind, args, kwargs) of its emit_* call, the point
+    dict is only built by the emitter process. Points are put in blocks of
+    block_size, one pickle and one put per block instead of per point, and a
+    daemon thread puts the incomplete block every flush_interval seconds.
+
+    When the queue is bounded and full, policy decides what happens:
+
+    - block : wait up to block_timeout seconds for the emitter to catch up,
+      then drop the block, so that a dead emitter does not hang the callers
+    - drop : drop the block
+    - sample : drop the block, and until a block fits again only keep
+      sample_rate of the points, counters scaled up by 1 / sample_rate
+
+    Dropped points are counted, the total is sent with every block as a store
+    with key metrics.dropped.
+    """
+
+    def __init__(
+        self,
+        queue,
+        block_size=256,
+        flush_interval=1,
+        policy="drop",
+        sample_rate=0.1,
+        block_timeout=1,
+    ):
+        if policy not in _QUEUE_FULL_POLICIES:
+            raise ValueError("policy must be one of %s" % (_QUEUE_FULL_POLICIES,))
+        self.queue = queue
+        self.block_timeout = block_timeout
+        self.block_size = block_size
+        self.flush_interval = flush_interval
+        self.policy = policy
+        self.sample_rate = sample_rate
+        # points lost since the start, and skipped by sampling
+        self.dropped = 0
+        self.sampled = 0
+        self._full = False
+        self._points = []
+        self._lock = threading.Lock()
+        self._pid = None
+        if hasattr(os, "register_at_fork"):
+            ref = weakref.ref(self)
+            os.register_at_fork(after_in_child=lambda: _reset_after_fork(ref))
+
+    def _start(self):
+        # once per process, points copied from the parent by fork are its own
+        self._pid = os.getpid()
+        self._points = []
+        thread = threading.Thread(
+            target=self._flush_loop, name="metrics-buffer", daemon=True
+        )
+        thread.start()
+
+    def _sample(self, kind, args, kwargs):
+        """Return the args of the kept point, None if skipped"""
+        if random.random() >= self.sample_rate:
+            self.sampled += 1
+            return None
+        if kind == "counter":
+            scale = 1 / self.sample_rate
+            if len(args) > 1:
+                args = (args[0], int(round(args[1] * scale))) + args[2:]
+            else:
+                kwargs["count"] = int(round(kwargs.get("count", 1) * scale))
+        return args
+
+    def add(self, kind, args, kwargs):
+        if len(args) <= _TIMESTAMP_INDEX[kind] and kwargs.get("timestamp") is None:
+            # the time of the call, not of the emitter process receiving it
+            kwargs["timestamp"] = int(time.time() * 1000)
+        args = _copy_dicts(kind, args, kwargs)
+        with self._lock:
+            if self._pid != os.getpid():
+                self._start()
+            if self._full and self.policy == "sample":
+                args = self._sample(kind, args, kwargs)
+                if args is None:
+                    return
+            self._points.append((kind, args, kwargs))
+            if len(self._points) < self.block_size:
+                return
+            block, self._points = self._points, []
+        self._put(block)
+
+    def _put(self, block):
+        points = block
+        if self.dropped:
+            # a total, losing it with a dropped block loses nothing
+            timestamp = int(time.time() * 1000)
+            args = ("metrics.dropped", self.dropped, None, None, timestamp)
+            points = block + [("store", args, {})]
+        try:
+            if self.policy == "block":
+                self.queue.put(points, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(points)
+        except queue.Full:
+            with self._lock:
+                self._full = True
+                self.dropped += len(block)
+        else:
+            self._full = False
+
+    def flush(self):
+        with self._lock:
+            block, self._points = self._points, []
+        if block:
+            self._put(block)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                get_logger("metrics").exception(e)
+
+
+def _reset_after_fork(ref):
+    buffer = ref()
+    if buffer is not None:
+        # another thread of the parent may have held the lock when forking
+        buffer._lock = threading.Lock()
+
+
 def _exit_emit_loop():
     sys.stderr.write("metrics exiting...\n")
     sys.stderr.flush()
 
 
+def _consume():
+    """Emit the blocks of the queue, until the None put by close()"""
+    while True:
+        try:
+            # 读取一批点, 等到第一块为止
+            blocks = [_metrics_queue.get()]
+            blocks.extend(
+                queue_mget(_metrics_queue, 63, return_when="any", timeout=0)
+            )
+        except Exception as e:
+            get_logger("metrics emitter").exception(e)
+            continue
+        for block in blocks:
+            if block is None:
+                continue
+            # one failing block must not lose the None after it
+            try:
+                _emitter.emit_packed(block)
+            except Exception as e:
+                get_logger("metrics emitter").exception(e)
+        if None in blocks:
+            return
+
+
+def _drain_and_close():
+    """Emit what producers still put in the next _drain_timeout seconds, then
+    write the pending points"""
+    try:
+        while True:
+            blocks = queue_mget(
+                _metrics_queue, 64, return_when="any", timeout=_drain_timeout
+            )
+            if not blocks:
+                break
+            for block in blocks:
+                if block is not None:
+                    _emitter.emit_packed(block)
+    except Exception as e:
+        get_logger("metrics emitter").exception(e)
+    finally:
+        _emitter.close()
+        _exit_emit_loop()
+
+
 def _emit_loop():
     sys.stderr.write(
         "metrics starting... batch=%d pid=%d\n" % (_emitter.batch_size, os.getpid())
@@ -297,15 +781,16 @@ def _emit_loop():
     sys.stderr.flush()
     from futile.signals import handle_exit
 
-    # TODO drain the queue, when SystemExit receives
-    while True:
+    if threading.current_thread() is threading.main_thread():
+        # the emitter process, drain the queue on SIGTERM as well
+        with handle_exit(_drain_and_close):
+            _consume()
+    else:
+        # signals are only handled by the main thread, close() stops us
         try:
-            # 读取一个点
-            point = _metrics_queue.get()
-            _emitter.emit(point)
-        except Exception as e:
-            get_logger("metrics emitter").exception(e)
-    _emitter.close()
+            _consume()
+        finally:
+            _drain_and_close()
 
 
 def init(
@@ -321,8 +806,30 @@ def init(
     use_thread=False,
     use_udp=False,
     timeout=10,
+    timer_sketch=False,
+    thread_local=False,
+    flush_interval=10,
+    queue_block_size=256,
+    queue_flush_interval=1,
+    queue_maxsize=1024,
+    queue_full="drop",
+    queue_block_timeout=1,
+    sample_rate=0.1,
+    drain_timeout=1,
     **kwargs,
 ):
+    """
+    queue_block_size: points are put on the queue of the emitter process in
+        blocks of that many points, or every queue_flush_interval seconds
+    queue_maxsize: max number of blocks in the queue, 0 for unbounded
+    queue_full: drop, sample or block when the queue is full, see _PointBuffer
+    queue_block_timeout: how long the block policy waits before dropping
+    drain_timeout: on SIGTERM or close(), the emitter keeps emitting points
+        until none comes for that many seconds, then writes the pending ones
+    thread_local: buffer counters, timers and stores per thread, written by a
+        flusher thread every flush_interval seconds, see ThreadLocalMetrics.
+        Cheaper than the queue to the emitter process when emitting a lot.
+    """
     if prefix is None:
         raise ValueError("Metric prefix not set")
 
@@ -346,13 +853,30 @@ def init(
         use_udp=use_udp,
         timeout=timeout,
     )
-    _emitter = MetricsEmitter(db, prefix, batch_size=batch_size)
+    _emitter = MetricsEmitter(
+        db, prefix, batch_size=batch_size, timer_sketch=timer_sketch
+    )
 
-    if not _directly:
+    if thread_local:
+        global _local
+        _local = ThreadLocalMetrics(_emitter, interval=flush_interval)
+    elif not _directly:
+        global _metrics_queue, _buffer, _drain_timeout
+        _metrics_queue = mp.Queue(maxsize=queue_maxsize)
+        _buffer = _PointBuffer(
+            _metrics_queue,
+            block_size=queue_block_size,
+            flush_interval=queue_flush_interval,
+            policy=queue_full,
+            sample_rate=sample_rate,
+            block_timeout=queue_block_timeout,
+        )
+        _drain_timeout = drain_timeout
         if use_thread:
-            thread = threading.Thread(target=_emit_loop)
-            thread.daemon = True
-            thread.start()
+            global _emit_thread
+            _emit_thread = threading.Thread(target=_emit_loop)
+            _emit_thread.daemon = True
+            _emit_thread.start()
         else:
             if threading.current_thread() != threading.main_thread():
                 get_logger("metrics").error("metrics called NOT from main thread")
@@ -365,42 +889,70 @@ def init(
 def emit_any(*args, **kwargs):
     if not _emitter:
         return
-    if _directly:
+    if _directly or _local is not None:
         _emitter.emit_any(*args, **kwargs)
     else:
-        _metrics_queue.put(_emitter.get_point(*args, **kwargs))
+        _buffer.add("any", args, kwargs)
 
 
 def emit_counter(*args, **kwargs):
     if not _emitter:
         return
-    if _directly:
+    if _local is not None:
+        _local.emit_counter(*args, **kwargs)
+    elif _directly:
         _emitter.emit_counter(*args, **kwargs)
     else:
-        _metrics_queue.put(_emitter.get_counter_point(*args, **kwargs))
+        _buffer.add("counter", args, kwargs)
 
 
 def emit_timer(*args, **kwargs):
     if not _emitter:
         return
-    if _directly:
+    if _local is not None:
+        _local.emit_timer(*args, **kwargs)
+    elif _directly:
         _emitter.emit_timer(*args, **kwargs)
     else:
-        _metrics_queue.put(_emitter.get_timer_point(*args, **kwargs))
+        _buffer.add("timer", args, kwargs)
 
 
 def emit_store(*args, **kwargs):
     if not _emitter:
         return
-    if _directly:
+    if _local is not None:
+        _local.emit_store(*args, **kwargs)
+    elif _directly:
         _emitter.emit_store(*args, **kwargs)
     else:
-        _metrics_queue.put(_emitter.get_store_point(*args, **kwargs))
+        _buffer.add("store", args, kwargs)
 
 
 def close():
-    if _directly:
+    if _local is not None:
+        _local.close()
         _emitter.close()
+    elif _directly:
+        _emitter.close()
+    elif _buffer is not None:
+        _buffer.flush()
+        if _inited_pid == os.getpid():
+            # the emitter drains the queue and writes the pending points,
+            # unless it is gone or stuck with a full queue
+            try:
+                _metrics_queue.put(None, timeout=_drain_timeout)
+            except queue.Full:
+                get_logger("metrics").error("metrics queue full, not drained")
+                return
+            if _emit_thread is not None:
+                _emit_thread.join()
+
+
+def queue_stats():
+    """Points dropped, and skipped by sampling, because the queue was full"""
+    if _buffer is None:
+        return dict(dropped=0, sampled=0)
+    return dict(dropped=_buffer.dropped, sampled=_buffer.sampled)
 
 
 def emit_counter_by_dict(counters, tags=None, timestamp=None):
@@ -413,3 +965,4 @@ def emit_counter_by_dict(counters, tags=None, timestamp=None):
 aemit_counter = aio_wrap(executor=_executor)(emit_counter)
 aemit_store = aio_wrap(executor=_executor)(emit_store)
 aemit_timer = aio_wrap(executor=_executor)(emit_timer)
+
@@ -1,6 +1,12 @@
 import os
+import random
+import socket
+import threading
+
 import statsd
 
+from futile.cache import LruCache
+
 _emitter = None
 
 
@@ -14,7 +20,7 @@ def fmttags(measurement, tags, base_tags=None):
     if not tags and not base_tags:
         return measurement
     if base_tags:
-        tags = {**tags, **base_tags}  # NOTE 不能直接使用 update, 否则会更改 tags
+        tags = {**(tags or {}), **base_tags}  # NOTE 不能直接使用 update, 否则会更改 tags
     tagstr = ",".join([f"{k}={v}" for k, v in tags.items()])
     return ",".join([measurement, tagstr])
 
@@ -43,13 +49,195 @@ class MetricsEmitter:
         self._client.gauge(key, value, rate=rate, delta=delta)
 
 
-def init(*, host=None, port=None, prefix=None, tags=None):
+class AggregatingMetricsEmitter(MetricsEmitter):
+    """
+    Aggregates metrics in memory, and sends them every flush_interval seconds
+
+    Counters are summed, gauges keep their last value, timers keep up to
+    max_timer_samples values per interval (a uniform sample of them beyond
+    that, sent with the matching sample rate). Metrics are sent packed into
+    UDP packets of at most mtu bytes, one line per metric, instead of one
+    packet per call.
+
+    Formatted names of up to max_names measurement and tags are cached, so
+    hot metrics do not go through fmttags on every call.
+    """
+
+    def __init__(
+        self,
+        host="localhost",
+        port=8125,
+        prefix=None,
+        tags=None,
+        *,
+        flush_interval=10,
+        mtu=1432,
+        max_timer_samples=1000,
+        max_names=10000,
+    ):
+        # metrics are sent by our own socket, not by a statsd.StatsClient
+        self._tags = tags
+        self._prefix = prefix + "." if prefix else ""
+        family, _, _, _, addr = socket.getaddrinfo(
+            host, port, socket.AF_INET, socket.SOCK_DGRAM
+        )[0]
+        self._addr = addr
+        self._sock = socket.socket(family, socket.SOCK_DGRAM)
+        self._mtu = mtu
+        self._max_timer_samples = max_timer_samples
+        self._names = LruCache(max_names)
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        # name -> [seen, samples]
+        self._timers = {}
+        self._should_stop = threading.Event()
+        self._flusher = None
+        if flush_interval:
+            self._flusher = threading.Thread(
+                target=self._flush_loop,
+                args=(flush_interval,),
+                name="metrics-flush",
+                daemon=True,
+            )
+            self._flusher.start()
+
+    def _name(self, key, tags):
+        try:
+            cache_key = (key, tuple(tags.items())) if tags else key
+            name = self._names.get(cache_key)
+        except TypeError:
+            # unhashable tag values
+            return self._prefix + fmttags(key, tags, self._tags)
+        if name is None:
+            name = self._prefix + fmttags(key, tags, self._tags)
+            self._names.put(cache_key, name)
+        return name
+
+    def emit_counter(self, key, value, *, tags=None, rate=1):
+        # every call is counted here, there is nothing to sample
+        name = self._name(key, tags)
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def emit_timer(self, key, value, *, tags=None, rate=1):
+        name = self._name(key, tags)
+        with self._lock:
+            timer = self._timers.get(name)
+            if timer is None:
+                timer = self._timers[name] = [0, []]
+            timer[0] += 1
+            samples = timer[1]
+            if len(samples) < self._max_timer_samples:
+                samples.append(value)
+            else:
+                # reservoir sampling
+                index = random.randrange(timer[0])
+                if index < self._max_timer_samples:
+                    samples[index] = value
+
+    def emit_store(self, key, value, *, tags=None, rate=1, delta=False):
+        name = self._name(key, tags)
+        with self._lock:
+            if delta and name in self._gauges:
+                last, last_delta = self._gauges[name]
+                self._gauges[name] = (last + value, last_delta)
+            else:
+                self._gauges[name] = (value, delta)
+
+    def _lines(self, counters, gauges, timers):
+        for name, value in counters.items():
+            yield "%s:%s|c" % (name, value)
+        for name, (value, delta) in gauges.items():
+            if delta:
+                yield "%s:%+g|g" % (name, value)
+            else:
+                if value < 0:
+                    # a negative value would be taken for a delta
+                    yield "%s:0|g" % name
+                yield "%s:%s|g" % (name, value)
+        for name, (seen, samples) in timers.items():
+            if len(samples) < seen:
+                suffix = "|ms|@%g" % (len(samples) / seen)
+            else:
+                suffix = "|ms"
+            for value in samples:
+                yield "%s:%0.6f%s" % (name, value, suffix)
+
+    def flush(self):
+        """Send all the metrics aggregated since the last flush"""
+        with self._lock:
+            counters, self._counters = self._counters, {}
+            gauges, self._gauges = self._gauges, {}
+            timers, self._timers = self._timers, {}
+        packet = []
+        size = 0
+        for line in self._lines(counters, gauges, timers):
+            line = line.encode("utf-8")
+            # +1 for the newline separating lines
+            if packet and size + 1 + len(line) > self._mtu:
+                self._send(b"\n".join(packet))
+                packet = []
+                size = 0
+            size += len(line) + (1 if packet else 0)
+            packet.append(line)
+        if packet:
+            self._send(b"\n".join(packet))
+
+    def _send(self, packet):
+        try:
+            self._sock.sendto(packet, self._addr)
+        except OSError:
+            # statsd is best effort, like statsd.StatsClient
+            pass
+
+    def _flush_loop(self, interval):
+        while not self._should_stop.wait(interval):
+            self.flush()
+
+    def close(self):
+        """Stop the flusher thread, and send what is left"""
+        self._should_stop.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        self.flush()
+        self._sock.close()
+
+
+def init(
+    *,
+    host=None,
+    port=None,
+    prefix=None,
+    tags=None,
+    aggregate=False,
+    flush_interval=10,
+    mtu=1432,
+):
+    """
+    Set up the emitter used by the module-level emit_* functions.
+
+    With aggregate, metrics are aggregated in process and sent every
+    flush_interval seconds, see AggregatingMetricsEmitter.
+    """
     global _emitter
     if host is None:
         host = os.getenv("STATSD_HOST") or "localhost"
     if port is None:
         port = os.getenv("STATSD_PORT") or 8125
-    _emitter = MetricsEmitter(host, port, prefix, tags)
+    if aggregate:
+        _emitter = AggregatingMetricsEmitter(
+            host, port, prefix, tags, flush_interval=flush_interval, mtu=mtu
+        )
+    else:
+        _emitter = MetricsEmitter(host, port, prefix, tags)
+
+
+def close():
+    """Send the metrics aggregated so far, if aggregating"""
+    if isinstance(_emitter, AggregatingMetricsEmitter):
+        _emitter.close()
 
 
 def emit_counter(key, value, *, tags=None, rate=1):
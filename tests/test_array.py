@@ -0,0 +1,325 @@
+import array
+import functools
+import os
+import tempfile
+import unittest
+
+import futile.array
+from futile.array import (
+    ApproxDistinctAggregator,
+    CountAggregator,
+    SumAggregator,
+    TopKAggregator,
+    chunked,
+    chunked_file,
+    chunked_qs,
+    count_by,
+    filter_by,
+    keyset_chunked_qs,
+    parallel_imap_unordered,
+    parallel_map,
+    parallel_reduce,
+    ParallelMapError,
+    partition,
+    sliding_window,
+    take_indices,
+    tumbling_window,
+    unique,
+)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class ChunkedTestCase(unittest.TestCase):
+
+    def test_zero_copy(self):
+        data = bytearray(b"abcde")
+        chunks = list(chunked(2, data, zero_copy=True))
+        self.assertTrue(all(isinstance(chunk, memoryview) for chunk in chunks))
+        data[0:1] = b"x"
+        self.assertEqual([bytes(chunk) for chunk in chunks], [b"xb", b"cd", b"e"])
+        ints = array.array("i", range(5))
+        self.assertEqual(
+            [chunk.tolist() for chunk in chunked(3, ints, zero_copy=True)],
+            [[0, 1, 2], [3, 4]],
+        )
+        # not a buffer, sliced as before
+        self.assertEqual(list(chunked(2, [1, 2, 3], zero_copy=True)), [[1, 2], [3]])
+
+    def test_chunked_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "data")
+            with open(path, "wb") as f:
+                f.write(b"abcde")
+            chunks = [bytes(chunk) for chunk in chunked_file(2, path)]
+            self.assertEqual(chunks, [b"ab", b"cd", b"e"])
+            open(path, "wb").close()
+            self.assertEqual(list(chunked_file(2, path)), [])
+
+
+@unittest.skipIf(np is None, "NumPy is not installed")
+class NumpyArrayTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._np = futile.array.np
+
+    def tearDown(self):
+        futile.array.np = self._np
+
+    def assertSameAsPython(self, fn):
+        accelerated = fn()
+        futile.array.np = None
+        python = fn()
+        futile.array.np = self._np
+        # repr compares types too, and nan to nan
+        self.assertEqual(repr(accelerated), repr(python))
+
+    def test_ints(self):
+        ints = np.array([3, 1, 0, 3, -2, 1, 0, 7])
+        bools = ints > 0
+        self.assertSameAsPython(lambda: list(unique(ints)))
+        self.assertSameAsPython(lambda: list(count_by(ints).items()))
+        self.assertSameAsPython(lambda: partition(ints)[0] + partition(ints)[1])
+        self.assertSameAsPython(lambda: list(filter_by(ints, bools, falsy=True)))
+        self.assertSameAsPython(lambda: list(take_indices(ints, np.array([0, -8, 8]))))
+
+    def test_floats(self):
+        floats = np.array([0.5, float("nan"), -0.0, 0.0, 0.5, float("nan")])
+        self.assertSameAsPython(lambda: list(unique(floats)))
+        self.assertSameAsPython(lambda: partition(floats)[0])
+
+    def test_array_array(self):
+        ints = array.array("q", [i % 7 for i in range(5000)])
+        self.assertSameAsPython(lambda: list(unique(ints)))
+        self.assertSameAsPython(lambda: list(count_by(ints).items()))
+
+    def test_array_array_bools(self):
+        ints = np.arange(2000)
+        bools = array.array("b", [i % 3 == 0 for i in range(2000)])
+        self.assertSameAsPython(lambda: list(filter_by(ints, bools)))
+
+    def test_vectorized(self):
+        ints = np.arange(-5, 5)
+        self.assertSameAsPython(
+            lambda: partition(ints, lambda x: x % 3 == 0, vectorized=True)[0]
+        )
+        self.assertSameAsPython(
+            lambda: list(count_by(ints, lambda x: x % 3, vectorized=True).items())
+        )
+
+
+def _fail_on_3(x):
+    if x == 3:
+        raise KeyError(x)
+    return x
+
+
+class ParallelTestCase(unittest.TestCase):
+
+    def test_map(self):
+        self.assertEqual(
+            list(parallel_map(abs, range(-50, 50), chunk_size=7)),
+            [abs(i) for i in range(-50, 50)],
+        )
+        self.assertEqual(
+            sorted(parallel_imap_unordered(abs, range(10), chunk_size=3)),
+            list(range(10)),
+        )
+
+    def test_backpressure(self):
+        consumed = []
+
+        def items():
+            for i in range(1000):
+                consumed.append(i)
+                yield i
+
+        results = parallel_map(
+            abs, items(), max_workers=2, chunk_size=10, max_inflight=2
+        )
+        next(results)
+        self.assertLessEqual(len(consumed), 40)
+        results.close()
+
+    def test_error(self):
+        for executor in ("thread", "process"):
+            with self.assertRaises(ParallelMapError) as context:
+                list(parallel_map(_fail_on_3, range(10), executor=executor))
+            self.assertEqual(context.exception.item, 3)
+            self.assertIsInstance(context.exception.error, KeyError)
+
+    def test_reduce(self):
+        self.assertEqual(parallel_reduce(max, range(100), chunk_size=9), 99)
+        self.assertEqual(
+            parallel_reduce(lambda a, b: a + b, range(100), 1000, chunk_size=9),
+            1000 + sum(range(100)),
+        )
+        self.assertRaises(TypeError, parallel_reduce, max, [])
+
+
+class WindowTestCase(unittest.TestCase):
+
+    def test_time_windows(self):
+        events = [(0, 1), (3, 2), (12, 5), (13, 1), (55, 4)]
+        windows = tumbling_window(
+            iter(events), SumAggregator, 10, key=lambda e: e[0], value=lambda e: e[1]
+        )
+        self.assertEqual(list(windows), [((0, 10), 3), ((10, 20), 6), ((50, 60), 4)])
+
+    def test_sliding_memory(self):
+        def events():
+            for i in range(10000):
+                yield i
+
+        windows = sliding_window(events(), CountAggregator, 100, 10)
+        self.assertEqual(next(windows), ((0, 100), 100))
+        counts = [count for _, count in windows]
+        self.assertEqual(counts[-1], 10)
+        self.assertEqual(len(counts), 999)
+
+    def test_approx_distinct(self):
+        distinct = ApproxDistinctAggregator()
+        for i in range(20000):
+            distinct.add(i % 5000)
+        other = ApproxDistinctAggregator()
+        for i in range(5000, 10000):
+            other.add(i)
+        distinct.merge(other)
+        self.assertAlmostEqual(distinct.result(), 10000, delta=500)
+
+    def test_top_k(self):
+        top = functools.partial(TopKAggregator, 2)
+        stream = "aababcabcdaaa"
+        [(_, result)] = tumbling_window(stream, top, len(stream))
+        self.assertEqual(result, [("a", 7), ("b", 3)])
+
+
+class UniqueTestCase(unittest.TestCase):
+
+    def test_key_called_once(self):
+        calls = []
+
+        def key(x):
+            calls.append(x)
+            return x
+
+        self.assertEqual(list(unique([1, 2, 1], key=key)), [1, 2])
+        self.assertEqual(calls, [1, 2, 1])
+
+    def test_spill(self):
+        items = [i * 7 % 101 for i in range(1000)]
+        expected = list(unique(items))
+        with tempfile.TemporaryDirectory() as tmp:
+            spilled = list(unique(items, max_keys=10, tmpdir=tmp))
+        self.assertEqual(spilled[:10], expected[:10])
+        self.assertEqual(sorted(spilled), sorted(expected))
+
+    def test_approximate(self):
+        items = list(range(1000)) * 2
+        result = list(unique(items, approximate=True, capacity=1000, error_rate=0.01))
+        self.assertEqual(len(result), len(set(result)))
+        self.assertGreater(len(result), 950)
+
+    def test_approximate_types(self):
+        items = [1, "1", b"1", (1,), "(1,)", 1.0, True, (1.0,), "1", b"1"]
+        result = list(unique(items, approximate=True, capacity=100))
+        self.assertEqual(result, [1, "1", b"1", (1,), "(1,)"])
+
+    def test_approximate_objects(self):
+        # equal, but their repr holds their id
+        items = [_Point(1, 2), _Point(3, 4), _Point(1, 2)]
+        result = list(unique(items, approximate=True, capacity=100))
+        self.assertEqual(result, items[:2])
+
+    def test_max_keys(self):
+        self.assertRaises(ValueError, list, unique([1, 2], max_keys=0))
+
+
+class _Point(object):
+
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+    def __eq__(self, other):
+        return (self.x, self.y) == (other.x, other.y)
+
+    def __hash__(self):
+        return hash((self.x, self.y))
+
+
+class _Row(object):
+
+    def __init__(self, pk):
+        self.pk = pk
+
+
+def _pk(row):
+    # values() dicts of a model with a custom-named primary key
+    return row["code"] if isinstance(row, dict) else row.pk
+
+
+class _Model(object):
+
+    class _meta(object):
+
+        class pk(object):
+            attname = "code"
+
+
+class _QuerySet(object):
+    """The part of a Django QuerySet the chunked_qs helpers use"""
+
+    model = _Model
+
+    def __init__(self, rows, queries):
+        self._rows = rows
+        self.queries = queries
+
+    def order_by(self, key):
+        return _QuerySet(sorted(self._rows, key=_pk), self.queries)
+
+    def filter(self, pk__gt):
+        return _QuerySet([row for row in self._rows if _pk(row) > pk__gt], self.queries)
+
+    def count(self):
+        return len(self._rows)
+
+    def __getitem__(self, index):
+        self.queries.append(index)
+        return self._rows[index]
+
+
+class QuerySetTestCase(unittest.TestCase):
+
+    def test_chunked_qs(self):
+        qs = _QuerySet([_Row(i) for i in range(5)], [])
+        chunks = [[row.pk for row in chunk] for chunk in chunked_qs(2, qs)]
+        self.assertEqual(chunks, [[0, 1], [2, 3], [4]])
+
+    def test_keyset(self):
+        for prefetch in (False, True):
+            queries = []
+            qs = _QuerySet([_Row(i) for i in range(9, -1, -2)], queries)
+            chunks = keyset_chunked_qs(2, qs, prefetch=prefetch)
+            self.assertEqual(
+                [[row.pk for row in chunk] for chunk in chunks],
+                [[1, 3], [5, 7], [9]],
+            )
+            # no OFFSET
+            self.assertTrue(all(query.start is None for query in queries))
+
+    def test_keyset_values(self):
+        qs = _QuerySet([{"code": i} for i in range(5)], [])
+        chunks = keyset_chunked_qs(2, qs, prefetch=True)
+        self.assertEqual(
+            [[row["code"] for row in chunk] for chunk in chunks],
+            [[0, 1], [2, 3], [4]],
+        )
+
+    def test_close_unconfigured_django(self):
+        # without Django, or with Django installed but not configured
+        futile.array._close_db_connections()
@@ -1,6 +1,28 @@
+import asyncio
+import os
+import tempfile
+import pickle
 import unittest
+import threading
 import time
 
+from futile.cache import (
+    _MARKER,
+    CacheMaker,
+    ExpiringLruCache,
+    LruCache,
+    ShardedLruCache,
+    batch_lru_cache,
+    lru_cache,
+    make_cache,
+)
+from futile.cache.aio import alru_cache
+from futile.cache.disk_cache import DiskCache, dump_cache, load_cache
+from futile.cache.keys import make_key_builder
+from futile.cache.policies import SegmentedLruCache
+from futile.cache.registry import CacheRegistry
+from futile.cache.shm import _SEQ, SharedMemoryCache
+from futile.cache.tinylfu import TinyLfuCache
 from futile.cache.expiring_cache import ExpiringCache
 
 
@@ -17,3 +39,582 @@ class CacheTestCase(unittest.TestCase):
         time.sleep(5)
         val = self._ecache.get("foo")
         self.assertEqual(val, None)
+
+
+class ShardedLruCacheTestCase(unittest.TestCase):
+
+    def test_sharded(self):
+        cache = ShardedLruCache(64, shards=4)
+        self.assertEqual(len(cache.shards), 4)
+        for i in range(32):
+            cache.put(i, str(i))
+        self.assertEqual(cache.get(3), "3")
+        self.assertEqual(cache.get("missing"), None)
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 1)
+        cache.invalidate(3)
+        self.assertEqual(cache.get(3), None)
+
+    def test_decorator(self):
+        calls = []
+
+        @lru_cache(16, shards=4)
+        def double(x):
+            calls.append(x)
+            return x * 2
+
+        self.assertIsInstance(double._cache, ShardedLruCache)
+        self.assertEqual(double(2), 4)
+        self.assertEqual(double(2), 4)
+        self.assertEqual(calls, [2])
+
+    def test_size(self):
+        cache = ShardedLruCache(17, shards=16)
+        self.assertEqual(sum(shard.size for shard in cache.shards), 17)
+
+    def test_unsupported(self):
+        self.assertRaises(ValueError, lru_cache, 16, shards=4, timeout=60)
+        self.assertRaises(ValueError, lru_cache, 16, shards=4, policy="lru")
+
+
+class PolicyTestCase(unittest.TestCase):
+
+    def test_exact_lru(self):
+        cache = make_cache(2, "lru")
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        self.assertEqual(cache.get("b"), None)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_slru_scan_resistance(self):
+        cache = make_cache(10, "slru")
+        for key in "abc":
+            cache.put(key, key)
+            cache.get(key)
+        for i in range(100):
+            cache.put(i, i)
+        for key in "abc":
+            self.assertEqual(cache.get(key), key)
+
+    def test_clock_pro(self):
+        cache = make_cache(10, "clock-pro")
+        for i in range(1000):
+            if cache.get(i % 5) is None:
+                cache.put(i % 5, i % 5)
+            cache.put(-i, i)
+        for i in range(5):
+            self.assertEqual(cache.get(i), i)
+        self.assertLessEqual(cache.count_hot + cache.count_cold, 10)
+
+    def test_unknown_policy(self):
+        self.assertRaises(ValueError, make_cache, 10, "fifo")
+
+    def test_cache_maker(self):
+        maker = CacheMaker(maxsize=10, policy="slru")
+
+        @maker.lrucache("slru")
+        def double(x):
+            return x * 2
+
+        self.assertEqual(double(2), 4)
+        self.assertIsInstance(double._cache, SegmentedLruCache)
+        maker.clear("slru")
+
+
+class TinyLfuCacheTestCase(unittest.TestCase):
+
+    def test_victim(self):
+        cache = LruCache(2)
+        self.assertIs(cache.victim("a"), _MARKER)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertIs(cache.victim("a"), _MARKER)
+        self.assertEqual(cache.victim("c"), "a")
+
+    def test_admission(self):
+        cache = TinyLfuCache(LruCache(10), window_size=1)
+        for _ in range(5):
+            for i in range(10):
+                if cache.get(i) is None:
+                    cache.put(i, i)
+        # a scan of one-hit keys must not push the hot keys out
+        for i in range(100, 200):
+            if cache.get(i) is None:
+                cache.put(i, i)
+        for i in range(10):
+            self.assertEqual(cache.cache.get(i), i)
+        self.assertGreater(cache.rejections, 0)
+        self.assertEqual(cache.lookups, cache.hits + cache.misses)
+
+
+class ExpiryTestCase(unittest.TestCase):
+
+    def test_purge_expired(self):
+        cache = ExpiringCache(0.05)
+        for i in range(10):
+            cache.put(i, i)
+        cache.put("long", "lived", timeout=60)
+        time.sleep(0.1)
+        self.assertEqual(cache.purge_expired(), 10)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.get("long"), "lived")
+        self.assertEqual(cache.expirations, 10)
+        cache.clear()
+        self.assertEqual(cache.expirations, 0)
+
+    def test_sweep_on_access(self):
+        cache = ExpiringCache(0.05)
+        cache.put("foo", "bar")
+        time.sleep(0.1)
+        self.assertEqual(cache.get("foo"), None)
+        self.assertEqual(len(cache), 0)
+
+    def test_expiring_lru_purge(self):
+        cache = ExpiringLruCache(10, default_timeout=0.05)
+        for i in range(5):
+            cache.put(i, i)
+        cache.put("long", "lived", timeout=60)
+        time.sleep(0.1)
+        self.assertEqual(cache.purge_expired(), 5)
+        self.assertEqual(list(cache.data), ["long"])
+
+    def test_reaper(self):
+        cache = ExpiringLruCache(10, default_timeout=0.01, reaper_interval=0.02)
+        cache.put("foo", "bar")
+        time.sleep(0.1)
+        cache.stop_reaper()
+        self.assertEqual(cache.data, {})
+        self.assertEqual(cache.expirations, 1)
+
+
+class SingleFlightTestCase(unittest.TestCase):
+
+    def _run_concurrently(self, fn, n=8):
+        results = []
+        errors = []
+
+        def target():
+            try:
+                results.append(fn(1))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=target) for _ in range(n)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, errors
+
+    def test_coalescing(self):
+        calls = []
+
+        @lru_cache(10, timeout=60, single_flight=True)
+        def slow(x):
+            calls.append(x)
+            time.sleep(0.1)
+            return x
+
+        results, errors = self._run_concurrently(slow)
+        self.assertEqual(results, [1] * 8)
+        self.assertEqual(calls, [1])
+
+    def test_shared_exception(self):
+        calls = []
+
+        @lru_cache(10, single_flight=True)
+        def failing(x):
+            calls.append(x)
+            time.sleep(0.1)
+            raise KeyError(x)
+
+        results, errors = self._run_concurrently(failing)
+        self.assertEqual(len(errors), 8)
+        self.assertEqual(calls, [1])
+
+    def test_missed_before_load_finished(self):
+        calls = []
+
+        class MissOnce(LruCache):
+            """Misses the first lookup, while another caller loads the key"""
+
+            on_miss = None
+
+            def get(self, key, default=None):
+                if self.on_miss is not None:
+                    on_miss, self.on_miss = self.on_miss, None
+                    on_miss()
+                    return default
+                return super().get(key, default)
+
+        cache = MissOnce(10)
+
+        @lru_cache(10, cache=cache, single_flight=True)
+        def load(x):
+            calls.append(x)
+            return x
+
+        def leader():
+            thread = threading.Thread(target=load, args=(1,))
+            thread.start()
+            thread.join()
+
+        cache.on_miss = leader
+        self.assertEqual(load(1), 1)
+        self.assertEqual(calls, [1])
+
+
+class StaleWhileRevalidateTestCase(unittest.TestCase):
+
+    def test_stale_ttl(self):
+        calls = []
+
+        @lru_cache(10, timeout=0.1, stale_ttl=10)
+        def version(x):
+            calls.append(x)
+            return len(calls)
+
+        self.assertEqual(version("a"), 1)
+        time.sleep(0.15)
+        # the expired value is served, and refreshed in the background
+        self.assertEqual(version("a"), 1)
+        time.sleep(0.02)
+        self.assertEqual(version("a"), 2)
+        self.assertEqual(version._cache.stale_hits, 1)
+
+    def test_refresh_ahead(self):
+        calls = []
+
+        @lru_cache(10, timeout=0.2, refresh_ahead=0.5)
+        def version(x):
+            calls.append(x)
+            return len(calls)
+
+        self.assertEqual(version("a"), 1)
+        time.sleep(0.15)
+        self.assertEqual(version("a"), 1)
+        time.sleep(0.03)
+        self.assertEqual(version("a"), 2)
+
+    def test_given_cache(self):
+        cache = ExpiringLruCache(10, default_timeout=0.1)
+
+        @lru_cache(10, cache=cache, stale_ttl=10)
+        def version(x):
+            return x
+
+        self.assertEqual(cache.stale_ttl, 10)
+        version("a")
+        time.sleep(0.15)
+        self.assertEqual(version("a"), "a")
+        self.assertEqual(cache.stale_hits, 1)
+
+    def test_needs_expiring_cache(self):
+        self.assertRaises(ValueError, lru_cache, 10, stale_ttl=10)
+        self.assertRaises(ValueError, lru_cache, 10, cache=LruCache(10), stale_ttl=10)
+
+
+class AsyncLruCacheTestCase(unittest.TestCase):
+
+    def test_caches_result(self):
+        calls = []
+
+        @alru_cache(10, timeout=60)
+        async def double(x):
+            calls.append(x)
+            await asyncio.sleep(0.05)
+            return x * 2
+
+        async def main():
+            results = await asyncio.gather(*[double(2) for _ in range(8)])
+            results.append(await double(2))
+            return results
+
+        self.assertEqual(asyncio.run(main()), [4] * 9)
+        self.assertEqual(calls, [2])
+
+    def test_exception_not_cached(self):
+        calls = []
+
+        @alru_cache(10)
+        async def failing(x):
+            calls.append(x)
+            raise KeyError(x)
+
+        async def main():
+            for _ in range(2):
+                with self.assertRaises(KeyError):
+                    await failing(1)
+
+        asyncio.run(main())
+        self.assertEqual(calls, [1, 1])
+
+
+class WeightedLruCacheTestCase(unittest.TestCase):
+
+    def test_max_weight(self):
+        cache = LruCache(100, weigher=lambda k, v: len(v), max_weight=10)
+        cache.put("a", "xxxx")
+        cache.put("b", "xxxx")
+        self.assertEqual(cache.weight, 8)
+        cache.put("c", "xxxx")
+        self.assertLessEqual(cache.weight, 10)
+        self.assertEqual(cache.get("c"), "xxxx")
+        self.assertEqual(cache.stats()["weight"], cache.weight)
+        cache.put("c", "x")
+        cache.invalidate("c")
+        self.assertEqual(cache.weight, sum(cache.weights.values()))
+
+    def test_too_heavy(self):
+        cache = LruCache(100, weigher=lambda k, v: len(v), max_weight=10)
+        cache.put("a", "x" * 11)
+        self.assertEqual(cache.get("a"), None)
+        self.assertEqual(cache.weight, 0)
+
+    def test_update_equal_key(self):
+        cache = LruCache(10, weigher=lambda k, v: v, max_weight=10)
+        for i in (1, 2, 3):
+            cache.put((i,), 3)
+        # equal to (1,), but another object, as lru_cache keys are
+        cache.put(tuple([1]), 5)
+        self.assertEqual(cache.get((1,)), 5)
+        self.assertEqual(cache.weight, sum(cache.weights.values()))
+        self.assertLessEqual(cache.weight, 10)
+
+    def test_decorator(self):
+        @lru_cache(100, shards=2, weigher=lambda k, v: len(v), max_weight=100)
+        def payload(n):
+            return "x" * n
+
+        for i in range(40):
+            payload(i)
+        self.assertLessEqual(payload._cache.weight, 100)
+
+
+class SharedMemoryCacheTestCase(unittest.TestCase):
+
+    def test_get_put(self):
+        cache = SharedMemoryCache(16, slot_size=128)
+        cache.put(("a", 1), {"b": 2})
+        self.assertEqual(cache.get(("a", 1)), {"b": 2})
+        cache.put("big", "x" * 200)
+        self.assertEqual(cache.get("big"), None)
+        self.assertEqual(cache.oversize, 1)
+        cache.invalidate(("a", 1))
+        self.assertEqual(cache.get(("a", 1)), None)
+        cache.close()
+
+    def test_seq_wraps_around(self):
+        cache = SharedMemoryCache(1, ways=1)
+        _SEQ.pack_into(cache._buf, 0, 0xFFFFFFFE)
+        cache.put("a", 1)
+        self.assertEqual(_SEQ.unpack_from(cache._buf, 0)[0], 0)
+        self.assertEqual(cache.get("a"), 1)
+        cache.close()
+
+    def test_shared_with_child(self):
+        cache = SharedMemoryCache(16, default_timeout=60)
+        pid = os.fork()
+        if pid == 0:
+            cache.put("foo", "from child")
+            os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertEqual(cache.get("foo"), "from child")
+        cache.close()
+
+
+class DiskCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._disk = DiskCache(os.path.join(self._dir.name, "cache.db"))
+
+    def tearDown(self):
+        self._disk.close()
+        self._dir.cleanup()
+
+    def test_get_put(self):
+        self._disk.put(("a", 1), [1, 2])
+        self._disk.put("gone", 1, timeout=-1)
+        self.assertEqual(self._disk.get(("a", 1)), [1, 2])
+        self.assertEqual(self._disk.get("gone"), None)
+        self.assertEqual(self._disk.purge_expired(), 1)
+        self._disk.invalidate(("a", 1))
+        self.assertEqual(len(self._disk), 0)
+
+    def test_snapshot(self):
+        cache = ExpiringLruCache(10, default_timeout=60)
+        cache.put("short", 1, timeout=0.1)
+        cache.put("long", 2)
+        dump_cache(cache, self._disk)
+        restored = ExpiringLruCache(10)
+        self.assertEqual(load_cache(restored, self._disk), 2)
+        self.assertEqual(restored.get("long"), 2)
+        self.assertLess(restored.data["short"][2], time.time() + 1)
+
+
+class BatchTestCase(unittest.TestCase):
+
+    def test_many(self):
+        for cache in (
+            LruCache(10),
+            ShardedLruCache(10, shards=2),
+            ExpiringLruCache(10, default_timeout=60),
+            ExpiringCache(60),
+        ):
+            cache.put_many({"a": 1, "b": 2, "c": 3})
+            self.assertEqual(cache.get_many(["a", "c", "d"]), {"a": 1, "c": 3})
+            cache.invalidate_many(["a", "d"])
+            self.assertEqual(cache.get_many(["a", "b"]), {"b": 2})
+            self.assertEqual(cache.get_many(k for k in "bc"), {"b": 2, "c": 3})
+
+    def test_expired(self):
+        cache = ExpiringLruCache(10)
+        cache.put_many({"a": 1, "b": 2}, timeout=-1)
+        self.assertEqual(cache.get_many(["a", "b"]), {})
+        self.assertEqual(cache.misses, 2)
+
+    def test_decorator(self):
+        calls = []
+
+        @batch_lru_cache(10)
+        def fetch(ids):
+            calls.append(ids)
+            return {i: i * 2 for i in ids if i != 3}
+
+        self.assertEqual(fetch([1, 2]), {1: 2, 2: 4})
+        self.assertEqual(fetch([2, 3, 4]), {2: 4, 4: 8})
+        self.assertEqual(calls, [[1, 2], [3, 4]])
+        self.assertEqual(fetch.__name__, "fetch")
+
+
+class RegistryTestCase(unittest.TestCase):
+
+    def test_cache_maker(self):
+        registry = CacheRegistry()
+        maker = CacheMaker(maxsize=10, registry=registry)
+
+        @maker.lrucache("double")
+        def double(x):
+            return x * 2
+
+        double(1)
+        double(1)
+        self.assertEqual(maker.names(), ["double"])
+        self.assertEqual(registry.names(), ["double"])
+        stats = maker.stats()["double"]
+        self.assertEqual((stats["hits"], stats["misses"], stats["loads"]), (1, 1, 1))
+
+    def test_emit(self):
+        gauges = {}
+
+        class Emitter(object):
+            def emit_store(self, key, value, *, tags=None):
+                gauges[(key, tags["cache"])] = value
+
+        @lru_cache(2)
+        def double(x):
+            return x * 2
+
+        registry = CacheRegistry()
+        registry.register("double", double)
+        for i in [1, 1, 2, 3, 1]:
+            double(i)
+        registry.emit(Emitter())
+        self.assertEqual(gauges[("cache.hit_ratio", "double")], 0.2)
+        self.assertEqual(gauges[("cache.size", "double")], 2)
+        self.assertIn(("cache.load_latency", "double"), gauges)
+        # rates are computed since the last snapshot
+        double(1)
+        self.assertEqual(registry.snapshot()["double"]["hit_ratio"], 1)
+
+
+class KeyBuilderTestCase(unittest.TestCase):
+
+    def test_normalized(self):
+        def func(a, b=2, *args, c=3, **kwargs):
+            pass
+
+        build = make_key_builder(func)
+        key = build((1, 2), {})
+        self.assertEqual(build((1,), dict(b=2)), key)
+        self.assertEqual(build((), dict(a=1, b=2)), key)
+        self.assertEqual(build((), dict(b=2, a=1)), key)
+        # defaults are not filled in
+        self.assertNotEqual(build((1,), {}), key)
+        self.assertNotEqual(build((1, 2, 3), {}), key)
+        self.assertEqual(build((1,), dict(c=3, d=4)), build((), dict(d=4, a=1, c=3)))
+        self.assertNotEqual(build((1,), dict(c=3)), build((1, 3), {}))
+        self.assertNotEqual(build((1,), dict(c=3)), build((1,), dict(d=3)))
+
+    def test_positional(self):
+        build = make_key_builder(lambda x, y=0: x)
+        self.assertEqual(build(("a",), {}), ("a",))
+        self.assertEqual(build((), dict(x="a")), ("a",))
+        # given twice, the call fails anyway
+        self.assertEqual(build(("a",), dict(x="b")), (("a",), frozenset([("x", "b")])))
+
+    def test_pickled_shapes(self):
+        def func(a, *, c=None, d=None):
+            pass
+
+        build = make_key_builder(func)
+        key = build((1,), dict(c=3))
+        # keys of TieredCache
+        self.assertEqual(pickle.loads(pickle.dumps(key)), key)
+        self.assertNotEqual(pickle.dumps(key), pickle.dumps(build((1,), dict(d=3))))
+
+    def test_single_argument_keywords(self):
+        @lru_cache(10)
+        def g(x):
+            return x
+
+        self.assertEqual(g(5), 5)
+        self.assertEqual(g(x=5), 5)
+        self.assertRaises(TypeError, g, _arg=5)
+        self.assertRaises(TypeError, g)
+        self.assertRaises(TypeError, g, 1, 2)
+
+    def test_unhashable_default(self):
+        calls = []
+
+        @lru_cache(10)
+        def f(a, opts={}):
+            calls.append(a)
+            return a
+
+        self.assertEqual(f(1), 1)
+        self.assertEqual(f(1), 1)
+        self.assertEqual(calls, [1])
+
+    def test_decorator(self):
+        calls = []
+
+        @lru_cache(10)
+        def add(a, b=0):
+            calls.append(a)
+            return a + b
+
+        self.assertEqual(add(1, 2), 3)
+        self.assertEqual(add(1, b=2), 3)
+        self.assertEqual(add(a=1, b=2), 3)
+        self.assertEqual(calls, [1])
+
+    def test_key_function(self):
+        @lru_cache(10, key=lambda user, request: user)
+        def profile(user, request):
+            return request
+
+        self.assertEqual(profile("bob", 1), 1)
+        self.assertEqual(profile("bob", 2), 1)
+
+    def test_ignore_unhashable_args(self):
+        @lru_cache(10, ignore_unhashable_args=True)
+        def first(items):
+            return items[0]
+
+        self.assertEqual(first([1]), 1)
+        self.assertRaises(TypeError, lru_cache(10)(first), [1])
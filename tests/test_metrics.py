@@ -0,0 +1,309 @@
+import os
+import queue
+import signal
+import threading
+import time
+import unittest
+from unittest import mock
+
+try:
+    from futile import metrics
+    from futile.metrics import MetricsEmitter, ThreadLocalMetrics, _PointBuffer
+except ImportError:
+    MetricsEmitter = None
+
+
+class _RecordingDB:
+    def __init__(self):
+        self.points = []
+
+    def write_points(self, points, time_precision=None):
+        self.points.extend(points)
+
+    def close(self):
+        pass
+
+
+@unittest.skipIf(MetricsEmitter is None, "influxdb is not installed")
+class TimerSketchTestCase(unittest.TestCase):
+
+    def test_one_point_per_interval(self):
+        db = _RecordingDB()
+        # flushed by hand
+        emitter = MetricsEmitter(db, "app", emit_interval=3600, timer_sketch=True)
+        for i in range(101):
+            emitter.emit_timer("latency", i + 1)
+        emitter.emit_counter("requests")
+        self.assertEqual(db.points, [])
+        emitter.flush_sketches()
+        (timer,) = db.points
+        self.assertEqual(timer["fields"]["count"], 101)
+        self.assertEqual(timer["fields"]["max"], 101)
+        emitter.emit_timer("latency", 5)
+        emitter.close()
+        timers = [p for p in db.points if p["tags"]["_type"] == "timer"]
+        self.assertEqual([p["fields"]["count"] for p in timers], [101, 1])
+
+    def test_flusher(self):
+        db = _RecordingDB()
+        emitter = MetricsEmitter(db, "app", emit_interval=0.05, timer_sketch=True)
+        for i in range(100):
+            emitter.emit_timer("latency", i + 1)
+        deadline = time.time() + 5
+        while not db.points and time.time() < deadline:
+            time.sleep(0.01)
+        emitter.close()
+        self.assertEqual(sum(p["fields"]["count"] for p in db.points), 100)
+
+
+@unittest.skipIf(MetricsEmitter is None, "influxdb is not installed")
+class ThreadLocalMetricsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._db = _RecordingDB()
+        emitter = MetricsEmitter(self._db, "app")
+        # flushed by hand
+        self._metrics = ThreadLocalMetrics(emitter, interval=3600)
+
+    def _by_type(self, type):
+        return [p for p in self._db.points if p["tags"]["_type"] == type]
+
+    def test_merge_threads(self):
+        metrics = self._metrics
+
+        def work():
+            for i in range(1000):
+                metrics.emit_counter("requests", tags={"code": 200})
+                metrics.emit_timer("latency", i + 1)
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        metrics.emit_store("queue", 5)
+        metrics.close()
+
+        (counter,) = self._by_type("counter")
+        self.assertEqual(counter["fields"]["_count"], 4000)
+        self.assertEqual(counter["tags"]["code"], 200)
+        (timer,) = self._by_type("timer")
+        self.assertEqual(timer["fields"]["count"], 4000)
+        self.assertEqual(timer["fields"]["max"], 1000)
+        for field in ("p50", "p90", "p99", "max", "sum"):
+            self.assertIsInstance(timer["fields"][field], float)
+        self.assertAlmostEqual(timer["fields"]["p99"], 990, delta=990 * 0.01)
+        (store,) = self._by_type("store")
+        self.assertEqual(store["fields"]["_value"], 5)
+
+    def test_grace_interval(self):
+        metrics = self._metrics
+        metrics.emit_counter("requests")
+        # swapped, but only written at the next flush
+        metrics.flush()
+        self.assertEqual(self._db.points, [])
+        metrics.emit_counter("requests", 2)
+        metrics.flush()
+        self.assertEqual([p["fields"]["_count"] for p in self._db.points], [1])
+        metrics.close()
+        self.assertEqual([p["fields"]["_count"] for p in self._db.points], [1, 2])
+
+    def test_fork(self):
+        metrics = self._metrics
+        db = self._db
+        # buffered by the parent, written by the parent only
+        metrics.emit_counter("requests", 1)
+        pid = os.fork()
+        if pid == 0:
+            metrics.interval = 0.05
+            metrics.emit_counter("requests", 2)
+            deadline = time.time() + 5
+            while not db.points and time.time() < deadline:
+                time.sleep(0.01)
+            counts = [p["fields"]["_count"] for p in db.points]
+            os._exit(0 if counts == [2] else 1)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.WEXITSTATUS(status), 0)
+        metrics.close()
+        self.assertEqual([p["fields"]["_count"] for p in db.points], [1])
+
+
+@unittest.skipIf(MetricsEmitter is None, "influxdb is not installed")
+class PointBufferTestCase(unittest.TestCase):
+
+    def test_blocks(self):
+        q = queue.Queue()
+        buffer = _PointBuffer(q, block_size=2, flush_interval=3600)
+        buffer.add("counter", ("requests",), {"timestamp": 1000})
+        buffer.add("counter", ("requests", 2, None, None, 1000), {})
+        buffer.add("store", ("queue", 5), {})
+        self.assertEqual(q.qsize(), 1)
+        buffer.flush()
+        self.assertEqual(q.qsize(), 2)
+
+        db = _RecordingDB()
+        emitter = MetricsEmitter(db, "app")
+        while not q.empty():
+            emitter.emit_packed(q.get())
+        emitter.close()
+        counters = [p for p in db.points if p["tags"]["_type"] == "counter"]
+        self.assertEqual([p["fields"]["_count"] for p in counters], [3])
+        (store,) = [p for p in db.points if p["tags"]["_type"] == "store"]
+        # stamped when added to the buffer
+        self.assertGreater(store["time"], 1000)
+
+    def test_reused_tags(self):
+        q = queue.Queue()
+        buffer = _PointBuffer(q, block_size=10, flush_interval=3600)
+        tags = {}
+        for code in (200, 404, 500):
+            tags["code"] = code
+            buffer.add("counter", ("requests", 1, tags), {})
+            buffer.add("any", (None,), {"tags": tags, "fields": tags})
+        buffer.flush()
+        block = q.get()
+        self.assertEqual(
+            [args[2]["code"] for _, args, _ in block[::2]], [200, 404, 500]
+        )
+        self.assertEqual(
+            [kwargs["fields"]["code"] for _, _, kwargs in block[1::2]], [200, 404, 500]
+        )
+
+    def test_fork_while_locked(self):
+        q = queue.Queue()
+        buffer = _PointBuffer(q, block_size=1, flush_interval=3600)
+        locked = threading.Event()
+        release = threading.Event()
+
+        def hold_lock():
+            with buffer._lock:
+                locked.set()
+                release.wait()
+
+        thread = threading.Thread(target=hold_lock)
+        thread.start()
+        locked.wait()
+        pid = os.fork()
+        if pid == 0:
+            buffer.add("counter", ("requests",), {})
+            os._exit(0 if q.qsize() == 1 else 1)
+        release.set()
+        thread.join()
+        deadline = time.time() + 5
+        while time.time() < deadline:
+            done, status = os.waitpid(pid, os.WNOHANG)
+            if done:
+                break
+            time.sleep(0.01)
+        else:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            self.fail("the child deadlocked")
+        self.assertEqual(os.WEXITSTATUS(status), 0)
+
+    def test_drop(self):
+        q = queue.Queue(maxsize=1)
+        buffer = _PointBuffer(q, block_size=1, flush_interval=3600, policy="drop")
+        for _ in range(3):
+            buffer.add("counter", ("requests",), {})
+        self.assertEqual(buffer.dropped, 2)
+        q.get()
+        buffer.add("counter", ("requests",), {})
+        (_, dropped) = q.get()
+        self.assertEqual(dropped[0], "store")
+        self.assertEqual(dropped[1][:2], ("metrics.dropped", 2))
+
+    def test_block_timeout(self):
+        q = queue.Queue(maxsize=1)
+        buffer = _PointBuffer(
+            q, block_size=1, flush_interval=3600, policy="block", block_timeout=0.01
+        )
+        # nobody consumes the queue
+        for _ in range(3):
+            buffer.add("counter", ("requests",), {})
+        self.assertEqual(buffer.dropped, 2)
+
+    def test_sample(self):
+        q = queue.Queue(maxsize=1)
+        buffer = _PointBuffer(
+            q, block_size=1, flush_interval=3600, policy="sample", sample_rate=0.25
+        )
+        buffer.add("counter", ("requests",), {})
+        buffer.add("counter", ("requests",), {})
+        self.assertEqual(buffer.dropped, 1)
+        q.get()
+        # two points skipped, the third kept
+        with mock.patch("random.random", side_effect=[0.5, 0.5, 0.1]):
+            for _ in range(3):
+                buffer.add("counter", ("requests",), {"count": 2})
+        self.assertEqual(buffer.sampled, 2)
+        (_, args, kwargs), _ = q.get()
+        self.assertEqual(kwargs["count"], 8)
+
+
+@unittest.skipIf(MetricsEmitter is None, "influxdb is not installed")
+class EmitLoopTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._saved = (metrics._metrics_queue, metrics._emitter, metrics._drain_timeout)
+
+    def tearDown(self):
+        metrics._metrics_queue, metrics._emitter, metrics._drain_timeout = self._saved
+
+    def test_drain_on_close(self):
+        db = _RecordingDB()
+        metrics._metrics_queue = q = queue.Queue()
+        metrics._emitter = MetricsEmitter(db, "app")
+        metrics._drain_timeout = 0.1
+        q.put([("counter", ("requests", 1, None, None, 1000), {})])
+        q.put(None)
+        # put after close(), by another producer
+        q.put([("counter", ("requests", 2, None, None, 1000), {})])
+        thread = threading.Thread(target=metrics._emit_loop)
+        thread.start()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual([p["fields"]["_count"] for p in db.points], [3])
+
+    def test_close_full_queue(self):
+        q = queue.Queue(maxsize=1)
+        q.put([])
+        buffer = _PointBuffer(q, flush_interval=3600)
+        with mock.patch.multiple(
+            metrics,
+            _metrics_queue=q,
+            _buffer=buffer,
+            _inited_pid=os.getpid(),
+            _drain_timeout=0.01,
+            _local=None,
+            _directly=False,
+            _emit_thread=None,
+        ):
+            # the emitter is gone, close() must not hang
+            metrics.close()
+        self.assertEqual(q.qsize(), 1)
+
+    def test_close_after_failing_block(self):
+        db = _RecordingDB()
+        metrics._metrics_queue = q = queue.Queue()
+        metrics._emitter = emitter = MetricsEmitter(db, "app")
+        metrics._drain_timeout = 0.1
+        emit_packed = emitter.emit_packed
+
+        def fail_once(block):
+            emitter.emit_packed = emit_packed
+            raise OSError("influxdb is down")
+
+        emitter.emit_packed = fail_once
+        q.put([("counter", ("requests", 1, None, None, 1000), {})])
+        q.put([("counter", ("requests", 2, None, None, 1000), {})])
+        q.put(None)
+        thread = threading.Thread(target=metrics._emit_loop)
+        thread.start()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual([p["fields"]["_count"] for p in db.points], [2])
+
+
+if __name__ == "__main__":
+    unittest.main()
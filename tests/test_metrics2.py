@@ -0,0 +1,76 @@
+import socket
+import unittest
+
+try:
+    from futile.metrics2 import AggregatingMetricsEmitter
+except ImportError:
+    AggregatingMetricsEmitter = None
+
+
+@unittest.skipIf(AggregatingMetricsEmitter is None, "statsd is not installed")
+class AggregatingMetricsEmitterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._server.bind(("127.0.0.1", 0))
+        self._server.settimeout(1)
+        port = self._server.getsockname()[1]
+        self._emitter = AggregatingMetricsEmitter(
+            "127.0.0.1",
+            port,
+            "app",
+            {"db": "spider"},
+            flush_interval=None,
+            mtu=100,
+            max_names=10,
+        )
+
+    def tearDown(self):
+        self._emitter.close()
+        self._server.close()
+
+    def _receive(self):
+        lines = []
+        try:
+            while True:
+                packet = self._server.recv(65536)
+                self.assertLessEqual(len(packet), 100)
+                lines.extend(packet.decode().split("\n"))
+        except socket.timeout:
+            return lines
+
+    def test_aggregate(self):
+        emitter = self._emitter
+        for _ in range(3):
+            emitter.emit_counter("requests", 1, tags={"code": 200})
+        emitter.emit_store("queue", 5)
+        emitter.emit_store("queue", 7)
+        emitter.emit_store("pending", 2, delta=True)
+        emitter.emit_store("pending", -3, delta=True)
+        for i in range(10):
+            emitter.emit_timer("latency", i)
+        emitter.flush()
+        lines = self._receive()
+        self.assertIn("app.requests,code=200,db=spider:3|c", lines)
+        self.assertIn("app.queue,db=spider:7|g", lines)
+        self.assertIn("app.pending,db=spider:-1|g", lines)
+        self.assertEqual(sum(1 for line in lines if "latency" in line), 10)
+        self.assertEqual(len(lines), 13)
+
+    def test_timer_sampling(self):
+        emitter = self._emitter
+        emitter._max_timer_samples = 5
+        for i in range(20):
+            emitter.emit_timer("latency", i)
+        emitter.flush()
+        lines = self._receive()
+        self.assertEqual(len(lines), 5)
+        self.assertTrue(all(line.endswith("|ms|@0.25") for line in lines))
+
+    def test_names_bounded(self):
+        emitter = self._emitter
+        for i in range(100):
+            emitter.emit_counter("requests", 1, tags={"user": i})
+        self.assertLessEqual(len(emitter._names.data), 10)
+        emitter.flush()
+        self.assertEqual(len(self._receive()), 100)
@@ -0,0 +1,38 @@
+import random
+import unittest
+
+from futile.sketch import DDSketch
+
+
+class DDSketchTestCase(unittest.TestCase):
+
+    def test_accuracy_after_merge(self):
+        values = [random.lognormvariate(3, 1) for _ in range(20000)]
+        sketches = [DDSketch(0.01) for _ in range(4)]
+        for i, value in enumerate(values):
+            sketches[i % 4].add(value)
+        merged = DDSketch(0.01)
+        for sketch in sketches:
+            merged.merge(sketch)
+        values.sort()
+        for q in (0.5, 0.9, 0.99):
+            exact = values[int(q * (len(values) - 1))]
+            self.assertAlmostEqual(merged.quantile(q), exact, delta=exact * 0.011)
+        self.assertEqual(merged.count, 20000)
+        self.assertEqual(merged.max, values[-1])
+
+    def test_zero_and_empty(self):
+        sketch = DDSketch()
+        self.assertIsNone(sketch.quantile(0.5))
+        sketch.add(0)
+        sketch.add(5)
+        self.assertEqual(sketch.quantile(0), 0)
+        self.assertAlmostEqual(sketch.quantile(1), 5, delta=0.05)
+        self.assertRaises(ValueError, sketch.merge, DDSketch(0.02))
+
+    def test_max_bins(self):
+        sketch = DDSketch(0.01, max_bins=100)
+        for i in range(1, 100000, 7):
+            sketch.add(i)
+        self.assertLessEqual(len(sketch.bins), 100)
+        self.assertAlmostEqual(sketch.quantile(0.99), 99000, delta=1000)
@@ -0,0 +1,189 @@
+import time
+import unittest
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from futile.cache.tiered import TieredCache, _NEGATIVE
+
+
+class _CountingRedis:
+    """Passes calls to a fakeredis client, counting them by command"""
+
+    def __init__(self, client):
+        self.client = client
+        self.calls = {}
+
+    def __getattr__(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        return getattr(self.client, name)
+
+
+@unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+class TieredCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._server = fakeredis.FakeServer()
+        self._client = _CountingRedis(self._make_client())
+        self._cache = TieredCache(self._client)
+
+    def _make_client(self):
+        return fakeredis.FakeStrictRedis(server=self._server)
+
+    def _server_keys(self):
+        return self._make_client().keys("*")
+
+    def _subscribe(self):
+        pubsub = self._make_client().pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self._cache.channel)
+        # the subscribe message
+        pubsub.get_message(timeout=0.1)
+        return pubsub
+
+    def _messages(self, pubsub):
+        messages = []
+        while True:
+            message = pubsub.get_message(timeout=0.1)
+            if message is None:
+                return messages
+            messages.append(message["data"].decode("utf-8"))
+
+    def test_hits(self):
+        cache = self._cache
+        cache.put("a", [1, 2])
+        self.assertEqual(cache.get("a"), [1, 2])
+        self.assertEqual((cache.l1_hits, cache.l2_hits), (1, 0))
+        self.assertEqual(self._client.calls.get("get", 0), 0)
+
+        # another process, L1 is empty
+        other = TieredCache(self._make_client())
+        self.assertEqual(other.get("a"), [1, 2])
+        self.assertEqual(other.get("a"), [1, 2])
+        self.assertEqual((other.l1_hits, other.l2_hits), (1, 1))
+
+    def test_negative(self):
+        cache = self._cache
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("a", 0), 0)
+        self.assertEqual(self._client.calls["get"], 1)
+        self.assertEqual((cache.negative_hits, cache.misses), (1, 2))
+        # not stored in Redis
+        self.assertEqual(self._server_keys(), [])
+
+    def test_get_many(self):
+        cache = self._cache
+        cache.put("a", 1)
+        other = TieredCache(self._make_client())
+        other.put("b", 2)
+        self.assertEqual(cache.get_many(["a", "b", "c"]), dict(a=1, b=2))
+        self.assertEqual(self._client.calls["mget"], 1)
+        self.assertEqual((cache.l1_hits, cache.l2_hits, cache.misses), (1, 1, 1))
+        # b and the miss of c are now in L1
+        self.assertEqual(cache.get_many(["b", "c"]), dict(b=2))
+        self.assertEqual(self._client.calls["mget"], 1)
+
+    def test_put_many(self):
+        cache = self._cache
+        pubsub = self._subscribe()
+        cache.put_many(dict(a=1, b=2))
+        self.assertEqual(self._client.calls["pipeline"], 1)
+        self.assertEqual(len(self._messages(pubsub)), 2)
+        other = TieredCache(self._make_client())
+        self.assertEqual(other.get_many(["a", "b"]), dict(a=1, b=2))
+        cache.invalidate_many(["a", "b"])
+        self.assertEqual(self._client.calls["pipeline"], 2)
+        self.assertEqual(self._server_keys(), [])
+        pubsub.close()
+
+    def test_l1_timeout(self):
+        cache = TieredCache(self._client, l1_timeout=60)
+        cache.put("a", 1, timeout=1)
+        cache.put_many(dict(b=2), timeout=1)
+        cache.put("c", 3)
+        for key in ("a", "b"):
+            # not kept in L1 after it expired from Redis
+            self.assertLessEqual(
+                cache.l1.get_entry(cache._redis_key(key))[1], time.time() + 1
+            )
+        self.assertGreater(
+            cache.l1.get_entry(cache._redis_key("c"))[1], time.time() + 1
+        )
+
+    def test_publish(self):
+        cache = self._cache
+        pubsub = self._subscribe()
+        cache.put("a", 1)
+        cache.invalidate("a")
+        cache.clear()
+        origin = cache._origin
+        rkey = cache._redis_key("a")
+        self.assertEqual(
+            self._messages(pubsub),
+            ["%s %s" % (origin, rkey), "%s %s" % (origin, rkey), "%s *" % origin],
+        )
+        pubsub.close()
+
+    def test_handle_message(self):
+        cache = self._cache
+        other = TieredCache(self._make_client())
+        cache.put("a", 1)
+        other.get("a")
+        rkey = cache._redis_key("a")
+        # our own message, L1 is already up to date
+        cache._handle_message(("%s %s" % (cache._origin, rkey)).encode("utf-8"))
+        self.assertEqual(cache.l1.get(rkey), 1)
+        other._handle_message(("%s %s" % (cache._origin, rkey)).encode("utf-8"))
+        self.assertIsNone(other.l1.get(rkey))
+
+    def test_clear(self):
+        cache = self._cache
+        cache.put("a", 1)
+        cache.put(("b", 2), 2)
+        self._make_client().set("other", 3)
+        cache.clear()
+        self.assertEqual(self._server_keys(), [b"other"])
+        self.assertIsNone(cache.l1.get(cache._redis_key("a")))
+        self.assertIsNone(cache.get(("b", 2)))
+
+    def test_invalidated_while_reading(self):
+        cache = self._cache
+        other = TieredCache(self._make_client())
+        other.put("a", 1)
+        rkey = cache._redis_key("a")
+        get = self._client.client.get
+
+        def put_meanwhile(key):
+            raw = get(key)
+            other.put("a", 2)
+            cache._handle_message("%s %s" % (other._origin, rkey))
+            return raw
+
+        self._client.client.get = put_meanwhile
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.l1.get(rkey))
+        self._client.client.get = get
+        self.assertEqual(cache.get("a"), 2)
+
+    def test_invalidated_while_reading_missing(self):
+        cache = self._cache
+        other = TieredCache(self._make_client())
+        rkey = cache._redis_key("a")
+        mget = self._client.client.mget
+
+        def put_meanwhile(keys):
+            raws = mget(keys)
+            other.put("a", 1)
+            cache._handle_message("%s %s" % (other._origin, rkey))
+            return raws
+
+        self._client.client.mget = put_meanwhile
+        self.assertEqual(cache.get_many(["a"]), {})
+        self.assertIsNot(cache.l1.get(rkey), _NEGATIVE)
+        self._client.client.mget = mget
+        self.assertEqual(cache.get_many(["a"]), dict(a=1))
+
+
+if __name__ == "__main__":
+    unittest.main()